@@ -0,0 +1,56 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Measure the time taken by ``stats.analytics`` on random scores, with NumPy
+(if it's installed) and in pure Python, on list and columnar stores. Run it
+with ``python benchmarks/analytics.py [count ...]``; the default counts are
+10⁵ and 10⁶.
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+import random
+from os.path import dirname
+
+sys.path.insert(0, dirname(__file__) + '/..')
+
+from rogue_scores.web.store import Score, ScoreColumns
+from rogue_scores.web import stats
+
+MONSTERS = ['bat', 'kestrel', 'orc', 'centaur', 'dragon', 'troll', 'ur']
+STATUSES = ['killed', 'killed', 'killed', 'quit', 'died']
+
+
+def random_scores(count):
+    rnd = random.Random(42)
+    scores = [Score(user='user%d' % rnd.randint(1, 1000),
+                    score=rnd.randint(1, 5000), level=rnd.randint(1, 26),
+                    cause=rnd.choice(MONSTERS), status=rnd.choice(STATUSES))
+              for _ in range(count)]
+    scores.sort(key=Score.sort_key)
+    return scores
+
+
+def timing(fn, *args):
+    start = time.time()
+    fn(*args)
+    return time.time() - start
+
+
+def main(counts):
+    print('%-10s %-8s %-8s %10s' % ('scores', 'store', 'numpy', 'seconds'))
+    for count in counts:
+        scores = random_scores(count)
+        columns = ScoreColumns(scores)
+        for name, store in (('list', scores), ('columns', columns)):
+            for use_numpy in (False, True):
+                if use_numpy and stats.numpy is None:
+                    continue
+                t = timing(stats.analytics, store, use_numpy)
+                print('%-10d %-8s %-8s %10.3f' % (count, name, use_numpy, t))
+
+
+if __name__ == '__main__':
+    main([int(c) for c in sys.argv[1:]] or [10 ** 5, 10 ** 6])
@@ -0,0 +1,83 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Compare the memory used by ``Score`` objects with the previous dict-based
+implementation, and with a ``ScoreColumns``. Run it with
+``python benchmarks/memory.py [count]``.
+
+Requires Python 3.4+ for ``tracemalloc``.
+"""
+
+from __future__ import print_function
+
+import sys
+import tracemalloc
+from os.path import dirname
+
+sys.path.insert(0, dirname(__file__) + '/..')
+
+from rogue_scores.web.store import Score, ScoreColumns
+
+USERS = ['baptiste', 'foo', 'bar', 'qux', 'moo']
+CAUSES = ['bat', 'centaur', 'hobgoblin', 'kestrel', 'rattlesnake']
+
+
+class DictScore(object):
+    """
+    The ``Score`` implementation of version 0.0.9
+    """
+    def __init__(self, **kwargs):
+        self.level = self.score = 0
+        self.user = self.cause = self.status = None
+        self.__dict__.update(kwargs)
+
+
+def attrs(i):
+    return {'user': USERS[i % len(USERS)], 'score': i, 'level': i % 26,
+            'cause': CAUSES[i % len(CAUSES)], 'status': 'killed'}
+
+
+def measure(cls, count):
+    """
+    Return the number of bytes allocated per score for ``count`` scores
+    """
+    # build the attributes dicts first so we only measure the scores
+    data = [attrs(i) for i in range(count)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    scores = [cls(**d) for d in data]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(scores) == count
+    return (after - before) / float(count)
+
+
+def measure_columns(count):
+    """
+    Return the number of bytes allocated per score in a ``ScoreColumns`` of
+    ``count`` scores
+    """
+    scores = [Score(**attrs(i)) for i in range(count)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    columns = ScoreColumns(scores)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(columns) == count
+    return (after - before) / float(count)
+
+
+def main(count):
+    old = measure(DictScore, count)
+    new = measure(Score, count)
+    cols = measure_columns(count)
+    print('%d scores' % count)
+    print('dict-based Score: %6.1f bytes/score' % old)
+    print('slots Score:      %6.1f bytes/score' % new)
+    print('savings:          %6.1f bytes/score (%.0f%%)'
+          % (old - new, 100 * (old - new) / old))
+    print('ScoreColumns:     %6.1f bytes/score' % cols)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
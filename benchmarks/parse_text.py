@@ -0,0 +1,97 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Measure the throughput of ``parse_text`` in texts per second, compared with
+the implementation of version 0.0.9. Run it with
+``python benchmarks/parse_text.py [count]``.
+"""
+
+from __future__ import print_function
+
+import re
+import sys
+import time
+from os.path import dirname
+
+sys.path.insert(0, dirname(__file__) + '/..')
+
+from rogue_scores.web.store import parse_text, parse_texts
+
+TEXTS = [
+    'killed on level 3 by a bat.',
+    'killed on level 8 by a centaur.',
+    'killed on level 5 by a kestrel.',
+    'killed by a dragon on level 24',
+    'quit on level 9.',
+    'died of starvation on level 5',
+    'killed on level 3 by hypothermia.',
+]
+
+
+def parse_text_old(text):
+    """
+    ``parse_text`` from version 0.0.9
+    """
+    text = text.strip().lower()
+    attrs = {}
+    m = re.match(r'.* on level (\d+).*', text)
+    if m:
+        attrs['level'] = int(m.groups(1)[0])
+
+    if text.startswith('quit'):
+        attrs['status'] = 'quit'
+        return attrs
+
+    m = re.match(r'died of ([a-z]+).*', text)
+    if m:
+        attrs['cause'] = m.groups(1)[0]
+        attrs['status'] = 'died'
+        return attrs
+
+    if text.startswith('killed '):
+        m = re.match('.* by an? ([a-z]+).*', text)
+        if m:
+            attrs['cause'] = m.groups(1)[0]
+            attrs['status'] = 'killed'
+            return attrs
+
+        m = re.match('.* by ([a-z]+).*', text)
+        if m:
+            attrs['cause'] = m.groups(1)[0]
+            attrs['status'] = 'died'
+            return attrs
+
+    if text.startswith('won '):
+        attrs['status'] = 'won'
+
+    return attrs
+
+
+def rate(fn, texts):
+    start = time.time()
+    fn(texts)
+    return len(texts) / (time.time() - start)
+
+
+def main(count):
+    repeated = [TEXTS[i % len(TEXTS)] for i in range(count)]
+    # distinct texts, which are never found in the cache
+    unique = ['%s %d' % (TEXTS[i % len(TEXTS)], i) for i in range(count)]
+    # long texts, where leading '.*' patterns backtrack
+    long_texts = ['killed on level 3 by a bat' + ' x' * 500 + str(i)
+                  for i in range(count // 100)]
+
+    each = lambda f: lambda texts: [f(t) for t in texts]
+
+    print('%d texts, in texts/second' % count)
+    print('%-16s %12s %12s %12s' % ('', 'repeated', 'distinct', 'long'))
+    for name, fn in (('0.0.9', each(parse_text_old)),
+                     ('parse_text', each(parse_text)),
+                     ('parse_texts', parse_texts)):
+        print('%-16s %12d %12d %12d' % (name, rate(fn, repeated),
+                                        rate(fn, unique),
+                                        rate(fn, long_texts)))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
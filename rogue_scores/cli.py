@@ -3,15 +3,22 @@ from __future__ import print_function
 
 """
 This module defines the endpoint used to provide the ``rogue_scores`` script.
+
+The script remembers the scores it uploaded to each server in a ledger file,
+and only sends the new ones. Use ``--full`` to send all of them again. It
+also remembers the servers which accept gzip-compressed uploads, so that
+they're compressed from the first upload of the next runs.
 """
 
 import sys
+import json
+import hashlib
 import platform
 import os
 import os.path
 import argparse
 from . import __version__
-from .upload import post_scores
+from .upload import post_scores, accepts_gzip
 from .scores import get_scores
 
 if platform.python_version() < '3.0':
@@ -20,6 +27,8 @@ else:
     import urllib.parse as urlparse
 
 SERVER_FILE = os.path.expanduser('~/.rogue-scores-server')
+LEDGER_FILE = os.path.expanduser('~/.rogue-scores-ledger')
+GZIP_FILE = os.path.expanduser('~/.rogue-scores-gzip')
 
 
 def set_server():
@@ -49,9 +58,83 @@ def set_server():
         f.write('%s' % u.netloc)
 
 
+def score_hash(score):
+    """
+    Return a hash of a score, as stored in the ledger file.
+
+    .. versionadded:: 0.1.0
+    """
+    return hashlib.sha1(json.dumps(score).encode('utf-8')).hexdigest()
+
+
+def read_ledger(server):
+    """
+    Return the set of the hashes of the scores uploaded to a server, as
+    stored in the ledger file. An empty set is returned if the file doesn't
+    exist or can't be read.
+
+    .. versionadded:: 0.1.0
+    """
+    try:
+        with open(LEDGER_FILE) as f:
+            ledger = json.load(f)
+        return set(ledger.get(server, []))
+    except (IOError, OSError, ValueError, AttributeError):
+        return set()
+
+
+def write_ledger(server, hashes):
+    """
+    Set the hashes of the scores uploaded to a server in the ledger file.
+    Other servers' hashes are kept.
+
+    .. versionadded:: 0.1.0
+    """
+    try:
+        with open(LEDGER_FILE) as f:
+            ledger = json.load(f)
+        if not isinstance(ledger, dict):
+            ledger = {}
+    except (IOError, OSError, ValueError):
+        ledger = {}
+
+    ledger[server] = sorted(hashes)
+    with open(LEDGER_FILE, 'w') as f:
+        json.dump(ledger, f)
+
+
+def read_gzip_servers():
+    """
+    Return the set of the servers known to accept gzip-compressed uploads.
+    An empty set is returned if the file doesn't exist or can't be read.
+
+    .. versionadded:: 0.1.0
+    """
+    try:
+        with open(GZIP_FILE) as f:
+            return set(json.load(f))
+    except (IOError, OSError, ValueError, TypeError):
+        return set()
+
+
+def add_gzip_server(server):
+    """
+    Remember that a server accepts gzip-compressed uploads
+
+    .. versionadded:: 0.1.0
+    """
+    servers = read_gzip_servers()
+    servers.add(server)
+    with open(GZIP_FILE, 'w') as f:
+        json.dump(sorted(servers), f)
+
+
 def parse_args():
     parser = argparse.ArgumentParser(description='Rogue scores uploader')
     parser.add_argument('--version', action='store_true')
+    parser.add_argument('--full', action='store_true',
+                        help='send all the scores, even the ones which have '
+                             'already been sent')
     return parser.parse_args()
 
 
@@ -78,9 +161,29 @@ def run():
         # this 'return' is here for tests where sys.exit is a mock
         return sys.exit(1)
 
-    if post_scores(scs, target=server):
+    # only the hashes of the current scores are kept, so that the ledger
+    # doesn't grow as old scores are pushed out of the local top 10
+    hashes = [score_hash(s) for s in scs]
+    sent = set() if args.full else read_ledger(server)
+    new = [s for s, h in zip(scs, hashes) if h not in sent]
+
+    if not new:
+        print("All the scores have already been sent.")
+        return
+
+    kwargs = {'target': server}
+    gzip = server in read_gzip_servers()
+    if gzip:
+        kwargs['gzip'] = True
+
+    ok = post_scores(new, **kwargs)
+    if not gzip and accepts_gzip(server):
+        add_gzip_server(server)
+
+    if ok:
+        write_ledger(server, hashes)
         print("Scores posted with success!")
     else:
         print("An error occurred.", file=sys.stderr)
-        print("I tried to send %d scores to '%s'." % (len(scs), server))
+        print("I tried to send %d scores to '%s'." % (len(new), server))
         sys.exit(2)
@@ -0,0 +1,22 @@
+# -*- coding: UTF-8 -*-
+
+"""
+This module provides the gzip helpers shared by the upload script and the Web
+server.
+
+.. versionadded:: 0.1.0
+"""
+
+import zlib
+
+# bodies smaller than this number of bytes are not compressed
+GZIP_MIN_SIZE = 1024
+
+
+def gzip_compress(body, level=6):
+    """
+    Return a body compressed in the gzip format
+    """
+    # 16 + MAX_WBITS tells zlib to write a gzip header and trailer
+    c = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return c.compress(body) + c.flush()
@@ -2,11 +2,113 @@
 
 """
 This module provides tools to upload Rogue scores to a remote server.
+
+Scores are uploaded with an ``Uploader``, which keeps its HTTP connections
+open between uploads, retries failed ones and compresses them when the server
+supports it.
 """
 
 import json
+import time
+import random
 import requests
 from . import __version__
+from .compression import gzip_compress, GZIP_MIN_SIZE
+
+# connect and read timeouts, in seconds
+TIMEOUT = (3.05, 10)
+
+# number of times a failed upload is retried
+RETRIES = 3
+
+# base delay between two attempts, in seconds. It's doubled after each one.
+BACKOFF = 0.5
+
+# HTTP statuses of the responses after which an upload is retried
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+class Uploader(object):
+    """
+    An uploader of scores, based on a ``requests.Session`` so that
+    connections are kept alive between uploads.
+
+    Uploads which fail because of a connection error, a timeout or a server
+    error are retried at most ``retries`` times, with an exponential backoff
+    with jitter: the n-th retry is made after a random delay between ``0``
+    and ``backoff * 2 ** (n - 1)`` seconds. The server ignores the scores it
+    already has, so retrying an upload which succeeded is harmless.
+
+    Servers which advertise their support of gzip-compressed uploads with an
+    ``Accept-Encoding`` response header are added to ``gzip_targets``, and
+    are sent compressed JSON bodies for the following uploads. Others are
+    sent form data. ``gzip_targets`` can be saved between runs, see
+    ``rogue_scores.cli``.
+
+    .. versionadded:: 0.1.0
+    """
+
+    def __init__(self, timeout=TIMEOUT, retries=RETRIES, backoff=BACKOFF,
+                 session=None):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = session or requests.Session()
+        self.session.headers['User-Agent'] = 'Rogue-scores v%s' % __version__
+        # targets which accept gzip-compressed bodies
+        self.gzip_targets = set()
+
+    def post(self, scores, target='localhost:5000', protocol='http'):
+        """
+        Post some scores to a remote server and return a boolean depending
+        on the request's success
+        """
+        url = u'%s://%s/scores' % (protocol, target)
+        kwargs = self._body(scores, target)
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self._delay(attempt))
+            try:
+                r = self.session.post(url, timeout=self.timeout,
+                                      allow_redirects=True, **kwargs)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout):
+                continue
+
+            if 'gzip' in r.headers.get('Accept-Encoding', ''):
+                self.gzip_targets.add(target)
+            if r.status_code in RETRY_STATUSES:
+                continue
+
+            try:
+                return r.status_code == 200 and r.text.strip() == 'ok'
+            except ValueError:
+                return False
+
+        return False
+
+    def _body(self, scores, target):
+        """
+        Return the keyword arguments of the request used to post some scores
+        to a target
+        """
+        body = json.dumps(scores)
+        if target in self.gzip_targets and len(body) >= GZIP_MIN_SIZE:
+            return {'data': gzip_compress(body.encode('utf-8')),
+                    'headers': {'Content-Type': 'application/json',
+                                'Content-Encoding': 'gzip'}}
+        return {'data': {'scores': body}}
+
+    def _delay(self, attempt):
+        """
+        Return the delay before an attempt, in seconds
+        """
+        return random.uniform(0, self.backoff * 2 ** (attempt - 1))
+
+
+# uploader used by post_scores, created on the first call
+_uploader = None
 
 
 def post_scores(scores, **kwargs):
@@ -18,19 +120,27 @@ def post_scores(scores, **kwargs):
     Keyword arguments:
             - ``protocol`` (``string``, default: ``http``)
             - ``target`` (``string``, default: ``localhost:5000``)
+            - ``gzip`` (``bool``, default: ``False``): if true, the target is
+              known to accept gzip-compressed uploads
+
+    The scores are posted with an ``Uploader`` shared by all the calls.
     """
-    url = u'%s://%s/scores' % (kwargs.get('protocol', 'http'),
-                               kwargs.get('target', 'localhost:5000'))
-
-    payload = {'scores': json.dumps(scores)}
-    headers = {'User-Agent': 'Rogue-scores v%s' % __version__}
-    try:
-        r = requests.post(url, data=payload, headers=headers,
-                          allow_redirects=True)
-    except requests.exceptions.ConnectionError:
-        return False
+    global _uploader
 
-    try:
-        return r.status_code == 200 and r.text.strip() == 'ok'
-    except ValueError:
-        return False
+    if _uploader is None:
+        _uploader = Uploader()
+    if kwargs.get('gzip'):
+        _uploader.gzip_targets.add(kwargs.get('target', 'localhost:5000'))
+    return _uploader.post(scores,
+                          target=kwargs.get('target', 'localhost:5000'),
+                          protocol=kwargs.get('protocol', 'http'))
+
+
+def accepts_gzip(target):
+    """
+    Test if a target advertised its support of gzip-compressed uploads in a
+    response to ``post_scores``
+
+    .. versionadded:: 0.1.0
+    """
+    return _uploader is not None and target in _uploader.gzip_targets
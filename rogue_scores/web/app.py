@@ -4,31 +4,279 @@
 This is a Web server for an online Rogue leaderboard. This is a Flask
 application with a couple helpers to parse POST'ed scores.
 
-There's currently no limit on the number of scores to store, and these are
-stored in a local JSON file. You can set the directory used for this file (by
-default it's the current one) with ``ROGUE_SCORES_PATH``.
+Scores are stored in a local JSON file. You can set the directory used for this
+file (by default it's the current one) with ``ROGUE_SCORES_PATH``. There's no
+limit on the number of scores to store unless ``ROGUE_SCORES_KEEP`` is set:
+only this number of best scores is then kept, plus the
+``ROGUE_SCORES_KEEP_PER_USER`` best scores of each user if it's set. Set
+``ROGUE_SCORES_JOURNAL`` to a non-empty value to append new scores to a journal
+file instead of rewriting the whole file on each upload.
+
+``POST /scores`` takes the scores as a JSON array in the ``scores`` form
+field, or as the request body with the ``application/json`` or
+``application/x-ndjson`` (one score per line) content types. Bodies are parsed
+incrementally and added by batches of 1000 scores, and the scores file is
+saved every 100000 scores and at the end of the upload. These bodies can be
+compressed with ``Content-Encoding: gzip``, which ``/scores`` responses
+advertise with an ``Accept-Encoding`` header.
+
+Recently uploaded scores and ``scores`` form fields are remembered, up to
+``ROGUE_SCORES_SEEN_SIZE`` of each (default: 10000), so that uploading them
+again doesn't touch the store.
+
+Uploads received within ``ROGUE_SCORES_COMMIT_WINDOW`` seconds (default:
+0.01) are saved at once. Writes are serialized between processes with a lock
+file, so the server can run with multiple workers.
+
+Set ``ROGUE_SCORES_BACKEND`` to ``sqlite`` to store the scores in a SQLite
+database in the same directory instead of a JSON file, or to ``binary`` to use
+a memory-mapped binary file (see ``rogue_scores.web.binstore``). With JSON and
+binary files, set ``ROGUE_SCORES_COLUMNAR`` to a non-empty value to keep the
+scores in memory in columns, which uses less memory per worker.
+
+``GET /scores`` returns all the scores, unless one of the ``limit``, ``offset``
+or ``cursor`` parameters is given: it then returns a page of scores, and the
+cursor of the next one in the ``X-Next-Cursor`` header, with a ``Link`` header
+to get it.
+
+Scores are timestamped when they're uploaded. The index page shows the best
+scores of the last day, week or month with ``window=day``, ``week`` or
+``month``, and ``GET /scores?since=<timestamp>`` returns the scores uploaded
+since the given UNIX timestamp.
+
+The index page shows the ``count`` best scores (default: 20), up to
+``ROGUE_SCORES_MAX_COUNT`` (default: 1000), starting at ``offset``, with a link
+to the next ones. It's rendered and sent in chunks.
+
+The rendered index page and ``GET /scores`` responses are cached in memory
+along with gzip-compressed copies, up to ``ROGUE_SCORES_CACHE_SIZE`` bytes
+(default: 16MB), until the scores change. Responses bigger than a quarter of
+this size aren't cached, and concurrent requests for the same uncached
+response don't all buffer it.
+
+``GET /stats`` returns detailed stats on the scores, see
+``rogue_scores.web.stats.analytics``.
 """
 
 import os
 import json
+import zlib
+import codecs
+import time
+import base64
 import logging
-from flask import Flask, Response, render_template, request
+import threading
+import itertools
+from calendar import timegm
+from flask import Flask, Response, abort, render_template, request, \
+    stream_with_context, url_for
 from logging import FileHandler
 
 from . import stats
-from .store import ScoresStore
+from .cache import ResponseCache, RecentSet, GzipReader, fingerprint
+from .store import open_store, normalize_score, iter_json, iter_ndjson, \
+    BadScoreFormatException, CommitQueue, WINDOWS
 
 app = Flask(__name__)
 
 app.config['DEBUG'] = True
 
+app.config['SCORES_BACKEND'] = os.environ.get('ROGUE_SCORES_BACKEND', 'json')
 app.config['SCORES'] = os.environ.get('ROGUE_SCORES_PATH', '.') \
-    + '/_rogue-scores.json'
+    + {'sqlite': '/_rogue-scores.db', 'binary': '/_rogue-scores.bin'}.get(
+        app.config['SCORES_BACKEND'], '/_rogue-scores.json')
+app.config['SCORES_JOURNAL'] = bool(os.environ.get('ROGUE_SCORES_JOURNAL'))
+app.config['SCORES_COLUMNAR'] = bool(os.environ.get('ROGUE_SCORES_COLUMNAR'))
+# retention policy, None means no limit
+app.config['SCORES_KEEP'] = \
+    int(os.environ.get('ROGUE_SCORES_KEEP') or 0) or None
+app.config['SCORES_KEEP_PER_USER'] = \
+    int(os.environ.get('ROGUE_SCORES_KEEP_PER_USER') or 0) or None
+# default number of scores per page of GET /scores
+app.config['SCORES_PAGE_SIZE'] = 100
+# maximal number of scores shown at once on the index page
+app.config['SCORES_MAX_COUNT'] = \
+    int(os.environ.get('ROGUE_SCORES_MAX_COUNT', 1000))
+# maximal size of the responses cache, in bytes
+app.config['SCORES_CACHE_SIZE'] = \
+    int(os.environ.get('ROGUE_SCORES_CACHE_SIZE', 16 * 1024 * 1024))
+# number of recently uploaded scores and payloads remembered to skip them
+app.config['SCORES_SEEN_SIZE'] = \
+    int(os.environ.get('ROGUE_SCORES_SEEN_SIZE', 10000))
+# number of scores of a JSON upload added to the store at once
+app.config['SCORES_UPLOAD_BATCH'] = 1000
+# number of scores of a JSON upload added to the store between two saves
+app.config['SCORES_UPLOAD_SAVE_EVERY'] = 100000
+# uploads received within this number of seconds are saved at once
+app.config['SCORES_COMMIT_WINDOW'] = \
+    float(os.environ.get('ROGUE_SCORES_COMMIT_WINDOW', 0.01))
+
+# number of template parts rendered before a chunk of a page is sent
+TEMPLATE_BUFFER = 64
 
 app.logger.setLevel(logging.DEBUG)
 app.logger.addHandler(FileHandler('rogue_scores.log'))
 
 
+# stores shared by all the requests handled by this process, by path
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(reload=True):
+    """
+    Return the scores store, as configured in the app. The store is loaded
+    once per process, and reloaded only when its file has been modified on
+    disk since, e.g. by another worker, unless ``reload`` is false.
+    """
+    path = app.config['SCORES']
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = \
+                open_store(path, journal=app.config['SCORES_JOURNAL'],
+                           columnar=app.config['SCORES_COLUMNAR'],
+                           keep=app.config['SCORES_KEEP'],
+                           keep_per_user=app.config['SCORES_KEEP_PER_USER'])
+        elif reload and store.is_stale():
+            app.logger.debug("Reloading the scores")
+            store.reload()
+        return store
+
+
+def commit_scores(scores):
+    """
+    Add scores to the store and save it. This is called by ``commits`` with
+    the scores of all the uploads received at the same time.
+    """
+    store = get_store()
+    with _stores_lock:
+        ct = store.add(*scores)
+        store.save()
+    if ct:
+        # cached responses of the previous version are useless now
+        cache.clear()
+    return ct
+
+
+commits = CommitQueue(commit_scores)
+
+# rendered responses, by version of the store and request variant
+cache = ResponseCache(app.config['SCORES_CACHE_SIZE'])
+
+# fingerprints of the scores and upload payloads which have been committed.
+# Their hits count the scores and payloads which have been skipped.
+seen_scores = RecentSet(app.config['SCORES_SEEN_SIZE'])
+seen_payloads = RecentSet(app.config['SCORES_SEEN_SIZE'])
+
+
+def unseen_scores(scores):
+    """
+    Return a list of ``(fingerprint, score)`` tuples for the normalized
+    scores which haven't been committed recently
+    """
+    new = []
+    for s in scores:
+        fp = fingerprint(s)
+        if fp not in seen_scores:
+            new.append((fp, s))
+    return new
+
+
+def submit_scores(scores):
+    """
+    Submit normalized scores to ``commits``, skipping the ones which have
+    been committed recently. Return the number of submitted scores.
+    """
+    new = unseen_scores(scores)
+    if not new:
+        return 0
+
+    commits.submit([s for _, s in new],
+                   window=app.config['SCORES_COMMIT_WINDOW'])
+    for fp, _ in new:
+        seen_scores.add(fp)
+    return len(new)
+
+
+def cache_variant():
+    """
+    Return the key of the current request's variant in the responses cache
+    """
+    return (request.path, request.query_string, request.headers.get('Host'))
+
+
+def cached_response(cached, mimetype):
+    """
+    Return a response for a ``CachedBody``, compressed if the client accepts
+    it
+    """
+    if cached.gzipped is not None and 'gzip' in request.accept_encodings:
+        resp = Response(cached.gzipped, 200, mimetype=mimetype)
+        resp.headers['Content-Encoding'] = 'gzip'
+    else:
+        resp = Response(cached.body, 200, mimetype=mimetype)
+    resp.headers['Vary'] = 'Accept-Encoding'
+    return resp
+
+
+def not_modified(store):
+    """
+    Return a ``304 Not Modified`` response if the client already has the
+    current version of the scores, according to the ``If-None-Match`` or
+    ``If-Modified-Since`` headers of the request, or ``None``. The store's
+    version is read from its files, so this doesn't load any score. The
+    ``ETag`` is preferred when both headers are given.
+    """
+    version = store.disk_version
+    if request.if_none_match:
+        if not request.if_none_match.contains_weak(version):
+            return None
+    elif request.if_modified_since:
+        mtime = store.last_modified
+        if mtime is None or int(mtime) > timegm(
+                request.if_modified_since.utctimetuple()):
+            return None
+    else:
+        return None
+
+    resp = Response(status=304)
+    return add_validators(resp, store, version)
+
+
+def add_validators(resp, store, version=None):
+    """
+    Add the ``ETag`` and ``Last-Modified`` headers of the store's version to
+    a response, and return it. The version is the one of the loaded scores
+    unless it's given.
+
+    The ``ETag`` is weak because the same one is sent for the identity and
+    gzip-compressed bodies. ``Last-Modified`` has a one-second resolution, so
+    it's omitted while the store may still be modified within the second of
+    its last modification: a client could otherwise miss this change. It's
+    also omitted if the files have been modified since the scores were
+    loaded, since it would then be the date of a newer version.
+    """
+    version = version or store.version
+    resp.set_etag(version, weak=True)
+    mtime = store.last_modified
+    if mtime is not None and int(mtime) < int(time.time()) \
+            and version == store.disk_version:
+        resp.last_modified = int(mtime)
+    return resp
+
+
+def stream_template(name, **context):
+    """
+    Render a template in chunks of text, as an iterator which can be used as
+    the body of a streamed response
+    """
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(name).stream(context)
+    stream.enable_buffering(TEMPLATE_BUFFER)
+    return stream_with_context(stream)
+
+
 @app.route("/")
 def index():
     count = request.args.get('count')
@@ -36,32 +284,282 @@ def index():
         count = max(int(count), 1)
     except:
         count = 20  # default
-    store = ScoresStore(app.config['SCORES'])
-    return render_template('main.html',
-                           scores=store.get(count),
-                           hostname=request.headers.get('Host'),
-                           stats=stats.stats(store))
+    count = min(count, app.config['SCORES_MAX_COUNT'])
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        offset = 0
+
+    # the scores of a window also change when old ones leave it
+    window = request.args.get('window')
+    if window not in WINDOWS:
+        window = None
+        resp = not_modified(get_store(reload=False))
+        if resp is not None:
+            return resp
+
+    store = get_store()
+    version = store.version
+    variant = cache_variant()
+    cached = None if window else cache.get(version, variant)
+    if cached is not None:
+        return add_validators(cached_response(cached, 'text/html'), store)
+
+    more = None
+    if window:
+        scores = store.since(time.time() - WINDOWS[window], count)
+        offset = 0
+    else:
+        scores = store.iter_page(count, offset)
+        if offset + count < len(store):
+            more = url_for('index', count=count, offset=offset + count)
+
+    chunks = stream_template('main.html',
+                             scores=scores,
+                             offset=offset,
+                             more=more,
+                             window=window,
+                             hostname=request.headers.get('Host'),
+                             stats=stats.stats(store))
+    if window:
+        return Response(chunks, 200, mimetype='text/html')
+
+    # the page is cached once it has been entirely sent
+    resp = Response(cache.tee(version, variant, chunks), 200,
+                    mimetype='text/html')
+    resp.headers['Vary'] = 'Accept-Encoding'
+    return add_validators(resp, store)
+
+
+@app.route('/stats')
+def stats_json():
+    return Response(json.dumps(stats.analytics(get_store())), 200,
+                    mimetype='application/json')
+
+
+def user_summary(store, name):
+    """
+    Return a dict of the scores of a user, with their best score, number of
+    games and the rank of their best score, or ``None`` if the user has no
+    score.
+    """
+    scores = store.get_user(name)
+    if not scores:
+        return None
+    return {'user': name,
+            'games': len(scores),
+            'best': scores[0].score,
+            'rank': store.rank(scores[0]),
+            'scores': scores}
+
+
+@app.route('/users/<name>')
+def user_page(name):
+    summary = user_summary(get_store(), name)
+    if summary is None:
+        abort(404)
+    return render_template('user.html', **summary)
+
+
+@app.route('/users/<name>.json')
+def user_json(name):
+    summary = user_summary(get_store(), name)
+    if summary is None:
+        abort(404)
+    summary['scores'] = [s.__dict__ for s in summary['scores']]
+    return Response(json.dumps(summary), 200, mimetype='application/json')
 
 
 @app.route('/scores', methods=['POST'])
 def scores_upload():
+    if request.mimetype in ('application/json', 'application/x-ndjson'):
+        return scores_upload_stream()
+
+    payload = request.form['scores']
+    fp = fingerprint(payload)
+    if fp in seen_payloads:
+        app.logger.debug("Got an already seen payload")
+        return 'ok'
+
     try:
-        scores = json.loads(request.form['scores'])
+        scores = json.loads(payload)
     except ValueError as e:
         app.logger.error(e)
         return 'wrong json'
 
     app.logger.debug("Got some JSON")
-    store = ScoresStore(app.config['SCORES'])
-    store.add(*scores)
-    store.save()
+    scores = [normalize_score(s) for s in scores]
+    ct = submit_scores(scores)
+    app.logger.debug("Skipped %d already seen scores" % (len(scores) - ct))
+    seen_payloads.add(fp)
     return 'ok'
 
 
+def scores_upload_stream():
+    """
+    Add the scores of a JSON array or newline-delimited JSON request body to
+    the store. The body is parsed incrementally, and its scores are added by
+    batches of ``SCORES_UPLOAD_BATCH``, so it's never held in memory at
+    once. The store is saved every ``SCORES_UPLOAD_SAVE_EVERY`` scores and
+    at the end of the upload rather than after each batch. Batches read
+    before a malformed score are kept. Bodies can be compressed with gzip.
+    """
+    encoding = request.headers.get('Content-Encoding', 'identity')
+    if encoding == 'gzip':
+        stream = GzipReader(request.stream)
+    elif encoding == 'identity':
+        stream = request.stream
+    else:
+        abort(415)
+
+    f = codecs.getreader('utf-8')(stream)
+    if request.mimetype == 'application/json':
+        values = iter_json(f)
+    else:
+        values = iter_ndjson(f)
+
+    store = get_store()
+    size = app.config['SCORES_UPLOAD_BATCH']
+    unsaved = 0
+    try:
+        while True:
+            scores = [normalize_score(s)
+                      for s in itertools.islice(values, size)]
+            if not scores:
+                break
+            new = unseen_scores(scores)
+            if not new:
+                continue
+            with _stores_lock:
+                store.add(*[s for _, s in new])
+            for fp, _ in new:
+                seen_scores.add(fp)
+            unsaved += len(new)
+            if unsaved >= app.config['SCORES_UPLOAD_SAVE_EVERY']:
+                save_scores(store)
+                unsaved = 0
+    except (ValueError, BadScoreFormatException, zlib.error) as e:
+        app.logger.error(e)
+        return 'wrong json'
+    finally:
+        if unsaved:
+            save_scores(store)
+    return 'ok'
+
+
+def save_scores(store):
+    """
+    Save a store after scores have been added to it
+    """
+    with _stores_lock:
+        store.save()
+    cache.clear()
+
+
+@app.after_request
+def advertise_encodings(resp):
+    """
+    Tell the clients they can upload gzip-compressed JSON scores, with the
+    ``Accept-Encoding`` response header of RFC 7694
+    """
+    if request.endpoint in ('scores_upload', 'scores_json'):
+        resp.headers['Accept-Encoding'] = 'gzip'
+    return resp
+
+
+def encode_cursor(s):
+    """
+    Return an opaque pagination cursor pointing after the given score
+    """
+    key = json.dumps(s.sort_key()).encode('utf-8')
+    return base64.urlsafe_b64encode(key).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Return the sort key of a pagination cursor. A ``ValueError`` is raised if
+    it's not a valid cursor.
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(
+            cursor.encode('ascii')).decode('utf-8'))
+    except (TypeError, UnicodeError):
+        raise ValueError(cursor)
+    # the score and level are ints and the user, cause and status are
+    # strings, so that the key can be compared to the scores' ones
+    if not isinstance(key, list) or len(key) != 5 \
+            or not all(isinstance(k, int) and not isinstance(k, bool)
+                       for k in key[:2]) \
+            or not all(isinstance(k, type(u'')) for k in key[2:]):
+        raise ValueError(cursor)
+    return tuple(key)
+
+
 @app.route('/scores', methods=['GET'])
 def scores_json():
-    store = ScoresStore(app.config['SCORES'])
+    resp = not_modified(get_store(reload=False))
+    if resp is not None:
+        return resp
+
+    store = get_store()
     kwargs = {}
     if 'pretty' in request.args:
         kwargs['indent'] = 4
-    return Response(store.json(**kwargs), 200, mimetype='application/json')
+
+    args = request.args
+    if any(k in args for k in ('since', 'limit', 'offset', 'cursor')):
+        return add_validators(scores_page(store, **kwargs), store)
+
+    version = store.version
+    variant = cache_variant()
+    cached = cache.get(version, variant)
+    if cached is not None:
+        resp = cached_response(cached, 'application/json')
+    else:
+        # the body is cached once it has been entirely sent
+        resp = Response(cache.tee(version, variant,
+                                  store.json_chunks(**kwargs)),
+                        200, mimetype='application/json')
+        resp.headers['Vary'] = 'Accept-Encoding'
+    return add_validators(resp, store)
+
+
+def scores_page(store, **kwargs):
+    """
+    Return the response of ``GET /scores`` for a store when only some of its
+    scores are requested
+    """
+    args = request.args
+    if 'since' in args:
+        try:
+            since = float(args['since'])
+            limit = int(args['limit']) if 'limit' in args else None
+        except ValueError:
+            abort(400)
+        scores = store.since(since, limit)
+        return Response(json.dumps([s.__dict__ for s in scores], **kwargs),
+                        200, mimetype='application/json')
+
+    try:
+        limit = int(args.get('limit', app.config['SCORES_PAGE_SIZE']))
+        offset = int(args.get('offset', 0))
+        after = decode_cursor(args['cursor']) if 'cursor' in args else None
+    except ValueError:
+        abort(400)
+    if limit < 1 or offset < 0:
+        abort(400)
+
+    # get one more score to know if there's a next page
+    scores = store.page(limit + 1, offset, after)
+    resp = Response(json.dumps([s.__dict__ for s in scores[:limit]],
+                               **kwargs),
+                    200, mimetype='application/json')
+    if len(scores) > limit:
+        cursor = encode_cursor(scores[limit - 1])
+        resp.headers['X-Next-Cursor'] = cursor
+        params = {'limit': limit, 'cursor': cursor}
+        if 'pretty' in args:
+            params['pretty'] = args['pretty']
+        resp.headers['Link'] = '<%s>; rel="next"' % url_for('scores_json',
+                                                            **params)
+    return resp
@@ -0,0 +1,254 @@
+# -*- coding: UTF-8 -*-
+
+"""
+This module provides a binary file format for the scores, which can be used
+instead of JSON. A file starts with a fixed-size header, followed by
+fixed-size records sorted from the best score to the worst one, a table of
+the strings used by the records (users, causes and statuses), and a JSON
+object of the extra attributes of some records, by record index.
+
+The file is opened with ``mmap``: opening a store only reads the header and
+the strings table, and each record is decoded when it's accessed, so
+``get(limit)`` only reads the first ``limit`` records.
+
+.. versionadded:: 0.1.0
+"""
+
+import os
+import os.path
+import json
+import mmap
+import struct
+import tempfile
+
+from .store import Score, ScoresStore, ScoreColumns, StringTable, \
+    FILE_MODE, _replace, _time
+
+MAGIC = b'RSCB'
+VERSION = 2
+
+# magic, version, records count, strings offset, strings count, extras
+# offset, extras length
+HEADER = struct.Struct('<4sHIQIQI')
+
+# score, level, user, cause, status, time (0 if None). Stores reject scores
+# and levels above ``MAX_INT`` so that they always fit in a record.
+RECORD = struct.Struct('<iiIIId')
+
+# records of files written by the first version of the format, without time
+RECORDS = {1: struct.Struct('<iiIII'), 2: RECORD}
+
+STRING_LENGTH = struct.Struct('<H')
+
+
+class BadBinaryFileException(Exception):
+    """
+    This exception is raised when a file doesn't use the binary scores format.
+    """
+
+
+class MappedScores(object):
+    """
+    A read-only list-like sequence of scores backed by a memory-mapped binary
+    scores file. ``Score`` objects are created when they're accessed.
+    """
+    __slots__ = ['_map', '_count', '_record_struct', 'strings', 'extras']
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        m = self._map
+        if len(m) < HEADER.size:
+            raise BadBinaryFileException(path)
+
+        magic, version, count, str_off, str_count, ext_off, ext_len = \
+            HEADER.unpack_from(m, 0)
+        if magic != MAGIC or version not in RECORDS:
+            raise BadBinaryFileException(path)
+
+        self._count = count
+        self._record_struct = RECORDS[version]
+
+        self.strings = [None]
+        off = str_off
+        for _ in range(str_count):
+            n, = STRING_LENGTH.unpack_from(m, off)
+            off += STRING_LENGTH.size
+            self.strings.append(m[off:off + n].decode('utf-8'))
+            off += n
+
+        self.extras = {}
+        if ext_len:
+            extras = json.loads(m[ext_off:ext_off + ext_len].decode('utf-8'))
+            self.extras = dict((int(i), e) for i, e in extras.items())
+
+    def _record(self, i):
+        """
+        Return the score, level, user, cause, status and time of the i-th
+        record
+        """
+        st = self._record_struct
+        record = st.unpack_from(self._map, HEADER.size + i * st.size)
+        if len(record) == 5:
+            record += (0,)
+        return record
+
+    def _row(self, i):
+        score, level, user, cause, status, t = self._record(i)
+        strings = self.strings
+        return Score(level, score, strings[user], strings[cause],
+                     strings[status], _time(t), **self.extras.get(i, {}))
+
+    def key(self, i):
+        """
+        Return the ``Score.key`` of the i-th score without creating it
+        """
+        score, level, user, cause, status, _ = self._record(i)
+        strings = self.strings
+        return (level, score, strings[user], strings[cause], strings[status])
+
+    def sort_key(self, i):
+        """
+        Return the ``Score.sort_key`` of the i-th score without creating it
+        """
+        score, level, user, cause, status, _ = self._record(i)
+        strings = self.strings
+        return (-score, -level, strings[user] or '', strings[cause] or '',
+                strings[status] or '')
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._row(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('score index out of range')
+        return self._row(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._row(i)
+
+    def close(self):
+        """
+        Close the underlying memory map
+        """
+        self._map.close()
+
+
+def write_binary(path, scores):
+    """
+    Write scores in a binary scores file. They must be sorted from the best
+    to the worst one. The file is written in a temporary file which is then
+    renamed, so that stores which have mapped the previous file can still use
+    it. A ``ValueError`` is raised, and nothing is written, if a score or a
+    level doesn't fit in a record.
+    """
+    table = StringTable()
+    encode = table.encode
+    extras = {}
+    records = []
+    for i, s in enumerate(scores):
+        try:
+            records.append(RECORD.pack(s.score, s.level, encode(s.user),
+                                       encode(s.cause), encode(s.status),
+                                       s.time or 0))
+        except struct.error:
+            raise ValueError('Score out of range: %r' % s)
+        if s.extra:
+            extras[str(i)] = s.extra
+
+    strings = []
+    for st in table.strings[1:]:
+        b = st.encode('utf-8')
+        strings.append(STRING_LENGTH.pack(len(b)) + b)
+    strings = b''.join(strings)
+    extras = json.dumps(extras).encode('utf-8') if extras else b''
+
+    str_off = HEADER.size + len(records) * RECORD.size
+    ext_off = str_off + len(strings)
+    header = HEADER.pack(MAGIC, VERSION, len(records), str_off,
+                         len(table) - 1, ext_off, len(extras))
+
+    dirname = os.path.dirname(path) or '.'
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.tmp-')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(header)
+        f.write(b''.join(records))
+        f.write(strings)
+        f.write(extras)
+    os.chmod(tmp, FILE_MODE)
+    _replace(tmp, path)
+
+
+def json_to_binary(src, dst):
+    """
+    Convert a JSON scores file into a binary one
+    """
+    write_binary(dst, ScoresStore(src))
+
+
+def binary_to_json(src, dst):
+    """
+    Convert a binary scores file into a JSON one
+    """
+    with open(dst, 'w') as f:
+        f.write(json.dumps([s.__dict__ for s in MappedScores(src)]))
+
+
+class BinaryScoresStore(ScoresStore):
+    """
+    A scores store using the binary scores format. Scores are read from the
+    memory-mapped file until one is added: the store then copies them in
+    memory (in a ``ScoreColumns`` if ``columnar`` is true) and writes a new
+    file on ``save``. The journal is not supported by this format.
+
+    .. versionadded:: 0.1.0
+    """
+    __slots__ = []
+
+    def __init__(self, path=None, **kwargs):
+        kwargs['journal'] = False
+        super(BinaryScoresStore, self).__init__(path, **kwargs)
+
+    def _load(self):
+        """
+        Map the store's file in memory
+        """
+        if not self.path:
+            return
+
+        stamp = self._stat()
+        self.scores = MappedScores(self.path)
+        self._pending = []
+        self._rewrite = bool(self._retain_all())
+        self._stamp = stamp
+
+    def _materialize(self):
+        """
+        Copy the mapped scores in memory so that they can be modified. They
+        are the scores of the file, so the new ones are still tracked as
+        pending.
+        """
+        if isinstance(self._scores, MappedScores):
+            scs = list(self._scores)
+            self.scores = ScoreColumns(scs) if self.columnar else scs
+            self._pending = []
+
+    def _insert(self, s):
+        self._materialize()
+        return super(BinaryScoresStore, self)._insert(s)
+
+    def _insert_many(self, scs):
+        self._materialize()
+        return super(BinaryScoresStore, self)._insert_many(scs)
+
+    def _write(self):
+        """
+        Write the whole scores file
+        """
+        write_binary(self.path, self)
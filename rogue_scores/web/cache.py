@@ -0,0 +1,232 @@
+# -*- coding: UTF-8 -*-
+
+"""
+This module provides caches for the Web server. Responses bodies are kept
+encoded along with a gzip-compressed copy, so that a cached response can be
+sent without rendering nor compressing anything. Fingerprints of the uploaded
+scores are kept so that the ones which have already been added can be
+skipped.
+
+.. versionadded:: 0.1.0
+"""
+
+import json
+import zlib
+import hashlib
+import threading
+from collections import OrderedDict
+
+from ..compression import gzip_compress, GZIP_MIN_SIZE
+
+
+def fingerprint(value):
+    """
+    Return a fingerprint of a value which can be serialized in JSON. Equal
+    values have the same fingerprint, regardless of the order of their keys.
+    """
+    data = json.dumps(value, sort_keys=True)
+    return hashlib.sha1(data.encode('utf-8')).digest()
+
+
+class GzipReader(object):
+    """
+    A read-only file-like object which decompresses a gzip stream as it's
+    read. At most ``chunk_size`` bytes are decompressed at once, whatever the
+    compression ratio of the stream.
+    """
+
+    def __init__(self, f, chunk_size=64 * 1024):
+        self.f = f
+        self.chunk_size = chunk_size
+        self._z = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._buf = b''
+        self._eof = False
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._buf) < size):
+            data = self._z.unconsumed_tail or self.f.read(self.chunk_size)
+            if not data:
+                self._buf += self._z.flush()
+                self._eof = True
+            else:
+                self._buf += self._z.decompress(data, self.chunk_size)
+
+        if size < 0:
+            data, self._buf = self._buf, b''
+        else:
+            data, self._buf = self._buf[:size], self._buf[size:]
+        return data
+
+
+class CachedBody(object):
+    """
+    A response body, with its gzip-compressed copy or ``None`` if it's too
+    small to be compressed
+    """
+    __slots__ = ['version', 'body', 'gzipped']
+
+    def __init__(self, version, body):
+        self.version = version
+        self.body = body
+        self.gzipped = None
+        if len(body) >= GZIP_MIN_SIZE:
+            self.gzipped = gzip_compress(body)
+
+    def size(self):
+        return len(self.body) + len(self.gzipped or b'')
+
+
+class ResponseCache(object):
+    """
+    A cache of ``CachedBody`` objects, by request variant (e.g. the path and
+    query string of the request). Each body is stored with the version of the
+    store it was computed from, and is only returned for this version, so
+    writes invalidate the cache without going through it.
+
+    The cache holds at most ``max_size`` bytes. The least recently used
+    bodies are dropped first. Bodies bigger than ``max_entry_size`` bytes
+    (by default a quarter of ``max_size``) aren't cached.
+    """
+
+    def __init__(self, max_size=16 * 1024 * 1024, max_entry_size=None):
+        self.max_size = max_size
+        if max_entry_size is None:
+            max_entry_size = max_size // 4
+        self.max_entry_size = min(max_entry_size, max_size)
+        self.size = 0
+        self.hits = self.misses = 0
+        self._bodies = OrderedDict()
+        # (version, variant) pairs which are being cached by ``tee``
+        self._filling = set()
+        self._lock = threading.Lock()
+
+    def get(self, version, variant):
+        """
+        Return the ``CachedBody`` of a variant for a version, or ``None``
+        """
+        with self._lock:
+            cached = self._bodies.get(variant)
+            if cached is None or cached.version != version:
+                self.misses += 1
+                return None
+            # move it at the end, it's now the most recently used one
+            del self._bodies[variant]
+            self._bodies[variant] = cached
+            self.hits += 1
+            return cached
+
+    def put(self, version, variant, body):
+        """
+        Compress a body and cache it if it fits in the cache. Return its
+        ``CachedBody`` in any case.
+        """
+        cached = CachedBody(version, body)
+        size = cached.size()
+        with self._lock:
+            old = self._bodies.pop(variant, None)
+            if old is not None:
+                self.size -= old.size()
+            if size > self.max_entry_size:
+                return cached
+
+            while self.size + size > self.max_size:
+                _, dropped = self._bodies.popitem(last=False)
+                self.size -= dropped.size()
+            self._bodies[variant] = cached
+            self.size += size
+        return cached
+
+    def tee(self, version, variant, chunks):
+        """
+        Yield the given chunks of text, and cache their concatenation once
+        they've all been read, if it's at most ``max_entry_size`` long. The
+        chunks are only kept by the first of the concurrent requests for the
+        same variant and version; the others just pass them through.
+        """
+        key = (version, variant)
+        with self._lock:
+            if key in self._filling:
+                parts = None
+            else:
+                parts = []
+                self._filling.add(key)
+
+        if parts is None:
+            for chunk in chunks:
+                yield chunk
+            return
+
+        try:
+            size = 0
+            for chunk in chunks:
+                if parts is not None:
+                    parts.append(chunk)
+                    size += len(chunk)
+                    if size > self.max_entry_size:
+                        parts = None
+                yield chunk
+
+            if parts is not None:
+                self.put(version, variant, ''.join(parts).encode('utf-8'))
+        finally:
+            with self._lock:
+                self._filling.discard(key)
+
+    def clear(self):
+        """
+        Remove all the cached bodies
+        """
+        with self._lock:
+            self._bodies.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._bodies)
+
+
+class RecentSet(object):
+    """
+    A set of at most ``max_size`` keys, e.g. fingerprints of uploaded scores.
+    The least recently seen keys are forgotten first. ``hits`` and ``misses``
+    count the membership tests which found a key and those which didn't.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.hits = self.misses = 0
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            if key not in self._keys:
+                self.misses += 1
+                return False
+            # move it at the end, it's now the most recently seen one
+            del self._keys[key]
+            self._keys[key] = True
+            self.hits += 1
+            return True
+
+    def add(self, key):
+        """
+        Add a key to the set, forgetting the least recently seen one if it's
+        full
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._keys.pop(key, None)
+            while len(self._keys) >= self.max_size:
+                self._keys.popitem(last=False)
+            self._keys[key] = True
+
+    def clear(self):
+        """
+        Remove all the keys
+        """
+        with self._lock:
+            self._keys.clear()
+
+    def __len__(self):
+        return len(self._keys)
@@ -0,0 +1,433 @@
+# -*- coding: UTF-8 -*-
+
+"""
+This module provides a SQLite-based scores store. It has the same interface as
+``rogue_scores.web.store.ScoresStore``, but scores are never loaded in memory
+all at once: each method is implemented as an SQL query on an indexed table.
+
+The database uses the WAL mode, so that multiple processes (e.g. gunicorn
+workers) can read it while another one is writing.
+
+.. versionadded:: 0.1.0
+"""
+
+import os
+import os.path
+import json
+import sqlite3
+import threading
+
+from .store import Score, ScoresStore, ScoreColumns
+from .stats import Aggregates
+
+FIELDS = ('level', 'score', 'user', 'cause', 'status')
+
+# Text columns can't be NULL because SQLite considers NULLs as distinct values
+# in UNIQUE constraints, so ``None`` is stored as an empty string.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scores (
+    level INTEGER NOT NULL DEFAULT 0,
+    score INTEGER NOT NULL DEFAULT 0,
+    user TEXT NOT NULL DEFAULT '',
+    cause TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL DEFAULT '',
+    extra TEXT,
+    time NUMERIC,
+    UNIQUE (level, score, user, cause, status)
+);
+CREATE INDEX IF NOT EXISTS scores_score
+    ON scores (score DESC, level DESC, user, cause, status);
+CREATE INDEX IF NOT EXISTS scores_user_score
+    ON scores (user, score DESC, level DESC, cause, status);
+DROP INDEX IF EXISTS scores_user;
+CREATE INDEX IF NOT EXISTS scores_cause ON scores (cause);
+CREATE INDEX IF NOT EXISTS scores_status ON scores (status);
+"""
+
+# created after the migration of databases which don't have a ``time`` column
+TIME_INDEX = 'CREATE INDEX IF NOT EXISTS scores_time ON scores (time)'
+
+# same order as Score.sort_key
+ORDER_BY = 'ORDER BY score DESC, level DESC, user, cause, status'
+
+# Delete the scores which are neither among the ``keep`` best ones nor among
+# the ``keep_per_user`` best ones of their user. This ranks the whole table,
+# so it's only used when the store is opened or its scores are replaced. This
+# needs SQLite 3.25+.
+RETAIN = """
+DELETE FROM scores WHERE rowid IN (
+    SELECT rowid FROM (
+        SELECT rowid,
+            ROW_NUMBER() OVER (%(order)s) AS rank,
+            ROW_NUMBER() OVER (PARTITION BY user %(order)s) AS user_rank
+        FROM scores)
+    WHERE rank > ? AND user_rank > ?)
+""" % {'order': ORDER_BY}
+
+# Delete the scores of a user after their ``keep_per_user`` best ones
+RETAIN_USER = """
+DELETE FROM scores WHERE rowid IN (
+    SELECT rowid FROM scores WHERE user = ? %s LIMIT -1 OFFSET ?)
+""" % ORDER_BY
+
+SORT_KEY = '-score, -level, user, cause, status'
+
+SELECT = 'SELECT level, score, user, cause, status, extra, time FROM scores'
+
+INSERT = 'INSERT OR IGNORE INTO scores VALUES (?, ?, ?, ?, ?, ?, ?)'
+
+
+def row_to_score(row):
+    """
+    Return a ``Score`` from a row of the ``scores`` table
+    """
+    level, score, user, cause, status, extra, time = row
+    attrs = json.loads(extra) if extra else {}
+    attrs.update(level=level, score=score, user=user or None,
+                 cause=cause or None, status=status or None, time=time)
+    return Score(**attrs)
+
+
+def score_to_row(s):
+    """
+    Return a tuple of values to insert in the ``scores`` table for a ``Score``
+    """
+    attrs = dict(s.__dict__)
+    row = tuple(attrs.pop(f, None) for f in FIELDS)
+    level, score, user, cause, status = row
+    time = attrs.pop('time', None)
+    return (level or 0, score or 0, user or '', cause or '', status or '',
+            json.dumps(attrs) if attrs else None, time)
+
+
+class SQLiteScoresStore(ScoresStore):
+    """
+    A scores store backed by a SQLite database. If ``path`` is ``None``, the
+    database is kept in memory.
+
+    >>> s = SQLiteScoresStore('/tmp/foo.db')
+    >>> s.add({'user': 'foo', 'level': 42, 'status': 'quit', 'score': 12})
+    1
+    >>> len(s)
+    1
+
+    .. versionadded:: 0.1.0
+    """
+    __slots__ = ['_db']
+
+    def __init__(self, path=None, keep=None, keep_per_user=None, **kwargs):
+        """
+        Open the database at the given path, creating it if it doesn't exist.
+        ``keep`` and ``keep_per_user`` set the same retention policy as in
+        ``ScoresStore``. It's applied to the whole table when the store is
+        opened, then after each ``add`` to the scores it may drop. Other
+        keyword arguments are ignored.
+        """
+        self.path = path
+        self.keep = keep
+        self.keep_per_user = keep_per_user
+        self.saved = True
+        self._index = self._pending = None
+        self.journal = False
+        self.compact_every = None
+        self._journaled = 0
+        self._stamp = None
+        self._changes = 0
+        self._columns = None
+        self._aggregates = None
+        self._mutex = threading.RLock()
+        self._file_mutex = threading.RLock()
+
+        if path:
+            dirname = os.path.dirname(path)
+            if dirname and not os.path.exists(dirname):
+                os.makedirs(dirname)
+
+        # the connection may be shared by the threads of a worker; sqlite
+        # serializes the accesses itself
+        self._db = sqlite3.connect(path or ':memory:', timeout=10,
+                                   check_same_thread=False)
+        if path:
+            self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+        self._migrate()
+        self._db.execute(TIME_INDEX)
+        if self._retains():
+            with self._db:
+                self._db.execute(RETAIN, (self.keep or 0,
+                                          self.keep_per_user or 0))
+
+    def _migrate(self):
+        """
+        Add the ``time`` column to a database which doesn't have it, moving
+        the timestamps of its scores from their ``extra`` attributes
+        """
+        cols = [r[1] for r in self._db.execute('PRAGMA table_info(scores)')]
+        if 'time' in cols:
+            return
+        with self._db:
+            self._db.execute('ALTER TABLE scores ADD COLUMN time NUMERIC')
+            self._db.execute(
+                "UPDATE scores SET time = json_extract(extra, '$.time'), "
+                "extra = NULLIF(json_remove(extra, '$.time'), '{}') "
+                "WHERE json_extract(extra, '$.time') IS NOT NULL")
+
+    @property
+    def scores(self):
+        """
+        The list of scores, from the best to the worst one. This loads the
+        whole table, prefer ``get`` or iterating on the store.
+        """
+        return list(self)
+
+    @scores.setter
+    def scores(self, scores):
+        with self._db:
+            self._db.execute('DELETE FROM scores')
+            self._db.executemany(INSERT, [score_to_row(s) for s in scores])
+            if self._retains():
+                self._db.execute(RETAIN, (self.keep or 0,
+                                          self.keep_per_user or 0))
+
+    def _load(self):
+        """
+        Nothing to do here, scores are read on demand
+        """
+
+    def _files(self):
+        """
+        Return the paths of the database and its WAL file, where the last
+        transactions are written
+        """
+        return (self.path, self.path + '-wal')
+
+    def is_stale(self):
+        """
+        Always return ``False``, since scores are read from the database on
+        each access.
+        """
+        return False
+
+    def reload(self):
+        """
+        Nothing to do here, scores are read on demand
+        """
+
+    def save(self):
+        """
+        Commit the current transaction, if any
+        """
+        self._db.commit()
+        self.saved = True
+
+    def compact(self):
+        """
+        Same as ``save``
+        """
+        self.save()
+
+    def _insert(self, s):
+        """
+        Insert a score and return ``True`` if it was inserted or ``False`` if
+        it wasn't because it's already there.
+        """
+        cur = self._db.execute(INSERT, score_to_row(s))
+        if cur.rowcount != 1:
+            return False
+        self.saved = False
+        return True
+
+    def _insert_many(self, scs):
+        """
+        Insert multiple scores and return the number of inserted ones
+        """
+        cur = self._db.executemany(INSERT, [score_to_row(s) for s in scs])
+        if cur.rowcount > 0:
+            self.saved = False
+        return max(cur.rowcount, 0)
+
+    def add(self, *scs, **kwargs):
+        """
+        Add one or more scores to the store, in one transaction. See
+        ``ScoresStore.add``.
+        """
+        with self._db:
+            last = self._last_rowid()
+            ct = super(SQLiteScoresStore, self).add(*scs, **kwargs)
+            if ct and self._retains():
+                ct = self._retain(last)
+        if ct:
+            self._changes += 1
+        self.saved = True
+        return ct
+
+    def _last_rowid(self):
+        """
+        Return the greatest ``rowid`` of the table, or 0 if it's empty. Rows
+        inserted after that have a greater one.
+        """
+        cur = self._db.execute('SELECT MAX(rowid) FROM scores')
+        return cur.fetchone()[0] or 0
+
+    def _retain(self, last):
+        """
+        Apply the retention policy after the insertion of the rows after the
+        ``rowid`` ``last``, and return the number of these rows which are
+        still there.
+
+        The table was retained before, so only two kinds of scores can be
+        dropped: those of the users of the new scores, and those pushed out
+        of the ``keep`` best scores by the new ones. At most ``n`` scores are
+        pushed out by ``n`` new ones, so only the users of the ``n`` scores
+        after the ``keep`` best ones are checked. Each user's scores are read
+        with the ``scores_user_score`` index.
+        """
+        db = self._db
+        count = self._count(last)
+        users = set(r[0] for r in db.execute(
+            'SELECT DISTINCT user FROM scores WHERE rowid > ?', (last,)))
+        where, cutoff = '', ()
+        if self.keep is not None:
+            pushed = db.execute(
+                'SELECT %s FROM scores %s LIMIT ? OFFSET ?'
+                % (SORT_KEY, ORDER_BY), (count, self.keep)).fetchall()
+            if not pushed:
+                # all the scores are among the best ones
+                return count
+            users.update(key[2] for key in pushed)
+            # only drop scores which are not among the best ones
+            where = ' AND (%s) >= (?, ?, ?, ?, ?)' % SORT_KEY
+            cutoff = tuple(pushed[0])
+
+        for user in users:
+            db.execute(RETAIN_USER.rstrip() + where,
+                       (user, self.keep_per_user or 0) + cutoff)
+        return self._count(last)
+
+    def _count(self, last):
+        """
+        Return the number of rows after the ``rowid`` ``last``
+        """
+        return self._db.execute('SELECT COUNT(*) FROM scores WHERE rowid > ?',
+                                (last,)).fetchone()[0]
+
+    def get(self, limit):
+        """
+        Return at most ``limit`` scores
+        """
+        if limit <= 0:
+            return []
+        cur = self._db.execute('%s %s LIMIT ?' % (SELECT, ORDER_BY), (limit,))
+        return [row_to_score(r) for r in cur]
+
+    def page(self, limit, offset=0, after=None):
+        """
+        Return at most ``limit`` scores, skipping the first ``offset`` ones,
+        and starting after the score with the sort key ``after`` if it's not
+        ``None``.
+        """
+        where, args = '', ()
+        if after is not None:
+            # the first condition is a range on the first column of the
+            # scores_score index, so the scan starts at the key's score
+            where = 'WHERE score <= ? AND (score < ? OR level < ? ' \
+                'OR (level = ? AND (user > ? OR (user = ? AND (cause > ? ' \
+                'OR (cause = ? AND status > ?))))))'
+            score, level, user, cause, status = after
+            args = (-score, -score, -level, -level, user, user, cause, cause,
+                    status)
+        cur = self._db.execute('%s %s %s LIMIT ? OFFSET ?'
+                               % (SELECT, where, ORDER_BY),
+                               args + (limit, offset))
+        return [row_to_score(r) for r in cur]
+
+    def iter_page(self, limit, offset=0):
+        """
+        Return an iterator on at most ``limit`` scores, skipping the first
+        ``offset`` ones. Rows are fetched as they're read.
+        """
+        cur = self._db.execute('%s %s LIMIT ? OFFSET ?' % (SELECT, ORDER_BY),
+                               (limit, offset))
+        return (row_to_score(r) for r in cur)
+
+    def aggregates(self):
+        """
+        Return the ``Aggregates`` of the scores, computed with one grouped
+        query and kept until the database's version changes
+        """
+        version = self.version
+        if self._aggregates is None or self._aggregates[0] != version:
+            cur = self._db.execute(
+                "SELECT level, user, CASE WHEN status = 'killed' "
+                "AND cause != '' THEN cause END, COUNT(*) FROM scores "
+                "GROUP BY 1, 2, 3")
+            self._aggregates = (version, Aggregates.from_counts(
+                ((lvl, user or None, killer), n)
+                for lvl, user, killer, n in cur))
+        return self._aggregates[1]
+
+    def columns(self):
+        """
+        Return the scores in a ``ScoreColumns``, which are kept until the
+        database's version changes
+        """
+        version = self.version
+        if self._columns is None or self._columns[0] != version:
+            self._columns = (version, ScoreColumns(self))
+        return self._columns[1]
+
+    def since(self, t, limit=None):
+        """
+        Return the scores added since the timestamp ``t``, from the best to
+        the worst one, and at most ``limit`` of them if it's not ``None``.
+        """
+        cur = self._db.execute(
+            '%s WHERE time >= ? %s LIMIT ?' % (SELECT, ORDER_BY),
+            (t, -1 if limit is None else limit))
+        return [row_to_score(r) for r in cur]
+
+    def get_user(self, user):
+        """
+        Return the scores of a user, from the best to the worst one
+        """
+        cur = self._db.execute('%s WHERE user = ? %s' % (SELECT, ORDER_BY),
+                               (user,))
+        return [row_to_score(r) for r in cur]
+
+    def rank(self, s):
+        """
+        Return the rank of a score in the store, starting at 1
+        """
+        cur = self._db.execute(
+            'SELECT COUNT(*) FROM scores '
+            'WHERE (-score, -level, user, cause, status) < (?, ?, ?, ?, ?)',
+            s.sort_key())
+        return cur.fetchone()[0] + 1
+
+    def __iter__(self):
+        for r in self._db.execute('%s %s' % (SELECT, ORDER_BY)):
+            yield row_to_score(r)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.scores[i]
+        if i < 0:
+            i += len(self)
+        if i >= 0:
+            cur = self._db.execute('%s %s LIMIT 1 OFFSET ?'
+                                   % (SELECT, ORDER_BY), (i,))
+            row = cur.fetchone()
+            if row is not None:
+                return row_to_score(row)
+        raise IndexError('score index out of range')
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM scores').fetchone()[0]
+
+    def __del__(self):
+        if not self.saved:
+            self.save()
+        self._db.close()
+
+    def __empty__(self):
+        return len(self) == 0
@@ -3,10 +3,19 @@
 """
 This modules helps computing interesting stats about the scores stored on the
 Web server.
+
+``analytics`` uses NumPy if it's installed, and pure Python otherwise.
 """
 
-import re
-from collections import defaultdict
+from collections import Counter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# percentiles computed by analytics
+PERCENTILES = (10, 25, 50, 75, 90, 99)
 
 
 def stats(scores):
@@ -18,36 +27,325 @@ def stats(scores):
         - ``most_active``: most games played by one user
         - ``best_killer``: monster with the most kills
 
-    If multiple users or monsters match a criteria for one of these keys, only
-    one of them will be picked.
+    If multiple users or monsters match a criteria for one of these keys, the
+    one with the smallest name is picked.
+
+    Stores maintain their ``Aggregates`` as scores are added, so this takes a
+    constant time on them. Other sequences of scores are iterated on.
     """
-    if not scores:
-        return {}
+    aggregates = getattr(scores, 'aggregates', None)
+    if aggregates is None:
+        return Aggregates(scores).summary()
+    return aggregates().summary()
 
-    users = defaultdict(int)
-    killers = defaultdict(int)
-    maxlvl = 0
-    maxlvl_user = None
 
-    for s in scores:
-        users[s.user] += 1
+class Aggregates(object):
+    """
+    Running aggregates on scores, used to compute ``stats`` without iterating
+    on the scores. Scores can be added and removed one at a time: the games
+    count by user, the kills count by monster and the users by level are
+    kept up to date, as well as the leader of each of them.
 
-        if s.status == 'killed' and s.cause:
-            killers[s['cause']] += 1
-        if s.level > maxlvl:
-            maxlvl = s.level
-            maxlvl_user = '%d (%s)' % (maxlvl, s.user)
+    .. versionadded:: 0.1.0
+    """
+    __slots__ = ['users', 'killers', 'levels', 'most_active', 'best_killer',
+                 'max_level', 'max_level_user']
 
-    s = {
-        'max_level': maxlvl_user,
-        'most_active':
-            '%s (%d games)' % tuple(max(users.items(), key=lambda p: p[1])),
-    }
+    def __init__(self, scores=()):
+        self.users = {}
+        self.killers = {}
+        # level -> games count by user, for positive levels only
+        self.levels = {}
+        self.most_active = self.best_killer = self.max_level_user = None
+        self.max_level = 0
+        for s in scores:
+            self.add(s)
+
+    @classmethod
+    def from_counts(cls, counts):
+        """
+        Create aggregates from an iterable of ``((level, user, killer),
+        count)`` pairs, where ``killer`` is the monster which killed the user
+        or ``None``.
+        """
+        agg = cls()
+        for (level, user, killer), n in counts:
+            agg._count(level, user, killer, n)
+        return agg
+
+    @classmethod
+    def from_columns(cls, columns):
+        """
+        Create aggregates from a ``ScoreColumns`` without creating ``Score``
+        objects
+        """
+        strings = columns.strings.strings
+        killed = columns.strings.codes.get('killed')
+        killers = (c if st == killed else 0
+                   for st, c in zip(columns.status, columns.cause))
+        counts = Counter(zip(columns.level, columns.user, killers))
+        return cls.from_counts(((lvl, strings[u], strings[k]), n)
+                               for (lvl, u, k), n in counts.items())
+
+    def add(self, s):
+        """
+        Add a score to the aggregates
+        """
+        self._count(s.level, s.user, _killer(s), 1)
+
+    def remove(self, s):
+        """
+        Remove a score from the aggregates
+        """
+        self._count(s.level, s.user, _killer(s), -1)
+
+    def _count(self, level, user, killer, n):
+        _incr(self.users, user, n)
+        self.most_active = _leader(self.users, self.most_active, user, n)
+
+        if killer:
+            _incr(self.killers, killer, n)
+            self.best_killer = _leader(self.killers, self.best_killer,
+                                       killer, n)
+
+        if level <= 0:
+            return
+
+        users = self.levels.setdefault(level, {})
+        _incr(users, user, n)
+        if not users:
+            del self.levels[level]
+
+        if n > 0:
+            if level > self.max_level:
+                self.max_level, self.max_level_user = level, user
+            elif level == self.max_level and user < self.max_level_user:
+                self.max_level_user = user
+        elif level == self.max_level:
+            if not users:
+                self.max_level = max(self.levels) if self.levels else 0
+                users = self.levels.get(self.max_level)
+            if users:
+                self.max_level_user = min(users)
+            else:
+                self.max_level_user = None
+
+    def summary(self):
+        """
+        Return the stats as a dict of strings, see ``stats``
+        """
+        if not self.users:
+            return {}
+
+        s = {
+            'max_level': None,
+            'most_active': '%s (%d games)' % (self.most_active,
+                                              self.users[self.most_active]),
+            'best_killer': '?',
+        }
+        if self.max_level > 0:
+            s['max_level'] = '%d (%s)' % (self.max_level, self.max_level_user)
+        if self.best_killer:
+            s['best_killer'] = '%s (%d kills)' % (
+                self.best_killer, self.killers[self.best_killer])
 
-    if killers:
-        s['best_killer'] = \
-            '%s (%d kills)' % tuple(max(killers.items(), key=lambda p: p[1]))
+        return s
+
+
+def _killer(s):
+    """
+    Return the monster which killed the user of a score, or ``None``
+    """
+    if s.status == 'killed' and s.cause:
+        return s.cause
+
+
+def _incr(counts, key, n):
+    """
+    Add ``n`` to a count in a dict, removing it if it drops to zero
+    """
+    ct = counts.get(key, 0) + n
+    if ct > 0:
+        counts[key] = ct
     else:
-        s['best_killer'] = '?'
+        counts.pop(key, None)
+
+
+def _leader(counts, leader, key, n):
+    """
+    Return the key with the highest count in a dict, with ties broken by the
+    smallest key, after the count of ``key`` has been changed by ``n``.
+    """
+    if n > 0:
+        if leader is None or leader == key:
+            return key
+        if (-counts[key], key) < (-counts.get(leader, 0), leader):
+            return key
+        return leader
+
+    if leader != key:
+        return leader
+    if not counts:
+        return None
+    return min(counts, key=lambda k: (-counts[k], k))
+
+
+def analytics(scores, use_numpy=None):
+    """
+    Compute detailed stats on a ``ScoresStore`` or a sequence of scores, and
+    return them in a dict which can be serialized in JSON:
+
+        - ``count``: number of scores
+        - ``score_percentiles``, ``level_percentiles``: dicts of the
+          percentiles in ``PERCENTILES`` of the scores and levels, computed
+          with a linear interpolation
+        - ``death_levels``: for each monster, the number of users it killed
+          by level
+        - ``kill_share``: for each monster, the fraction of the kills it made
+        - ``users``: for each user, the number of games and the average score
+          and level
 
-    return s
+    The stats are computed on the columns of the scores, with NumPy if
+    ``use_numpy`` is true or if it's ``None`` and NumPy is installed. Columnar
+    stores are used as-is, other stores are converted in columns first and
+    keep them until their scores change.
+
+    .. versionadded:: 0.1.0
+    """
+    columns = _columns(scores)
+    if not len(columns):
+        return {'count': 0, 'score_percentiles': {}, 'level_percentiles': {},
+                'death_levels': {}, 'kill_share': {}, 'users': {}}
+
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    if use_numpy:
+        return _analytics_numpy(columns)
+    return _analytics_python(columns)
+
+
+def _columns(scores):
+    """
+    Return the ``ScoreColumns`` of a store or a sequence of scores. Stores
+    keep their columns between calls.
+    """
+    from .store import ScoreColumns
+
+    if isinstance(scores, ScoreColumns):
+        return scores
+    columns = getattr(scores, 'columns', None)
+    if columns is not None:
+        return columns()
+    return ScoreColumns(scores)
+
+
+def _killers(columns):
+    """
+    Return the codes of the monsters which killed the users of each score of
+    some columns, or 0
+    """
+    killed = columns.strings.codes.get('killed')
+    return [c if st == killed else 0
+            for st, c in zip(columns.status, columns.cause)]
+
+
+def _percentile(values, p):
+    """
+    Return a percentile of a sorted list of values, with a linear
+    interpolation between the closest ranks, like ``numpy.percentile``.
+    """
+    rank = (len(values) - 1) * p / 100.0
+    lo = int(rank)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (rank - lo)
+
+
+def _analytics_python(columns):
+    strings = columns.strings.strings
+    scores = sorted(columns.score)
+    levels = sorted(columns.level)
+    killers = _killers(columns)
+
+    games = Counter(columns.user)
+    totals = {}
+    for u, sc, lvl in zip(columns.user, columns.score, columns.level):
+        t = totals.get(u)
+        if t is None:
+            totals[u] = [sc, lvl]
+        else:
+            t[0] += sc
+            t[1] += lvl
+
+    deaths = Counter((k, lvl) for k, lvl in zip(killers, columns.level) if k)
+    kills = Counter(k for k in killers if k)
+
+    return _result(strings, len(columns),
+                   dict((p, float(_percentile(scores, p)))
+                        for p in PERCENTILES),
+                   dict((p, float(_percentile(levels, p)))
+                        for p in PERCENTILES),
+                   deaths.items(), kills.items(),
+                   ((u, n, totals[u][0], totals[u][1])
+                    for u, n in games.items()))
+
+
+def _analytics_numpy(columns):
+    strings = columns.strings.strings
+    score = numpy.frombuffer(columns.score, dtype=numpy.intc)
+    level = numpy.frombuffer(columns.level, dtype=numpy.intc)
+    user = numpy.frombuffer(columns.user, dtype=numpy.intc)
+    status = numpy.frombuffer(columns.status, dtype=numpy.intc)
+    cause = numpy.frombuffer(columns.cause, dtype=numpy.intc)
+
+    killed = columns.strings.codes.get('killed', -1)
+    mask = (status == killed) & (cause != 0)
+    killers, killer_levels = cause[mask], level[mask]
+
+    # (killer, level) pairs as single integers
+    width = int(level.max()) + 1 if len(level) else 1
+    pairs, counts = numpy.unique(
+        killers.astype(numpy.int64) * width + killer_levels,
+        return_counts=True)
+    deaths = [((int(pr // width), int(pr % width)), int(n))
+              for pr, n in zip(pairs, counts)]
+
+    kills = numpy.bincount(killers)
+    games = numpy.bincount(user)
+    score_sums = numpy.bincount(user, weights=score)
+    level_sums = numpy.bincount(user, weights=level)
+
+    return _result(strings, len(columns),
+                   dict(zip(PERCENTILES, numpy.percentile(
+                       score, PERCENTILES).tolist())),
+                   dict(zip(PERCENTILES, numpy.percentile(
+                       level, PERCENTILES).tolist())),
+                   deaths,
+                   ((k, int(n)) for k, n in enumerate(kills) if n),
+                   ((u, int(n), score_sums[u], level_sums[u])
+                    for u, n in enumerate(games) if n))
+
+
+def _result(strings, count, score_percentiles, level_percentiles, deaths,
+            kills, users):
+    """
+    Return the dict of ``analytics`` from the counts computed on columns,
+    where monsters and users are given by their codes.
+    """
+    death_levels = {}
+    for (k, lvl), n in deaths:
+        death_levels.setdefault(strings[k], {})[int(lvl)] = n
+
+    kills = list(kills)
+    total = float(sum(n for _, n in kills))
+
+    return {
+        'count': count,
+        'score_percentiles': score_percentiles,
+        'level_percentiles': level_percentiles,
+        'death_levels': death_levels,
+        'kill_share': dict((strings[k], n / total) for k, n in kills),
+        'users': dict((strings[u], {'games': n,
+                                    'avg_score': float(sc) / n,
+                                    'avg_level': float(lvl) / n})
+                      for u, n, sc, lvl in users),
+    }
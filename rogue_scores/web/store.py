@@ -15,9 +15,104 @@ These keys can be ``None`` (or ``0`` for numerical ones) if the attribute is
 not set.
 """
 
+import os
 import os.path
 import re
 import json
+import time
+import heapq
+import hashlib
+import bisect
+import tempfile
+import itertools
+import threading
+import functools
+import contextlib
+from array import array
+
+from .stats import Aggregates
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+try:
+    from functools import lru_cache
+except ImportError:  # Python 2
+    lru_cache = None
+
+SQLITE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+BINARY_EXTENSIONS = ('.bin',)
+
+# number of characters read at once when parsing a JSON file incrementally
+CHUNK_SIZE = 64 * 1024
+
+# number of scores encoded at once by ScoresStore.json_chunks
+JSON_BATCH = 256
+
+# minimal number of scores given to ScoresStore.add to insert them at once
+BULK_ADD_MIN = 16
+
+# number of distinct texts whose parse_text results are kept in memory
+PARSE_CACHE_SIZE = 4096
+
+# permissions of the scores files
+FILE_MODE = 0o644
+
+# time windows of the leaderboards, in seconds
+WINDOWS = {
+    'day': 24 * 3600,
+    'week': 7 * 24 * 3600,
+    'month': 30 * 24 * 3600,
+}
+
+# width of the time buckets of the recent scores, in seconds
+BUCKET_WIDTH = 3600
+
+
+# patterns used by parse_text. None of them starts with a '.*', so that they
+# don't backtrack on long texts.
+_LEVEL_RE = re.compile(r' on level (\d+)')
+_STATUS_RE = re.compile(r'(quit)|died of ([a-z]+)|(killed) |(won) ')
+_KILLER_RE = re.compile(r' by (an? )?([a-z]+)')
+
+
+def _parse_text(text):
+    """
+    Parse a score's text, see ``parse_text``. The returned dict must not be
+    modified since it may be cached.
+    """
+    text = text.strip().lower()
+    attrs = {}
+    m = _LEVEL_RE.search(text)
+    if m:
+        attrs['level'] = int(m.group(1))
+
+    m = _STATUS_RE.match(text)
+    if not m:
+        return attrs
+
+    quitted, died_of, killed, won = m.groups()
+    if quitted:
+        attrs['status'] = 'quit'
+    elif died_of:
+        attrs['cause'] = died_of
+        attrs['status'] = 'died'
+    elif killed:
+        m = _KILLER_RE.search(text)
+        if m:
+            # killed by a monster, or 'killed by hypothermia'
+            attrs['cause'] = m.group(2)
+            attrs['status'] = 'killed' if m.group(1) else 'died'
+    else:
+        attrs['status'] = 'won'
+
+    return attrs
+
+
+if lru_cache is not None:
+    _parse_text = lru_cache(maxsize=PARSE_CACHE_SIZE)(_parse_text)
 
 
 def parse_text(text):
@@ -30,6 +125,8 @@ def parse_text(text):
     (e.g. of starvation) or ``won``. This function should work with multiple
     text variants.
 
+    The results of the last ``PARSE_CACHE_SIZE`` distinct texts are cached.
+
     >>> parse_text("killed on level 12 by a quagga.")
     {'level': 12, 'status': 'killed', 'cause': 'quagga'}
     >>> parse_text("quit on level 3.")
@@ -41,39 +138,118 @@ def parse_text(text):
 
     .. versionadded:: 0.0.7
     """
-    text = text.strip().lower()
-    attrs = {}
-    m = re.match(r'.* on level (\d+).*', text)
-    if m:
-        attrs['level'] = int(m.groups(1)[0])
+    return dict(_parse_text(text))
 
-    if text.startswith('quit'):
-        attrs['status'] = 'quit'
-        return attrs
 
-    m = re.match(r'died of ([a-z]+).*', text)
-    if m:
-        attrs['cause'] = m.groups(1)[0]
-        attrs['status'] = 'died'
-        return attrs
+def parse_texts(texts):
+    """
+    Parse multiple scores' texts and return a list of dictionnaries of
+    attributes, as ``parse_text`` does. Each distinct text is parsed only once.
 
-    if text.startswith('killed '):
-        m = re.match('.* by an? ([a-z]+).*', text)
-        if m:
-            attrs['cause'] = m.groups(1)[0]
-            attrs['status'] = 'killed'
-            return attrs
+    >>> parse_texts(["quit on level 3.", "quit on level 3."])
+    [{'level': 3, 'status': 'quit'}, {'level': 3, 'status': 'quit'}]
 
-        m = re.match('.* by ([a-z]+).*', text)
-        if m:
-            attrs['cause'] = m.groups(1)[0]
-            attrs['status'] = 'died'
-            return attrs
+    .. versionadded:: 0.1.0
+    """
+    parsed = {}
+    attrs = []
+    for text in texts:
+        a = parsed.get(text)
+        if a is None:
+            a = parsed[text] = _parse_text(text)
+        attrs.append(dict(a))
+    return attrs
 
-    if text.startswith('won '):
-        attrs['status'] = 'won'
 
-    return attrs
+def iter_json(f, chunk_size=CHUNK_SIZE):
+    """
+    Parse a JSON array from a file-like object and yield its elements one by
+    one, reading the file by chunks of ``chunk_size`` characters. This never
+    holds more than one element and one chunk in memory. A ``ValueError`` is
+    raised if the file doesn't contain a JSON array.
+
+    .. versionadded:: 0.1.0
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+    started = False
+
+    while True:
+        while pos < len(buf) and (buf[pos] in ' \t\n\r'
+                                  or started and buf[pos] == ','):
+            pos += 1
+
+        if pos < len(buf):
+            if not started:
+                if buf[pos] != '[':
+                    raise ValueError('Expecting a JSON array')
+                started = True
+                pos += 1
+                continue
+
+            if buf[pos] == ']':
+                return
+
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                # the element may be truncated
+                if eof:
+                    raise
+            else:
+                # a number may also be truncated at the end of the buffer
+                if end < len(buf) or eof:
+                    pos = end
+                    yield value
+                    continue
+        elif eof:
+            raise ValueError('Unterminated JSON array')
+
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buf = buf[pos:] + chunk
+        pos = 0
+
+
+def iter_ndjson(f):
+    """
+    Parse newline-delimited JSON from a file-like object and yield its values
+    one by one, reading it line by line. Blank lines are ignored. A
+    ``ValueError`` is raised on the first malformed line.
+
+    .. versionadded:: 0.1.0
+    """
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def iter_scores(path, limit=None):
+    """
+    Yield ``Score`` objects from a JSON scores file, reading it incrementally.
+    Scores are yielded in the file's order, which is from the best score to
+    the worst one for files written by a ``ScoresStore``. If ``limit`` is
+    given, the file is only read until ``limit`` scores have been yielded.
+    Scores of the journal file, if any, are not included.
+
+    A ``BadScoreFormatException`` is raised for files in the old (0.0.6)
+    format.
+
+    .. versionadded:: 0.1.0
+    """
+    if limit is not None and limit <= 0:
+        return
+
+    with open(path) as f:
+        for i, d in enumerate(iter_json(f)):
+            if not isinstance(d, dict):
+                raise BadScoreFormatException(d)
+            yield Score(**d)
+            if limit is not None and i + 1 >= limit:
+                return
 
 
 class BadScoreFormatException(Exception):
@@ -85,35 +261,107 @@ class BadScoreFormatException(Exception):
         Exception.__init__(self, s or 'Unrecognized format: %s' % str(s))
 
 
+SCORE_FIELDS = ('level', 'score', 'user', 'cause', 'status')
+
+# greatest score and level, since they're stored in 32-bit signed integers in
+# ``ScoreColumns`` and binary files
+MAX_INT = 2 ** 31 - 1
+
+
 class Score(object):
     """
     A score. This object implements some dict-like methods to provide an easy
     access to its attributes. It have at least these ones: ``level``, ``score``
     (default: ``0``), ``user``, ``status``, ``cause`` (default: ``None``).
 
+    These five attributes are stored in slots to keep scores small in memory,
+    as well as ``time``, the timestamp at which the score was added to a
+    store (default: ``None``). Any other attribute (e.g. ``monster``) is
+    stored in the ``extra`` dict, which is ``None`` if the score doesn't have
+    any. Extra attributes can be read and set like the other ones, and
+    ``__dict__`` returns all of them.
+
     .. versionadded:: 0.0.7
     """
+    __slots__ = SCORE_FIELDS + ('time', 'extra')
 
-    def __init__(self, **kwargs):
+    def __init__(self, level=0, score=0, user=None, cause=None, status=None,
+                 time=None, **extra):
         """
         Create a new score. Any attribute can be added via a keyword argument.
         """
-        self.level = self.score = 0
-        self.user = self.cause = self.status = None
-        self.__dict__.update(kwargs)
+        setattr_ = object.__setattr__
+        setattr_(self, 'level', level)
+        setattr_(self, 'score', score)
+        setattr_(self, 'user', user)
+        setattr_(self, 'cause', cause)
+        setattr_(self, 'status', status)
+        setattr_(self, 'time', time)
+        setattr_(self, 'extra', extra or None)
+
+    def __getattr__(self, name):
+        # only called for attributes which are not in a slot
+        if name == 'extra':
+            raise AttributeError(name)
+        try:
+            return self.extra[name]
+        except (KeyError, TypeError):
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if name in Score.__slots__ or name == '__dict__':
+            object.__setattr__(self, name, value)
+        elif self.extra is None:
+            object.__setattr__(self, 'extra', {name: value})
+        else:
+            self.extra[name] = value
+
+    @property
+    def __dict__(self):
+        """
+        A new dict of this score's attributes, including the extra ones
+        """
+        d = {'level': self.level, 'score': self.score, 'user': self.user,
+             'cause': self.cause, 'status': self.status}
+        if self.time is not None:
+            d['time'] = self.time
+        if self.extra:
+            d.update(self.extra)
+        return d
+
+    @__dict__.setter
+    def __dict__(self, d):
+        Score.__init__(self, **d)
 
     def __int__(self):
         return self.score
 
+    def key(self):
+        """
+        Return a tuple of this score's ``level``, ``score``, ``user``,
+        ``cause`` and ``status``. Two scores are equal if they have the same
+        key.
+
+        .. versionadded:: 0.1.0
+        """
+        return (self.level, self.score, self.user, self.cause, self.status)
+
+    def sort_key(self):
+        """
+        Return a tuple used to sort scores from the best to the worst one.
+        Scores are sorted by descending score, then by descending level, and
+        ties are broken with the user, cause and status.
+
+        .. versionadded:: 0.1.0
+        """
+        return (-self.score, -self.level, self.user or '', self.cause or '',
+                self.status or '')
+
     def __eq__(self, o):
         if not isinstance(o, Score):
             return False
 
-        for attr in ('level', 'score', 'user', 'cause', 'status'):
-            if getattr(self, attr) != getattr(o, attr):
-                return False
-
-        return True
+        return self.key() == o.key()
 
     def __ne__(self, o):
         return not self.__eq__(o)
@@ -131,12 +379,303 @@ class Score(object):
         return int(self) <= int(o)
 
     def __getitem__(self, k):
-        return self.__dict__[k]
+        if k in SCORE_FIELDS or (k == 'time' and self.time is not None):
+            return getattr(self, k)
+        if self.extra and k in self.extra:
+            return self.extra[k]
+        raise KeyError(k)
 
     def __repr__(self):
         return 'Score(%s)' % str(self.__dict__)
 
 
+class _SortKeys(object):
+    """
+    A read-only view on the sort keys of a list of scores, used to bisect it
+    without building a parallel list of keys.
+    """
+    __slots__ = ['scores']
+
+    def __init__(self, scores):
+        self.scores = scores
+
+    def __len__(self):
+        return len(self.scores)
+
+    def __getitem__(self, i):
+        return self.scores[i].sort_key()
+
+
+class StringTable(object):
+    """
+    A dictionary encoding for strings: each distinct string is given a small
+    integer code. ``None`` is always encoded as ``0``.
+
+    .. versionadded:: 0.1.0
+    """
+    __slots__ = ['strings', 'codes']
+
+    def __init__(self):
+        self.strings = [None]
+        self.codes = {None: 0}
+
+    def encode(self, s):
+        """
+        Return the code of a string, adding it to the table if necessary
+        """
+        code = self.codes.get(s)
+        if code is None:
+            code = self.codes[s] = len(self.strings)
+            self.strings.append(s)
+        return code
+
+    def decode(self, code):
+        """
+        Return the string corresponding to a code
+        """
+        return self.strings[code]
+
+    def __len__(self):
+        return len(self.strings)
+
+
+class ScoreColumns(object):
+    """
+    A list-like sequence of scores stored in columns: ``score`` and ``level``
+    are arrays of integers, ``user``, ``cause`` and ``status`` are arrays of
+    codes from a shared ``StringTable``, and ``time`` is an array of floats
+    where ``0`` stands for ``None``. ``Score`` objects are only created
+    when they're accessed. Extra attributes are kept in a dict indexed by
+    ``Score.key``.
+
+    .. versionadded:: 0.1.0
+    """
+    __slots__ = SCORE_FIELDS + ('time', 'strings', 'extras')
+
+    def __init__(self, scores=()):
+        for f in SCORE_FIELDS:
+            setattr(self, f, array('i'))
+        self.time = array('d')
+        self.strings = StringTable()
+        self.extras = {}
+        for s in scores:
+            self.append(s)
+
+    def _row(self, i):
+        strings = self.strings.strings
+        s = Score(self.level[i], self.score[i], strings[self.user[i]],
+                  strings[self.cause[i]], strings[self.status[i]],
+                  _time(self.time[i]))
+        if self.extras:
+            extra = self.extras.get(s.key())
+            if extra:
+                s.extra = dict(extra)
+        return s
+
+    def key(self, i):
+        """
+        Return the ``Score.key`` of the i-th score without creating it
+        """
+        strings = self.strings.strings
+        return (self.level[i], self.score[i], strings[self.user[i]],
+                strings[self.cause[i]], strings[self.status[i]])
+
+    def sort_key(self, i):
+        """
+        Return the ``Score.sort_key`` of the i-th score without creating it
+        """
+        strings = self.strings.strings
+        return (-self.score[i], -self.level[i], strings[self.user[i]] or '',
+                strings[self.cause[i]] or '', strings[self.status[i]] or '')
+
+    def sort_keys(self):
+        """
+        Return a read-only sequence of the scores' sort keys, which can be
+        bisected
+        """
+        return _ColumnsSortKeys(self)
+
+    def column(self, name):
+        """
+        Return the values of a column as a list. String columns are decoded.
+        """
+        col = getattr(self, name)
+        if name in ('score', 'level'):
+            return col.tolist()
+        if name == 'time':
+            return [_time(t) for t in col]
+        strings = self.strings.strings
+        return [strings[c] for c in col]
+
+    def insert(self, i, s):
+        """
+        Insert a score before the index ``i``. Its fields are all encoded
+        before any column is modified, so that columns are left untouched if
+        one of them can't be stored (e.g. a score too big for an integer).
+        """
+        encode = self.strings.encode
+        row = array('i', (s.level, s.score, encode(s.user), encode(s.cause),
+                          encode(s.status)))
+        t = array('d', (s.time or 0,))[0]
+        for f, v in zip(SCORE_FIELDS, row):
+            getattr(self, f).insert(i, v)
+        self.time.insert(i, t)
+        if s.extra:
+            self.extras[s.key()] = dict(s.extra)
+
+    def append(self, s):
+        self.insert(len(self), s)
+
+    def merge(self, scores):
+        """
+        Merge a list of sorted scores in these columns. Rows between two new
+        scores are copied by slices, so this takes ``O(n + k log n)`` with
+        ``k`` new scores.
+        """
+        fields = SCORE_FIELDS + ('time',)
+        old = dict((f, getattr(self, f)) for f in fields)
+        new = dict((f, array(old[f].typecode)) for f in fields)
+        keys = self.sort_keys()
+        encode = self.strings.encode
+        i = 0
+        for s in scores:
+            j = bisect.bisect_left(keys, s.sort_key(), i)
+            for f in fields:
+                new[f] += old[f][i:j]
+            new['level'].append(s.level)
+            new['score'].append(s.score)
+            new['user'].append(encode(s.user))
+            new['cause'].append(encode(s.cause))
+            new['status'].append(encode(s.status))
+            new['time'].append(s.time or 0)
+            if s.extra:
+                self.extras[s.key()] = dict(s.extra)
+            i = j
+
+        for f in fields:
+            new[f] += old[f][i:]
+            setattr(self, f, new[f])
+
+    def __delitem__(self, i):
+        if self.extras:
+            self.extras.pop(self.key(i), None)
+        for f in SCORE_FIELDS + ('time',):
+            del getattr(self, f)[i]
+
+    def __len__(self):
+        return len(self.score)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._row(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('score index out of range')
+        return self._row(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._row(i)
+
+    def __repr__(self):
+        return 'ScoreColumns(%s)' % str(list(self))
+
+
+class _ColumnsSortKeys(object):
+    """
+    A read-only view on the sort keys of a ``ScoreColumns``
+    """
+    __slots__ = ['columns']
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __getitem__(self, i):
+        return self.columns.sort_key(i)
+
+
+class TimeBuckets(object):
+    """
+    A ring of buckets of the sort keys of the scores added in the last
+    ``span`` seconds, grouped by their ``time`` in buckets of ``width``
+    seconds. It's used to find recent scores without going through all of
+    them. The ring has a fixed number of buckets: when a score is added in a
+    new bucket, it replaces the expired one at the same place in the ring.
+
+    .. versionadded:: 0.1.0
+    """
+    __slots__ = ['width', 'ring']
+
+    def __init__(self, span=max(WINDOWS.values()), width=BUCKET_WIDTH):
+        self.width = width
+        # each item is None or a (bucket number, [(time, sort key), ...])
+        # tuple
+        self.ring = [None] * (span // width + 1)
+
+    def add(self, t, sk):
+        """
+        Add the sort key of a score added at the time ``t``
+        """
+        if t is None:
+            return
+        b = int(t // self.width)
+        i = b % len(self.ring)
+        bucket = self.ring[i]
+        if bucket is None or bucket[0] < b:
+            bucket = self.ring[i] = (b, [])
+        elif bucket[0] > b:
+            # too old, its bucket has been replaced
+            return
+        bucket[1].append((t, sk))
+
+    def covers(self, since, now):
+        """
+        Test if the ring contains all the scores added since ``since``
+        """
+        return now // self.width - since // self.width < len(self.ring)
+
+    def find(self, since, now):
+        """
+        Return the sort keys of the scores added between ``since`` and
+        ``now``, in no particular order. The ring must cover this interval.
+        """
+        keys = []
+        for b in range(int(since // self.width), int(now // self.width) + 1):
+            bucket = self.ring[b % len(self.ring)]
+            if bucket is not None and bucket[0] == b:
+                keys.extend(sk for t, sk in bucket[1] if t >= since)
+        return keys
+
+
+class _Rev(object):
+    """
+    A wrapper which reverses the order of a key, so that ``heapq`` can be used
+    to keep the worst scores on top of a heap.
+    """
+    __slots__ = ['key']
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, o):
+        return o.key < self.key
+
+
+def _synchronized(method):
+    """
+    Decorate a method of ``ScoresStore`` so that it holds the store's mutex
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._mutex:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class ScoresStore(object):
     """
     A scores store. This is based on a JSON file, but the interface should not
@@ -150,17 +689,58 @@ class ScoresStore(object):
     >>> s.save()
     None
 
+    With ``journal=True``, ``save`` appends the scores added since the last
+    save to a journal file next to the main one (its path is the store's path
+    followed by ``.journal``) instead of rewriting the whole file. The journal
+    is replayed when the store is loaded, and compacted into the main file
+    when it contains ``compact_every`` scores or more.
+
+    With ``columnar=True``, scores are kept in memory in a ``ScoreColumns``
+    instead of a list of ``Score`` objects, which takes a lot less memory.
+
+    ``keep`` and ``keep_per_user`` set a retention policy: only the ``keep``
+    best scores are kept, plus the ``keep_per_user`` best scores of each user
+    if it's set. Other scores are dropped when they're added or pushed out by
+    a better one. If only ``keep_per_user`` is set, only the best scores of
+    each user are kept. The best scores of each user are tracked with a heap
+    per user.
+
+    The scores of each user are indexed, so that ``get_user`` doesn't have to
+    go through all the scores, and the ``Aggregates`` used by
+    ``rogue_scores.web.stats.stats`` are updated on each insertion.
+
+    ``add`` sets the ``time`` of the new scores to the current timestamp.
+    Recent scores are indexed in ``TimeBuckets``, which are used by
+    ``since``.
+
     .. versionadded:: 0.0.7
     """
-    __slots__ = ['path', 'scores', 'saved']
+    __slots__ = ['path', '_scores', '_index', '_pending', 'saved', 'journal',
+                 'compact_every', '_journaled', '_stamp', 'columnar',
+                 '_lock_file', 'keep', 'keep_per_user', '_heaps', '_users',
+                 '_aggregates', '_times', '_changes', '_columns', '_mutex',
+                 '_file_mutex', '_rewrite']
 
-    def __init__(self, path=None, **kwargs):
+    def __init__(self, path=None, journal=False, compact_every=1000,
+                 columnar=False, keep=None, keep_per_user=None, **kwargs):
         """
         Create a new store in the given file path. The file is created if it
         doesn't exist. If ``path`` is ``None``, the store is not saved on disk.
         """
         self.path = path
-        self.scores = []
+        self.journal = journal
+        self.compact_every = compact_every
+        self.columnar = columnar
+        self.keep = keep
+        self.keep_per_user = keep_per_user
+        self._journaled = 0
+        self._stamp = None
+        self._lock_file = None
+        self._changes = 0
+        self._rewrite = False
+        self._mutex = threading.RLock()
+        self._file_mutex = threading.RLock()
+        self.scores = self._empty()
         self.saved = True
         if self.path and not os.path.isfile(self.path):
             dirname = os.path.dirname(self.path)
@@ -171,11 +751,105 @@ class ScoresStore(object):
         else:
             self._load()
 
+    @property
+    def scores(self):
+        """
+        The list of scores, from the best to the worst one.
+        """
+        return self._scores
+
+    @scores.setter
+    def scores(self, scores):
+        self._scores = scores
+        # the duplicates index, the users' heaps, the users index and the
+        # aggregates are lazily rebuilt when they're needed
+        self._index = None
+        self._heaps = None
+        self._users = None
+        self._aggregates = None
+        self._times = None
+        self._columns = None
+        # we don't know which scores are new, the next save must rewrite the
+        # whole file
+        self._pending = None
+
+    @property
+    def journal_path(self):
+        """
+        Path of the journal file, or ``None`` if the store has no path.
+
+        .. versionadded:: 0.1.0
+        """
+        if self.path:
+            return self.path + '.journal'
+
+    def _empty(self):
+        """
+        Return an empty sequence of scores
+        """
+        return ScoreColumns() if self.columnar else []
+
     def json(self, **kwargs):
         """
         Return a JSON representation of this store
         """
-        return json.dumps(self.scores, default=lambda o: o.__dict__, **kwargs)
+        return json.dumps(self.scores, default=_json_default, **kwargs)
+
+    def json_chunks(self, indent=None, batch=JSON_BATCH):
+        """
+        Yield the JSON representation of this store in chunks of ``batch``
+        scores, so that it never has to be built in memory at once. The
+        chunks put together are the same as ``json(indent=indent)``.
+
+        .. versionadded:: 0.1.0
+        """
+        scores = getattr(self, '_scores', None)
+        if isinstance(scores, list):
+            # scores inserted while the chunks are read don't move the ones
+            # which have not been read yet
+            scores = list(scores)
+        else:
+            scores = self._pages(batch)
+
+        if indent is None:
+            start, sep, end = '[', ', ', ']'
+            encode = json.dumps
+        else:
+            pad = ' ' * indent
+            start, sep, end = '[\n' + pad, ',\n' + pad, '\n]'
+
+            def encode(d):
+                return json.dumps(d, indent=indent).replace('\n', '\n' + pad)
+
+        it = iter(scores)
+        chunk = [encode(s.__dict__) for s in itertools.islice(it, batch)]
+        if not chunk:
+            yield '[]'
+            return
+
+        yield start + sep.join(chunk)
+        while True:
+            chunk = [encode(s.__dict__) for s in itertools.islice(it, batch)]
+            if not chunk:
+                break
+            yield sep + sep.join(chunk)
+        yield end
+
+    def _pages(self, size):
+        """
+        Yield the scores, reading them by pages of ``size`` scores. Each page
+        starts after the last score of the previous one, so that scores
+        inserted in the meantime don't shift the ones which haven't been read
+        yet.
+        """
+        after = None
+        while True:
+            page = self.page(size, 0, after)
+            for s in page:
+                yield s
+            if len(page) < size:
+                return
+            after = page[-1].sort_key()
 
     def _load(self):
         """
@@ -184,54 +858,501 @@ class ScoresStore(object):
         if not self.path:
             return
 
+        # the files may be replaced by another process while we read them:
+        # taking the stamp first means we'd only reload them needlessly
+        stamp = self._stat()
+
         with open(self.path) as f:
-            self.scores = json.loads(f.read())
+            items = iter_json(f)
+            first = next(items, None)
 
-        if len(self.scores) > 0 and isinstance(self.scores[0], list):
-            # support for old format
-            self.scores, scs = [], self.scores
-            self.add(*scs)
-            self.save()
+            if isinstance(first, list):
+                # support for old format. We don't know when these scores
+                # were added, so they don't get a time.
+                self.scores = self._empty()
+                self._add_many([dict(normalize_score(s), time=None)
+                                for s in itertools.chain([first], items)])
+                self.compact()
+            else:
+                scs = self._empty()
+                ordered = True
+                prev = None
+                if first is not None:
+                    # get Score objects instead of dicts, one at a time
+                    for d in itertools.chain([first], items):
+                        sc = Score(**d)
+                        key = sc.sort_key()
+                        if prev is not None and key < prev:
+                            ordered = False
+                        prev = key
+                        scs.append(sc)
+
+                if not ordered:
+                    # files written by previous versions may have ties in
+                    # insertion order
+                    scs = sorted(scs, key=Score.sort_key)
+                    if self.columnar:
+                        scs = ScoreColumns(scs)
+                self.scores = scs
+                # the file must be rewritten if the retention policy drops
+                # some of its scores. New scores are still tracked, so that
+                # they can be merged if another process writes it first.
+                self._pending = []
+                self._rewrite = bool(self._retain_all())
+
+        self._replay()
+        self._stamp = stamp
+
+    def _files(self):
+        """
+        Return the paths of the store's files
+        """
+        return (self.path, self.journal_path)
+
+    def _stat(self):
+        """
+        Return a tuple identifying the current version of the store's files on
+        disk, based on their modification time, size and inode.
+        """
+        stamp = []
+        for path in self._files():
+            try:
+                st = os.stat(path)
+            except OSError:
+                stamp.append(None)
+            else:
+                stamp.append((getattr(st, 'st_mtime_ns', st.st_mtime),
+                              st.st_size, st.st_ino))
+        return tuple(stamp)
+
+    def _version(self, stamp):
+        """
+        Return the version of the store for a stamp of its files
+        """
+        version = hashlib.sha1(repr(stamp).encode('utf-8')).hexdigest()[:16]
+        if not self.saved:
+            version += '-%d' % self._changes
+        return version
+
+    @property
+    def version(self):
+        """
+        A string which changes when the scores change. It's computed from the
+        modification times, sizes and inodes of the store's files when they
+        were loaded, so it's the same in all the processes which loaded the
+        same files, and it only changes when the store is reloaded. Stores
+        without a path or with unsaved scores use a counter of the
+        modifications.
+
+        .. versionadded:: 0.1.0
+        """
+        if not self.path or self._stamp is None:
+            return self.disk_version
+        return self._version(self._stamp)
+
+    @property
+    def disk_version(self):
+        """
+        The ``version`` the store will have once it's reloaded, computed from
+        the current state of its files. It doesn't need to load them.
+
+        .. versionadded:: 0.1.0
+        """
+        if not self.path:
+            return str(self._changes)
+        return self._version(self._stat())
+
+    @property
+    def last_modified(self):
+        """
+        The last modification time of the store's files, as a timestamp, or
+        ``None`` if it doesn't have any.
+
+        .. versionadded:: 0.1.0
+        """
+        if not self.path:
+            return None
+        times = []
+        for path in self._files():
+            try:
+                times.append(os.stat(path).st_mtime)
+            except OSError:
+                pass
+        return max(times) if times else None
+
+    def is_stale(self):
+        """
+        Test if the store's files have been modified on disk since the store
+        was loaded or saved, e.g. by another process.
+
+        .. versionadded:: 0.1.0
+        """
+        return bool(self.path) and self._stat() != self._stamp
+
+    @_synchronized
+    def reload(self):
+        """
+        Reload the store from disk. Unsaved scores are lost.
+
+        .. versionadded:: 0.1.0
+        """
+        if not self.path:
+            return
+
+        # the scores are replaced at once by _load
+        self.saved = True
+        if os.path.isfile(self.path):
+            self._load()
         else:
-            # get Score objects instead of dicts
-            self.scores = list(map(lambda d: Score(**d), self.scores))
+            self.scores = self._empty()
+            self.save()
+
+    def _replay(self):
+        """
+        Insert the scores of the journal file, if there's one
+        """
+        self._journaled = 0
+        path = self.journal_path
+        if not os.path.isfile(path):
+            return
+
+        with open(path) as f:
+            for line in f:
+                try:
+                    d = json.loads(line)
+                except ValueError:
+                    # the last line may be truncated if the server crashed
+                    # while writing it
+                    continue
+                self._journaled += 1
+                self._insert(Score(**d))
+
+        # these scores are already on disk
+        self._pending = []
+        self.saved = True
+
+    @contextlib.contextmanager
+    def lock(self):
+        """
+        Return a context manager holding an exclusive advisory lock on the
+        store's files, so that only one process at a time can write them. The
+        lock is taken on a ``.lock`` file next to the scores file. It's
+        reentrant for a given store in a thread, and a no-op if the store has
+        no path or if ``fcntl`` is not available. Other threads using the
+        same store wait for the lock to be released.
+
+        .. versionadded:: 0.1.0
+        """
+        if not self.path or fcntl is None:
+            yield
+            return
+
+        with self._file_mutex:
+            if self._lock_file is not None:
+                # this thread already holds the lock
+                yield
+                return
+
+            f = open(self.path + '.lock', 'a')
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                self._lock_file = f
+                yield
+            finally:
+                self._lock_file = None
+                # this releases the lock
+                f.close()
 
     def save(self):
         """
         Save the current scores on disk, if the store's ``path`` is not
-        ``None``.
+        ``None``. If the store uses a journal, only the new scores are written.
+
+        If the file has been modified by another process since it was loaded,
+        it's reloaded and the scores added since the last save are inserted
+        again before writing it, so that no score is lost.
         """
-        if self.path:
+        if not self.path:
+            return
+
+        with self.lock():
+            if self._pending and self.is_stale() \
+                    and os.path.isfile(self.path):
+                with self._mutex:
+                    pending = self._pending
+                    self.reload()
+                    self._insert_many(pending)
+
+            if not self.journal or self._pending is None or self._rewrite \
+                    or not os.path.isfile(self.path) \
+                    or self._journaled + len(self._pending) \
+                    >= self.compact_every:
+                return self.compact()
+
+            if self._pending:
+                with open(self.journal_path, 'a') as f:
+                    f.write(''.join([json.dumps(sc.__dict__) + '\n'
+                                     for sc in self._pending]))
+                self._journaled += len(self._pending)
+                self._pending = []
+            self.saved = True
+            self._stamp = self._stat()
+
+    def compact(self):
+        """
+        Rewrite the whole scores file and remove the journal, if any. This is
+        what ``save`` does if the store doesn't use a journal. The file is
+        written in a temporary file which is then renamed, so that other
+        processes never read a partially written file.
+
+        .. versionadded:: 0.1.0
+        """
+        if not self.path:
+            return
+
+        with self.lock():
             self.saved = True
-            with open(self.path, 'w') as f:
-                f.write(self.json())
+            self._write()
+
+            self._pending = []
+            self._rewrite = False
+            if os.path.isfile(self.journal_path):
+                os.unlink(self.journal_path)
+            self._journaled = 0
+            self._stamp = self._stat()
+
+    def _write(self):
+        """
+        Write the whole scores file
+        """
+        dirname = os.path.dirname(self.path) or '.'
+        fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.tmp-')
+        with os.fdopen(fd, 'w') as f:
+            f.write(self.json())
+        os.chmod(tmp, FILE_MODE)
+        _replace(tmp, self.path)
+
+    def _locate(self, s):
+        """
+        Return the index where a score should be inserted, or ``None`` if it's
+        already in the store. Duplicates are detected with a set of scores
+        keys, and the insertion point is found by bisecting the sorted list.
+
+        Columnar stores don't have a duplicates index: they only compare the
+        score with the ones that have the same sort key.
+        """
+        k = s.key()
+        sk = s.sort_key()
+
+        keys = self._sort_keys()
+        if isinstance(self._scores, ScoreColumns):
+            i = j = bisect.bisect_left(keys, sk)
+            while j < len(keys) and keys[j] == sk:
+                if self._scores.key(j) == k:
+                    return None
+                j += 1
+            return i
+
+        if self._index is None:
+            self._index = set(s1.key() for s1 in self._scores)
+
+        if k in self._index:
+            return None
+
+        return bisect.bisect_left(keys, sk)
+
+    def _sort_keys(self):
+        """
+        Return a read-only sequence of the scores' sort keys, which can be
+        bisected
+        """
+        if isinstance(self._scores, ScoreColumns):
+            return self._scores.sort_keys()
+        return _SortKeys(self._scores)
+
+    def _inserted(self, scs):
+        """
+        Update the store after some scores have been inserted
+        """
+        if self._index is not None:
+            self._index.update(s.key() for s in scs)
+        if self._users is not None:
+            for s in scs:
+                sk = s.sort_key()
+                bisect.insort(self._users.setdefault(sk[2], []), sk)
+        if self._aggregates is not None:
+            for s in scs:
+                self._aggregates.add(s)
+        if self._times is not None:
+            for s in scs:
+                self._times.add(s.time, s.sort_key())
+        if self._pending is not None:
+            self._pending.extend(scs)
+        self._columns = None
+        self._changes += 1
+        self.saved = False
+
+    def _retains(self):
+        """
+        Test if the store has a retention policy
+        """
+        return self.keep is not None or self.keep_per_user is not None
+
+    def _retain_all(self):
+        """
+        Apply the retention policy to all the scores at once, rebuild the
+        users' heaps, and return the set of the keys of the dropped scores.
+        """
+        self._heaps = {}
+        if not self._retains():
+            return set()
+
+        keep = self.keep or 0
+        per_user = self.keep_per_user or 0
+        kept = []
+        dropped = set()
+        for i, s in enumerate(self._scores):
+            sk = s.sort_key()
+            heap = self._heaps.setdefault(sk[2], [])
+            if len(heap) < per_user:
+                heap.append(_Rev(sk))
+            elif i >= keep:
+                dropped.add(s.key())
+                continue
+            kept.append(s)
+
+        for heap in self._heaps.values():
+            heapq.heapify(heap)
+
+        if dropped:
+            self._scores = ScoreColumns(kept) if self.columnar else kept
+            if self._index is not None:
+                self._index -= dropped
+            self._users = self._aggregates = self._columns = None
+        return dropped
+
+    def _protect(self, sk):
+        """
+        Add a score's sort key to the heap of its user's best scores if it's
+        one of them. Return a tuple of a boolean telling if it was added, and
+        the sort key of the score it replaced in the heap, if any.
+        """
+        if not self.keep_per_user:
+            return False, None
+
+        heap = self._heaps.setdefault(sk[2], [])
+        if len(heap) < self.keep_per_user:
+            heapq.heappush(heap, _Rev(sk))
+            return True, None
+        if sk < heap[0].key:
+            return True, heapq.heapreplace(heap, _Rev(sk)).key
+        return False, None
+
+    def _protected(self, sk):
+        """
+        Test if a score is one of the best scores of its user
+        """
+        heap = self._heaps.get(sk[2])
+        return bool(heap) and sk <= heap[0].key
+
+    def _evict(self, sk):
+        """
+        Drop the score with the given sort key if it's not retained anymore
+        """
+        keys = self._sort_keys()
+        i = bisect.bisect_left(keys, sk)
+        if i >= len(keys) or keys[i] != sk or i < (self.keep or 0) \
+                or self._protected(sk):
+            return
+
+        if self._index is not None:
+            self._index.discard(self._scores[i].key())
+        if self._users is not None:
+            keys = self._users[sk[2]]
+            del keys[bisect.bisect_left(keys, sk)]
+        if self._aggregates is not None:
+            self._aggregates.remove(self._scores[i])
+        # if it's pending, it'll be dropped again when it's read back
+        del self._scores[i]
+        self._columns = None
 
     def _insert(self, s):
         """
         Insert a score and return ``True`` if it was inserted or ``False`` if
-        it wasn't because it's already there.
+        it wasn't because it's already there or the retention policy drops
+        it.
         """
-        for i, s1 in enumerate(self.scores):
-            if s == s1:
+        i = self._locate(s)
+        if i is None:
+            return False
+
+        if not self._retains():
+            self._scores.insert(i, s)
+            self._inserted([s])
+            return True
+
+        if self._heaps is None:
+            self._retain_all()
+            i = self._locate(s)
+            if i is None:
                 return False
-            if s > s1:
-                self.scores.insert(i, s)
-                break
-        else:
-            self.scores.append(s)
-        self.saved = False
+
+        sk = s.sort_key()
+        protected, replaced = self._protect(sk)
+        if i >= (self.keep or 0) and not protected:
+            return False
+
+        self._scores.insert(i, s)
+        self._inserted([s])
+        if self.keep is not None and len(self._scores) > self.keep:
+            # this score was the last one of the global top
+            self._evict(self._sort_keys()[self.keep])
+        if replaced is not None:
+            self._evict(replaced)
         return True
 
-    def _add(self, s, **attrs):
+    def _insert_many(self, scs):
         """
-        Add a score. This is an internal function, use ``add`` instead. It
-        returns ``True`` if the score has been added, ``False`` if not.
+        Insert multiple scores and return the number of inserted ones. The
+        scores are sorted, deduplicated, then merged with the current ones in
+        one pass, which is faster than inserting them one by one.
+        """
+        fresh = []
+        seen = set()
+        for s in sorted(scs, key=Score.sort_key):
+            k = s.key()
+            if k not in seen:
+                seen.add(k)
+                if self._locate(s) is not None:
+                    fresh.append(s)
+
+        if fresh:
+            if isinstance(self._scores, ScoreColumns):
+                self._scores.merge(fresh)
+            else:
+                self._scores = _merge(self._scores, fresh)
+            self._inserted(fresh)
+
+            if self._retains():
+                dropped = self._retain_all()
+                if dropped:
+                    fresh = [s for s in fresh if s.key() not in dropped]
+
+        return len(fresh)
+
+    def _sanitize(self, s, **attrs):
+        """
+        Return a sanitized ``Score`` from a dict, or ``None`` if it doesn't
+        contain basic info on the score.
         """
         attrs.update(dict(s))
 
-        user = re.sub(r'\W+', '', attrs.get('user', ''))
+        try:
+            user = re.sub(r'\W+', '', attrs.get('user', ''))
+        except TypeError:
+            return None
         if not user:
-            return False
+            return None
         else:
             attrs['user'] = user
 
@@ -244,18 +1365,28 @@ class ScoresStore(object):
             attrs['score'] = int(attrs.get('score', 0))
             attrs['level'] = int(attrs.get('level', 0))
         except:
-            return False
+            return None
 
-        if attrs['score'] <= 0 or attrs['level'] < 0:
-            return False
+        if attrs['score'] <= 0 or attrs['level'] < 0 \
+                or attrs['score'] > MAX_INT or attrs['level'] > MAX_INT:
+            return None
 
         # sanitize status, cause, monster
         for s in ('status', 'cause', 'monster'):
             if attrs.get(s) is not None:
                 attrs[s] = re.sub(r'[^a-z]+', '', str(attrs[s]))
 
-        return self._insert(Score(**attrs))
+        return Score(**attrs)
+
+    def _add(self, s, **attrs):
+        """
+        Add a score. This is an internal function, use ``add`` instead. It
+        returns ``True`` if the score has been added, ``False`` if not.
+        """
+        sc = self._sanitize(s, **attrs)
+        return sc is not None and self._insert(sc)
 
+    @_synchronized
     def add(self, *scs, **kwargs):
         """
         Add one or more scores to the store. These are sanitized before
@@ -265,31 +1396,183 @@ class ScoresStore(object):
             - it's already present
             - it doesn't contain basic info on the score, like no user or a
               null score
+            - its score or level is greater than ``MAX_INT``
 
         Keyword arguments can be used to set default values on all added
         scores.
+
+        If there are at least ``BULK_ADD_MIN`` scores, they're inserted all at
+        once with a merge instead of one by one.
+
+        The ``time`` of the scores is set to the current timestamp, unless
+        it's given as a keyword argument.
+        """
+        # scores can't set their own time
+        now = kwargs.pop('time', None) or int(time.time())
+        return self._add_many([dict(normalize_score(s), time=now)
+                               for s in scs], **kwargs)
+
+    def _add_many(self, scs, **kwargs):
         """
+        Add a list of normalized scores as dicts, without setting their
+        ``time``. This is an internal function, use ``add`` instead. It
+        returns the number of inserted scores.
+        """
+        if len(scs) >= BULK_ADD_MIN:
+            sanitized = [self._sanitize(s, **kwargs) for s in scs]
+            return self._insert_many([s for s in sanitized if s is not None])
+
         ct = 0
         for s in scs:
-            # old server format, and format sent by the upload script
-            if not isinstance(s, dict):
-                if (isinstance(s, list) or isinstance(s, tuple)) \
-                        and len(s) == 3:
-                    s = {'user': s[0], 'score': s[1], 'text': s[2]}
-                else:
-                    raise BadScoreFormatException(s)
-
             if self._add(s, **kwargs):
                 ct += 1
 
         return ct
 
+    @_synchronized
     def get(self, limit):
         """
         Return at most ``limit`` scores
         """
         return self.scores[:limit]
 
+    @_synchronized
+    def page(self, limit, offset=0, after=None):
+        """
+        Return at most ``limit`` scores, skipping the first ``offset`` ones.
+        If ``after`` is a sort key, the page starts after the score with this
+        key. Scores are sliced from the sorted sequence, so this takes
+        ``O(limit + log n)``.
+
+        .. versionadded:: 0.1.0
+        """
+        start = offset
+        if after is not None:
+            start += bisect.bisect_right(self._sort_keys(), tuple(after))
+        return self._scores[start:start + limit]
+
+    @_synchronized
+    def iter_page(self, limit, offset=0):
+        """
+        Return an iterator on at most ``limit`` scores, skipping the first
+        ``offset`` ones.
+
+        .. versionadded:: 0.1.0
+        """
+        # a slice is a copy, so scores inserted while it's read don't shift
+        # it. The scores of other stores are created here, while the store
+        # can't be modified.
+        return iter(self._scores[offset:offset + limit])
+
+    @_synchronized
+    def aggregates(self):
+        """
+        Return the ``Aggregates`` of the scores. They're computed on the first
+        call, then kept up to date when scores are added or dropped.
+
+        .. versionadded:: 0.1.0
+        """
+        if self._aggregates is None:
+            if isinstance(self._scores, ScoreColumns):
+                self._aggregates = Aggregates.from_columns(self._scores)
+            else:
+                self._aggregates = Aggregates(self._scores)
+        return self._aggregates
+
+    @_synchronized
+    def columns(self):
+        """
+        Return the scores in a ``ScoreColumns``. Columnar stores return their
+        scores as-is; other stores build the columns on the first call and
+        keep them until the scores change.
+
+        .. versionadded:: 0.1.0
+        """
+        if isinstance(self._scores, ScoreColumns):
+            return self._scores
+        if self._columns is None:
+            self._columns = ScoreColumns(self._scores)
+        return self._columns
+
+    def _time_index(self):
+        """
+        Return the ``TimeBuckets`` of the scores
+        """
+        if self._times is None:
+            times = TimeBuckets()
+            if isinstance(self._scores, ScoreColumns):
+                keys = self._scores.sort_keys()
+                for i, t in enumerate(self._scores.time):
+                    if t:
+                        times.add(t, keys[i])
+            else:
+                for s in self._scores:
+                    times.add(s.time, s.sort_key())
+            self._times = times
+        return self._times
+
+    @_synchronized
+    def since(self, t, limit=None):
+        """
+        Return the scores added since the timestamp ``t``, from the best to
+        the worst one, and at most ``limit`` of them if it's not ``None``.
+        Recent scores are found in the ``TimeBuckets``; older ones need to go
+        through all the scores.
+
+        .. versionadded:: 0.1.0
+        """
+        now = time.time()
+        times = self._time_index()
+        if not times.covers(t, now):
+            scores = [s for s in self if s.time is not None and s.time >= t]
+            return scores[:limit]
+
+        keys = self._sort_keys()
+        scores = []
+        for sk in sorted(set(times.find(t, now))):
+            if limit is not None and len(scores) >= limit:
+                break
+            i = bisect.bisect_left(keys, sk)
+            # dropped scores are still in the buckets
+            if i < len(keys) and keys[i] == sk:
+                scores.append(self._scores[i])
+        return scores
+
+    def _user_index(self):
+        """
+        Return a dict of the sorted lists of the sort keys of each user's
+        scores
+        """
+        if self._users is None:
+            users = {}
+            keys = self._sort_keys()
+            for i in range(len(keys)):
+                sk = keys[i]
+                users.setdefault(sk[2], []).append(sk)
+            self._users = users
+        return self._users
+
+    @_synchronized
+    def get_user(self, user):
+        """
+        Return the scores of a user, from the best to the worst one. This
+        takes ``O(k log n)`` for ``k`` scores of this user.
+
+        .. versionadded:: 0.1.0
+        """
+        keys = self._sort_keys()
+        return [self._scores[bisect.bisect_left(keys, sk)]
+                for sk in self._user_index().get(user, ())]
+
+    @_synchronized
+    def rank(self, s):
+        """
+        Return the rank of a score in the store, starting at 1
+
+        .. versionadded:: 0.1.0
+        """
+        return bisect.bisect_left(self._sort_keys(), s.sort_key()) + 1
+
     def __iter__(self):
         for s in self.scores:
             yield s
@@ -309,3 +1592,166 @@ class ScoresStore(object):
 
     def __repr__(self):
         return 'ScoresStore(%s)' % str(list(self))
+
+
+class CommitQueue(object):
+    """
+    A group commit queue. Threads ``submit`` lists of scores, and the ones
+    submitted while a commit is running or within ``window`` seconds of each
+    other are given all at once to one call of ``commit``, which should add
+    them to a store and save it. The first thread of a group waits for
+    ``window`` seconds if other threads are submitting scores, then calls
+    ``commit`` while the other ones wait for it to return. A thread which
+    submits scores alone, e.g. in a single-threaded worker, commits them
+    right away. Commits are serialized. This reduces the number of writes
+    when many uploads arrive at the same time.
+
+    .. versionadded:: 0.1.0
+    """
+
+    def __init__(self, commit, window=0.01):
+        self.commit = commit
+        self.window = window
+        self.commits = 0
+        self._lock = threading.Lock()
+        self._commit_lock = threading.Lock()
+        self._batch = None
+        # number of threads in submit
+        self._submitters = 0
+
+    def submit(self, scores, window=None):
+        """
+        Submit a list of scores, wait for them to be committed, and return
+        what ``commit`` returned for their group. If ``commit`` raises an
+        exception, it's raised in all the threads of the group.
+        """
+        with self._lock:
+            self._submitters += 1
+            alone = self._submitters == 1
+            batch = self._batch
+            leader = batch is None
+            if leader:
+                batch = self._batch = _Batch()
+            batch.scores.extend(scores)
+
+        try:
+            if not leader:
+                batch.done.wait()
+            else:
+                if not alone:
+                    time.sleep(self.window if window is None else window)
+                self._commit_batch(batch)
+        finally:
+            with self._lock:
+                self._submitters -= 1
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.result
+
+    def _commit_batch(self, batch):
+        """
+        Commit a group of scores once the previous one has been committed.
+        Scores submitted until then join the group.
+        """
+        try:
+            with self._commit_lock:
+                with self._lock:
+                    # new submissions go to a new group
+                    self._batch = None
+                batch.result = self.commit(batch.scores)
+                self.commits += 1
+        except Exception as e:
+            batch.error = e
+        finally:
+            batch.done.set()
+
+
+class _Batch(object):
+    """
+    A group of scores submitted to a ``CommitQueue``
+    """
+    __slots__ = ['scores', 'done', 'result', 'error']
+
+    def __init__(self):
+        self.scores = []
+        self.done = threading.Event()
+        self.result = self.error = None
+
+
+def _replace(src, dst):
+    """
+    Rename a file, replacing the destination if it exists
+    """
+    getattr(os, 'replace', os.rename)(src, dst)
+
+
+def normalize_score(s):
+    """
+    Return a score as a dict. Scores can also be given as tuples or lists of
+    the user, score and text, which is the format sent by the upload script
+    and the format used by the server in versions before 0.0.7. A
+    ``BadScoreFormatException`` is raised for other values.
+
+    .. versionadded:: 0.1.0
+    """
+    if not isinstance(s, dict):
+        if (isinstance(s, list) or isinstance(s, tuple)) and len(s) == 3:
+            s = {'user': s[0], 'score': s[1], 'text': s[2]}
+        else:
+            raise BadScoreFormatException(s)
+    return s
+
+
+def _merge(scores, new):
+    """
+    Return a new list of the scores of two sorted lists. The first one should
+    be the longer one.
+    """
+    keys = _SortKeys(scores)
+    merged = []
+    i = 0
+    for s in new:
+        j = bisect.bisect_left(keys, s.sort_key(), i)
+        merged += scores[i:j]
+        merged.append(s)
+        i = j
+    merged += scores[i:]
+    return merged
+
+
+def _time(t):
+    """
+    Return a timestamp read from a column, where ``0`` stands for ``None``
+    """
+    if not t:
+        return None
+    return int(t) if t == int(t) else t
+
+
+def _json_default(o):
+    if isinstance(o, Score):
+        return o.__dict__
+    # other sequences of scores, e.g. ScoreColumns
+    return list(o)
+
+
+def open_store(path=None, **kwargs):
+    """
+    Return a store for the given path. The backend is chosen from the file's
+    extension: ``.db``, ``.sqlite`` and ``.sqlite3`` files are opened with a
+    ``rogue_scores.web.sqlstore.SQLiteScoresStore``, ``.bin`` files with a
+    ``rogue_scores.web.binstore.BinaryScoresStore``, and other files with a
+    ``ScoresStore``. Keyword arguments are given to the store.
+
+    .. versionadded:: 0.1.0
+    """
+    ext = os.path.splitext(path or '')[1]
+    if ext in SQLITE_EXTENSIONS:
+        from .sqlstore import SQLiteScoresStore
+        return SQLiteScoresStore(path, **kwargs)
+    if ext in BINARY_EXTENSIONS:
+        from .binstore import BinaryScoresStore
+        return BinaryScoresStore(path, **kwargs)
+
+    return ScoresStore(path, **kwargs)
@@ -40,6 +40,10 @@ well as a Python script to upload local scores to the server""",
         'requests >= 2.3.0',
         'argparse >= 1.2.1',
     ],
+    extras_require={
+        # faster stats on the Web server
+        'stats': ['numpy'],
+    },
     entry_points={
         'console_scripts':[
             'rogue_scores = rogue_scores.cli:run'
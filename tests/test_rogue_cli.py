@@ -18,7 +18,8 @@ else:
 
 import rogue_scores
 import rogue_scores.cli
-from rogue_scores.cli import run, set_server
+from rogue_scores.cli import run, set_server, read_ledger, write_ledger, \
+    score_hash, read_gzip_servers, add_gzip_server
 
 def noop(*args, **kwargs):
     return
@@ -39,9 +40,25 @@ class TestRogueCLI(unittest.TestCase):
         sys.exit = self.mkExit()
         rogue_scores.cli.SERVER_FILE = self._tmp.name
         os.unlink(self._tmp.name)
+        self._ledger = rogue_scores.cli.LEDGER_FILE
+        rogue_scores.cli.LEDGER_FILE = self._tmp.name + '.ledger'
+        self._argv = sys.argv[1:]
+        sys.argv[1:] = []
+        self._gzip = rogue_scores.cli.GZIP_FILE
+        rogue_scores.cli.GZIP_FILE = self._tmp.name + '.gzip'
+        self._accepts_gzip = rogue_scores.cli.accepts_gzip
+        rogue_scores.cli.accepts_gzip = lambda server: False
 
     def tearDown(self):
         rogue_scores.cli.SERVER_FILE = self._server
+        if os.path.isfile(rogue_scores.cli.LEDGER_FILE):
+            os.unlink(rogue_scores.cli.LEDGER_FILE)
+        rogue_scores.cli.LEDGER_FILE = self._ledger
+        sys.argv[1:] = self._argv
+        if os.path.isfile(rogue_scores.cli.GZIP_FILE):
+            os.unlink(rogue_scores.cli.GZIP_FILE)
+        rogue_scores.cli.GZIP_FILE = self._gzip
+        rogue_scores.cli.accepts_gzip = self._accepts_gzip
         sys.stdin = self._stdin
         sys.stdout = self._stdout
         sys.stderr = self._stderr
@@ -166,3 +183,103 @@ class TestRogueCLI(unittest.TestCase):
         self.assertEquals('rogue_scores v%s\n' % rogue_scores.__version__,
                           sys.stdout.read())
         self.assertEquals(0, self._last_exit)
+
+    # == ledger == #
+
+    def test_read_ledger_no_file(self):
+        self.assertEquals(set(), read_ledger('foo'))
+
+    def test_read_ledger_malformed(self):
+        with open(rogue_scores.cli.LEDGER_FILE, 'w') as f:
+            f.write('[1, ')
+        self.assertEquals(set(), read_ledger('foo'))
+
+    def test_write_ledger(self):
+        write_ledger('foo', ['a', 'b'])
+        write_ledger('bar', ['c'])
+        self.assertEquals(set(['a', 'b']), read_ledger('foo'))
+        self.assertEquals(set(['c']), read_ledger('bar'))
+        write_ledger('foo', ['d'])
+        self.assertEquals(set(['d']), read_ledger('foo'))
+
+    def test_score_hash(self):
+        self.assertEquals(score_hash(('user', 42, 'foo')),
+                          score_hash(['user', 42, 'foo']))
+        self.assertNotEqual(score_hash(('user', 42, 'foo')),
+                            score_hash(('user', 43, 'foo')))
+
+    def test_cli_run_sends_new_scores_only(self):
+        self.mkFakeInput('srv')
+        old, new = ('user', 42, 'foo'), ('user', 50, 'bar')
+        write_ledger('srv', [score_hash(old)])
+        self.setScores([new, old])
+        self.fakePostScores(True)
+        run()
+        self.assertSequenceEqual([[new]], self._post_args)
+        self.assertEquals(set([score_hash(old), score_hash(new)]),
+                          read_ledger('srv'))
+
+    def test_cli_run_nothing_new(self):
+        self.mkFakeInput('srv')
+        scs = [('user', 42, 'foo')]
+        write_ledger('srv', [score_hash(scs[0])])
+        self.setScores(scs)
+        self.fakePostScores(True)
+        run()
+        self.assertEquals(None, self._post_args)
+        self.assertEquals(None, self._last_exit)
+
+    def test_cli_run_other_server(self):
+        self.mkFakeInput('srv')
+        scs = [('user', 42, 'foo')]
+        write_ledger('other', [score_hash(scs[0])])
+        self.setScores(scs)
+        self.fakePostScores(True)
+        run()
+        self.assertSequenceEqual([scs], self._post_args)
+
+    def test_cli_run_post_error_keeps_ledger(self):
+        self.mkFakeInput('srv')
+        self.setScores([('user', 42, 'foo')])
+        self.fakePostScores(False)
+        run()
+        self.assertEquals(2, self._last_exit)
+        self.assertEquals(set(), read_ledger('srv'))
+
+    def test_cli_run_full_flag(self):
+        self.mkFakeInput('srv')
+        sys.argv[1:] = ['--full']
+        scs = [('user', 42, 'foo')]
+        write_ledger('srv', [score_hash(scs[0])])
+        self.setScores(scs)
+        self.fakePostScores(True)
+        run()
+        self.assertSequenceEqual([scs], self._post_args)
+
+    # == gzip servers == #
+
+    def test_read_gzip_servers_no_file(self):
+        self.assertEquals(set(), read_gzip_servers())
+
+    def test_add_gzip_server(self):
+        add_gzip_server('foo')
+        add_gzip_server('bar')
+        add_gzip_server('foo')
+        self.assertEquals(set(['foo', 'bar']), read_gzip_servers())
+
+    def test_cli_run_remembers_gzip_server(self):
+        self.mkFakeInput('srv')
+        self.setScores([('user', 42, 'foo')])
+        self.fakePostScores(True)
+        rogue_scores.cli.accepts_gzip = lambda server: server == 'srv'
+        run()
+        self.assertEquals({'target': 'srv'}, self._post_kwargs)
+        self.assertEquals(set(['srv']), read_gzip_servers())
+
+    def test_cli_run_gzip_server(self):
+        self.mkFakeInput('srv')
+        add_gzip_server('srv')
+        self.setScores([('user', 42, 'foo')])
+        self.fakePostScores(True)
+        run()
+        self.assertEquals({'target': 'srv', 'gzip': True}, self._post_kwargs)
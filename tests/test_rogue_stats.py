@@ -1,5 +1,6 @@
 # -*- coding: UTF-8 -*-
 
+import random
 import platform
 import subprocess
 
@@ -8,8 +9,9 @@ if platform.python_version() < '2.7':
 else:
     import unittest
 
-from rogue_scores.web.store import ScoresStore
-from rogue_scores.web.stats import stats
+from rogue_scores.web.store import Score, ScoresStore, ScoreColumns
+from rogue_scores.web import stats as stats_module
+from rogue_scores.web.stats import stats, Aggregates, analytics
 
 class TestRogueScoresStats(unittest.TestCase):
 
@@ -51,3 +53,147 @@ class TestRogueScoresStats(unittest.TestCase):
             'max_level': '32 (bar)',
             'best_killer': 'a (2 kills)',
         }, stats(self.store))
+
+    def test_stats_columnar(self):
+        scs = [{'user': 'foo', 'score': 17, 'cause': 'a',
+                'status': 'killed', 'level': 21},
+               {'user': 'bar', 'score': 25, 'cause': 'a',
+                'status': 'killed', 'level': 32},
+               {'user': 'bar', 'score': 3, 'cause': 'b',
+                'status': 'killed', 'level': 2},
+               {'user': 'qux', 'score': 4, 'cause': 'b',
+                'status': 'died', 'level': 32}]
+        self.store.add(*scs)
+        columnar = ScoresStore(columnar=True)
+        columnar.add(*scs)
+        self.assertEquals(stats(self.store), stats(columnar))
+
+    def test_stats_ties(self):
+        self.store.add({'user': 'foo', 'score': 17, 'cause': 'b',
+                        'status': 'killed', 'level': 3},
+                       {'user': 'bar', 'score': 2, 'cause': 'a',
+                        'status': 'killed', 'level': 3})
+        self.assertEquals({
+            'most_active': 'bar (1 games)',
+            'max_level': '3 (bar)',
+            'best_killer': 'a (1 kills)',
+        }, stats(self.store))
+
+    def test_stats_incremental(self):
+        self.store.add({'user': 'foo', 'score': 17, 'level': 3})
+        agg = self.store.aggregates()
+        self.store.add({'user': 'bar', 'score': 2, 'level': 5})
+        self.assertTrue(agg is self.store.aggregates())
+        self.assertEquals('5 (bar)', stats(self.store)['max_level'])
+
+    def test_stats_retention(self):
+        store = ScoresStore(keep=1)
+        store.add({'user': 'foo', 'score': 17, 'level': 3})
+        stats(store)
+        store.add({'user': 'bar', 'score': 20, 'level': 2})
+        self.assertEquals({
+            'most_active': 'bar (1 games)',
+            'max_level': '2 (bar)',
+            'best_killer': '?',
+        }, stats(store))
+
+
+class TestRogueAggregates(unittest.TestCase):
+
+    def randomScores(self, n):
+        rnd = random.Random(42)
+        return [Score(user=rnd.choice('abcde'), score=rnd.randint(1, 50),
+                      level=rnd.randint(0, 4), cause=rnd.choice('xyz'),
+                      status=rnd.choice(['killed', 'quit']))
+                for _ in range(n)]
+
+    def test_add_remove(self):
+        scores = self.randomScores(200)
+        agg = Aggregates(scores)
+        for i in range(len(scores)):
+            agg.remove(scores[i])
+            self.assertEquals(Aggregates(scores[i + 1:]).summary(),
+                              agg.summary())
+        self.assertEquals({}, agg.summary())
+
+    def test_from_columns(self):
+        scores = self.randomScores(200)
+        self.assertEquals(Aggregates(scores).summary(),
+                          Aggregates.from_columns(
+                              ScoreColumns(scores)).summary())
+
+
+class TestRogueAnalytics(unittest.TestCase):
+
+    def setUp(self):
+        self.store = ScoresStore()
+        self.store.add({'user': 'foo', 'score': 10, 'cause': 'bat',
+                        'status': 'killed', 'level': 2},
+                       {'user': 'foo', 'score': 20, 'cause': 'bat',
+                        'status': 'killed', 'level': 4},
+                       {'user': 'bar', 'score': 30, 'cause': 'orc',
+                        'status': 'killed', 'level': 2},
+                       {'user': 'bar', 'score': 40, 'status': 'quit',
+                        'level': 6})
+
+    def test_analytics_empty(self):
+        self.assertEquals(0, analytics(ScoresStore())['count'])
+
+    def test_analytics_python(self):
+        a = analytics(self.store, use_numpy=False)
+        self.assertEquals(4, a['count'])
+        self.assertEquals(25.0, a['score_percentiles'][50])
+        self.assertEquals(13.0, a['score_percentiles'][10])
+        self.assertEquals(3.0, a['level_percentiles'][50])
+        self.assertEquals({'bat': {2: 1, 4: 1}, 'orc': {2: 1}},
+                          a['death_levels'])
+        self.assertEquals({'bat': 2 / 3.0, 'orc': 1 / 3.0}, a['kill_share'])
+        self.assertEquals({'games': 2, 'avg_score': 35.0, 'avg_level': 4.0},
+                          a['users']['bar'])
+
+    def test_analytics_unsorted(self):
+        scores = [Score(user='a', score=sc, level=1)
+                  for sc in (1, 100, 50, 2, 75)]
+        a = analytics(scores, use_numpy=False)
+        self.assertAlmostEqual(90.0, a['score_percentiles'][90])
+        self.assertAlmostEqual(99.0, a['score_percentiles'][99])
+        self.assertEquals(50.0, a['score_percentiles'][50])
+
+    def test_analytics_columns_kept(self):
+        columns = self.store.columns()
+        analytics(self.store, use_numpy=False)
+        self.assertTrue(columns is self.store.columns())
+        self.store.add({'user': 'qux', 'score': 5, 'level': 1})
+        self.assertFalse(columns is self.store.columns())
+        self.assertEquals(5, analytics(self.store, use_numpy=False)['count'])
+
+    def test_analytics_columnar(self):
+        columnar = ScoresStore(columnar=True)
+        columnar.add(*[s.__dict__ for s in self.store])
+        self.assertEquals(analytics(self.store, use_numpy=False),
+                          analytics(columnar, use_numpy=False))
+
+    def assertAnalyticsEqual(self, a1, a2):
+        self.assertEquals(sorted(a1), sorted(a2))
+        for k, v in a1.items():
+            if isinstance(v, dict):
+                self.assertAnalyticsEqual(v, a2[k])
+            else:
+                self.assertAlmostEqual(v, a2[k])
+
+    @unittest.skipIf(stats_module.numpy is None, 'NumPy is not installed')
+    def test_analytics_numpy(self):
+        self.assertAnalyticsEqual(analytics(self.store, use_numpy=False),
+                                  analytics(self.store, use_numpy=True))
+
+    @unittest.skipIf(stats_module.numpy is None, 'NumPy is not installed')
+    def test_analytics_numpy_random(self):
+        rnd = random.Random(42)
+        scores = [Score(user=rnd.choice('abcde'), score=rnd.randint(1, 500),
+                        level=rnd.randint(0, 26), cause=rnd.choice('xyz'),
+                        status=rnd.choice(['killed', 'quit']))
+                  for _ in range(1000)]
+        store = ScoresStore(columnar=True)
+        store.add(*[s.__dict__ for s in scores])
+        self.assertAnalyticsEqual(analytics(store, use_numpy=False),
+                                  analytics(store, use_numpy=True))
@@ -1,6 +1,9 @@
 # -*- coding: UTF-8 -*-
 
+import json
+import zlib
 import platform
+import threading
 import subprocess
 from httmock import all_requests, response, HTTMock
 import requests
@@ -10,7 +13,17 @@ if platform.python_version() < '2.7':
 else:
     import unittest
 
-from rogue_scores.upload import post_scores
+if platform.python_version() < '3.0':
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs
+else:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs
+
+from rogue_scores import upload
+from rogue_scores.upload import post_scores, accepts_gzip, Uploader
 
 @all_requests
 def server_mock_ok(url, req):
@@ -37,6 +50,13 @@ def server_mock_connection_error(url, req):
 
 class TestRogueUpload(unittest.TestCase):
 
+    def setUp(self):
+        self._uploader = upload._uploader
+        upload._uploader = Uploader(backoff=0)
+
+    def tearDown(self):
+        upload._uploader = self._uploader
+
     # == .post_scores == #
 
     def test_post_scores_ok(self):
@@ -64,3 +84,150 @@ class TestRogueUpload(unittest.TestCase):
             r = post_scores([])
         self.assertFalse(r)
 
+    def test_post_scores_shared_uploader(self):
+        uploader = upload._uploader
+        with HTTMock(server_mock_ok):
+            post_scores([])
+        self.assertTrue(uploader is upload._uploader)
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    """
+    A local HTTP server which records the requests it gets and answers them
+    with the statuses in ``statuses``, then with ``200 ok``
+    """
+    daemon_threads = True
+
+    def __init__(self, gzip=False):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StandInHandler)
+        self.gzip = gzip
+        self.statuses = []
+        self.requests = []
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        self.server.requests.append((self.client_address, self.headers,
+                                     body))
+
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        reply = b'ok' if status == 200 else b'oops'
+        self.send_response(status)
+        if self.server.gzip:
+            self.send_header('Accept-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestRogueUploader(unittest.TestCase):
+
+    def setUp(self):
+        self.uploader = Uploader(backoff=0)
+
+    def tearDown(self):
+        self.uploader.session.close()
+        if hasattr(self, 'server'):
+            self.server.shutdown()
+            self.server.server_close()
+
+    def startServer(self, **kwargs):
+        self.server = StandInServer(**kwargs)
+        t = threading.Thread(target=self.server.serve_forever,
+                             kwargs={'poll_interval': 0.01})
+        t.daemon = True
+        t.start()
+        return '127.0.0.1:%d' % self.server.server_address[1]
+
+    def scores(self, n):
+        return [['user%d' % i, i + 1, 'quit on level 1'] for i in range(n)]
+
+    def test_post(self):
+        target = self.startServer()
+        self.assertTrue(self.uploader.post(self.scores(1), target=target))
+        _, headers, body = self.server.requests[0]
+        self.assertEquals(self.scores(1),
+                          json.loads(parse_qs(body.decode('utf-8'))
+                                     ['scores'][0]))
+        self.assertIn('Rogue-scores', headers['User-Agent'])
+
+    def test_post_keep_alive(self):
+        target = self.startServer()
+        self.uploader.post(self.scores(1), target=target)
+        self.uploader.post(self.scores(2), target=target)
+        self.assertEquals(2, len(self.server.requests))
+        self.assertEquals(self.server.requests[0][0],
+                          self.server.requests[1][0])
+
+    def test_post_retries(self):
+        target = self.startServer()
+        self.server.statuses = [503, 500]
+        self.assertTrue(self.uploader.post(self.scores(1), target=target))
+        self.assertEquals(3, len(self.server.requests))
+
+    def test_post_too_many_failures(self):
+        target = self.startServer()
+        self.server.statuses = [503] * 10
+        self.assertFalse(self.uploader.post(self.scores(1), target=target))
+        self.assertEquals(4, len(self.server.requests))
+
+    def test_post_client_error_not_retried(self):
+        target = self.startServer()
+        self.server.statuses = [400]
+        self.assertFalse(self.uploader.post(self.scores(1), target=target))
+        self.assertEquals(1, len(self.server.requests))
+
+    def test_post_connection_error(self):
+        server = StandInServer()
+        port = server.server_address[1]
+        server.server_close()
+        self.assertFalse(self.uploader.post(self.scores(1),
+                                            target='127.0.0.1:%d' % port))
+
+    def test_post_gzip_when_advertised(self):
+        target = self.startServer(gzip=True)
+        scores = self.scores(100)
+        self.assertTrue(self.uploader.post(scores, target=target))
+        self.assertTrue(self.uploader.post(scores, target=target))
+        _, headers, body = self.server.requests[0]
+        self.assertEquals(None, headers.get('Content-Encoding'))
+        _, headers, body = self.server.requests[1]
+        self.assertEquals('gzip', headers['Content-Encoding'])
+        self.assertEquals('application/json', headers['Content-Type'])
+        self.assertEquals(scores, json.loads(body.decode('utf-8')))
+
+    def test_post_no_gzip_small_bodies(self):
+        target = self.startServer(gzip=True)
+        self.uploader.post(self.scores(1), target=target)
+        self.uploader.post(self.scores(1), target=target)
+        self.assertEquals(None,
+                          self.server.requests[1][1].get('Content-Encoding'))
+
+    def test_delay(self):
+        uploader = Uploader(backoff=1)
+        for attempt in (1, 2, 3):
+            d = uploader._delay(attempt)
+            self.assertTrue(0 <= d <= 2 ** (attempt - 1))
+
+    def test_post_scores_gzip(self):
+        target = self.startServer(gzip=True)
+        _uploader = upload._uploader
+        upload._uploader = self.uploader
+        try:
+            self.assertFalse(accepts_gzip(target))
+            scores = self.scores(100)
+            self.assertTrue(post_scores(scores, target=target, gzip=True))
+            self.assertTrue(accepts_gzip(target))
+        finally:
+            upload._uploader = _uploader
+        _, headers, body = self.server.requests[0]
+        self.assertEquals('gzip', headers['Content-Encoding'])
+        self.assertEquals(scores, json.loads(body.decode('utf-8')))
@@ -3,6 +3,8 @@
 import os
 import os.path
 import json
+import zlib
+import time
 import platform
 import tempfile
 import logging
@@ -14,6 +16,8 @@ else:
 
 from rogue_scores.web import app
 from rogue_scores.web.app import index, scores_upload, scores_json
+from rogue_scores.web.cache import gzip_compress
+from rogue_scores.web.store import ScoresStore
 
 class FakeRequest(object):
     scores = '[]'
@@ -22,22 +26,32 @@ class FakeRequest(object):
         self.form = {'scores': FakeRequest.scores}
         self.headers = {}
         self.args = {}
+        self.if_none_match = None
+        self.if_modified_since = None
+        self.path = '/'
+        self.query_string = b''
+        self.accept_encodings = ()
+        self.mimetype = 'application/x-www-form-urlencoded'
+        self.endpoint = None
 
 app.app.logger.handlers = [logging.FileHandler('/dev/null')]
 
 class TestRogueWeb(unittest.TestCase):
 
     def setUp(self):
+        app.cache.clear()
+        app.seen_scores.clear()
+        app.seen_payloads.clear()
         self._scores = app.app.config['SCORES']
         self._req = app.request
         self.tmp = tempfile.NamedTemporaryFile(delete=False)
         app.request = FakeRequest()
         app.app.config['SCORES'] = self.tmp.name
         self.json = json.dumps([
-            {'user': 'foo', 'level': 42, 'cause': 'bar',
-             'status': 'killed', 'score': 24},
             {'user': 'moo', 'level': 25, 'cause': 'qwe',
-             'status': 'killed', 'score': 255}
+             'status': 'killed', 'score': 255},
+            {'user': 'foo', 'level': 42, 'cause': 'bar',
+             'status': 'killed', 'score': 24}
         ]).encode('utf-8')
         self.tmp.write(self.json)
         self.tmp.close()
@@ -45,8 +59,9 @@ class TestRogueWeb(unittest.TestCase):
     def tearDown(self):
         app.app.config['SCORES'] = self._scores
         app.request = self._req
-        if os.path.isfile(self.tmp.name):
-            os.unlink(self.tmp.name)
+        for ext in ('', '.lock', '.journal'):
+            if os.path.isfile(self.tmp.name + ext):
+                os.unlink(self.tmp.name + ext)
 
     def getScores(self):
         with open(self.tmp.name) as f:
@@ -56,9 +71,195 @@ class TestRogueWeb(unittest.TestCase):
 
     def test_index_no_score(self):
         os.unlink(self.tmp.name)
-        with app.app.app_context():
+        with app.app.test_request_context('/'):
             ret = index()
-        self.assertRegexpMatches(ret, r'</th>\s*</tr>\s*</table>')
+            self.assertRegexpMatches(ret.get_data(as_text=True),
+                                     r'</th>\s*</tr>\s*</table>')
+
+    def test_index_streamed(self):
+        app.request = self._req
+        resp = app.app.test_client().get('/')
+        self.assertTrue(resp.is_streamed)
+        html = resp.get_data(as_text=True)
+        self.assertIn('>moo</a>', html)
+        self.assertNotIn('More scores', html)
+
+    def test_index_max_count(self):
+        app.request = self._req
+        app.app.config['SCORES_MAX_COUNT'] = 1
+        try:
+            html = app.app.test_client().get('/?count=1000000').get_data(
+                as_text=True)
+        finally:
+            app.app.config['SCORES_MAX_COUNT'] = 1000
+        self.assertIn('>moo</a>', html)
+        self.assertNotIn('>foo</a>', html)
+        self.assertIn('href="/?count=1&amp;offset=1">More scores', html)
+
+    def test_index_offset(self):
+        app.request = self._req
+        html = app.app.test_client().get('/?offset=1').get_data(as_text=True)
+        self.assertNotIn('>moo</a>', html)
+        self.assertIn('>foo</a>', html)
+        self.assertIn('<td>2</td>', html)
+
+    # == conditional requests == #
+
+    def ageScores(self, seconds=10):
+        t = time.time() - seconds
+        os.utime(app.get_store().path, (t, t))
+
+    def test_scores_json_etag(self):
+        self.ageScores()
+        app.request = self._req
+        client = app.app.test_client()
+        resp = client.get('/scores')
+        etag = resp.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        self.assertTrue(resp.headers['Last-Modified'])
+
+        resp = client.get('/scores', headers={'If-None-Match': etag})
+        self.assertEquals(304, resp.status_code)
+        self.assertEquals(b'', resp.data)
+        self.assertEquals(etag, resp.headers['ETag'])
+
+        store = app.get_store()
+        store.add({'user': 'qux', 'score': 3, 'status': 'quit'})
+        store.save()
+        resp = client.get('/scores', headers={'If-None-Match': etag})
+        self.assertEquals(200, resp.status_code)
+        self.assertNotEquals(etag, resp.headers['ETag'])
+
+    def test_scores_json_etag_gzip(self):
+        app.app.config['SCORES'] = self.tmp.name
+        with open(self.tmp.name, 'w') as f:
+            f.write(json.dumps([{'user': 'u%d' % i, 'score': i + 1}
+                                for i in range(100)]))
+        app.request = self._req
+        client = app.app.test_client()
+        client.get('/scores').data
+        resp = client.get('/scores', headers={'Accept-Encoding': 'gzip'})
+        self.assertEquals('gzip', resp.headers['Content-Encoding'])
+        etag = resp.headers['ETag']
+        resp = client.get('/scores', headers={'If-None-Match': etag})
+        self.assertEquals(304, resp.status_code)
+
+    def test_no_last_modified_within_the_second(self):
+        self.ageScores(-5)
+        app.request = self._req
+        resp = app.app.test_client().get('/scores')
+        self.assertTrue(resp.headers['ETag'])
+        self.assertFalse('Last-Modified' in resp.headers)
+
+    def test_scores_json_etag_loaded_version(self):
+        self.ageScores()
+        app.request = self._req
+        client = app.app.test_client()
+        store = app.get_store()
+        etag = client.get('/scores').headers['ETag']
+        other = ScoresStore(self.tmp.name)
+        other.add({'user': 'qux', 'score': 3, 'status': 'quit'})
+        other.save()
+        # the store hasn't been reloaded: it has the previous version
+        resp = app.add_validators(app.Response(), store)
+        self.assertEquals(etag, resp.headers['ETag'])
+        self.assertFalse('Last-Modified' in resp.headers)
+        resp = client.get('/scores', headers={'If-None-Match': etag})
+        self.assertEquals(200, resp.status_code)
+        self.assertNotEquals(etag, resp.headers['ETag'])
+
+    def test_index_if_modified_since(self):
+        self.ageScores()
+        app.request = self._req
+        client = app.app.test_client()
+        resp = client.get('/')
+        last_modified = resp.headers['Last-Modified']
+        resp = client.get('/', headers={'If-Modified-Since': last_modified})
+        self.assertEquals(304, resp.status_code)
+        resp = client.get('/', headers={
+            'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'})
+        self.assertEquals(200, resp.status_code)
+
+    def test_index_window_no_etag(self):
+        app.request = self._req
+        resp = app.app.test_client().get('/?window=day')
+        self.assertFalse('ETag' in resp.headers)
+
+    # == .get_store == #
+
+    def test_get_store_cached(self):
+        with app.app.app_context():
+            self.assertTrue(app.get_store() is app.get_store())
+
+    def test_get_store_reloaded(self):
+        with app.app.app_context():
+            store = app.get_store()
+            with open(self.tmp.name, 'w') as f:
+                f.write('[]')
+            self.assertTrue(store is app.get_store())
+            self.assertEquals(0, len(store))
+
+    def test_index_window(self):
+        app.request = self._req
+        store = app.get_store()
+        store.add({'user': 'qux', 'score': 3, 'status': 'quit'})
+        store.save()
+        resp = app.app.test_client().get('/?window=week')
+        html = resp.data.decode('utf-8')
+        self.assertIn('href="/users/qux"', html)
+        self.assertNotIn('href="/users/moo"', html)
+
+    def test_scores_json_since(self):
+        app.request = self._req
+        store = app.get_store()
+        store.add({'user': 'qux', 'score': 3, 'status': 'quit'}, time=1000)
+        store.save()
+        client = app.app.test_client()
+        resp = client.get('/scores?since=500')
+        self.assertEquals(['qux'], [d['user'] for d in
+                                    json.loads(resp.data.decode('utf-8'))])
+        self.assertEquals(400, client.get('/scores?since=x').status_code)
+
+    # == .stats_json == #
+
+    def test_stats_json(self):
+        resp = app.app.test_client().get('/stats')
+        self.assertEquals(200, resp.status_code)
+        d = json.loads(resp.data.decode('utf-8'))
+        self.assertEquals(2, d['count'])
+        self.assertEquals({'bar': 0.5, 'qwe': 0.5}, d['kill_share'])
+
+    # == .user_page == #
+
+    def test_user_page(self):
+        resp = app.app.test_client().get('/users/foo')
+        self.assertEquals(200, resp.status_code)
+        self.assertIn('<td>24</td>', resp.data.decode('utf-8'))
+
+    def test_user_page_unknown_user(self):
+        resp = app.app.test_client().get('/users/nope')
+        self.assertEquals(404, resp.status_code)
+
+    def test_index_links_users(self):
+        app.request = self._req
+        resp = app.app.test_client().get('/')
+        self.assertIn('href="/users/moo"', resp.data.decode('utf-8'))
+
+    # == .user_json == #
+
+    def test_user_json(self):
+        resp = app.app.test_client().get('/users/foo.json')
+        self.assertEquals(200, resp.status_code)
+        d = json.loads(resp.data.decode('utf-8'))
+        self.assertEquals('foo', d['user'])
+        self.assertEquals(1, d['games'])
+        self.assertEquals(24, d['best'])
+        self.assertEquals(2, d['rank'])
+        self.assertEquals(['bar'], [sc['cause'] for sc in d['scores']])
+
+    def test_user_json_unknown_user(self):
+        resp = app.app.test_client().get('/users/nope.json')
+        self.assertEquals(404, resp.status_code)
 
     # == .scores_upload == #
 
@@ -84,7 +285,127 @@ class TestRogueWeb(unittest.TestCase):
         self.assertEquals('ok', ret)
         d = {'user': 'myname', 'level': 43,
              'status': 'killed', 'cause': 'foo', 'score': 50}
-        self.assertEquals(d, self.getScores()[0])
+        sc = self.getScores()[1]
+        self.assertTrue(sc.pop('time') > 0)
+        self.assertEquals(d, sc)
+
+    def test_scores_upload_seen_payload(self):
+        FakeRequest.scores = '[["myname", 50, "killed by a foo on level 43"]]'
+        app.request = FakeRequest()
+        commits = app.commits.commits
+        hits = app.seen_payloads.hits
+        with app.app.app_context():
+            self.assertEquals('ok', scores_upload())
+            self.assertEquals('ok', scores_upload())
+        self.assertEquals(commits + 1, app.commits.commits)
+        self.assertEquals(hits + 1, app.seen_payloads.hits)
+        self.assertEquals(3, len(self.getScores()))
+
+    def test_scores_upload_seen_scores(self):
+        app.request = FakeRequest()
+        app.request.form['scores'] = '[["a", 50, "quit on level 2"]]'
+        with app.app.app_context():
+            scores_upload()
+        hits = app.seen_scores.hits
+        with app.app.app_context():
+            self.assertEquals(1, app.submit_scores([
+                {'user': 'a', 'score': 50, 'text': 'quit on level 2'},
+                {'user': 'b', 'score': 20, 'text': 'quit on level 1'}]))
+        self.assertEquals(hits + 1, app.seen_scores.hits)
+        self.assertEquals(4, len(self.getScores()))
+
+    def postScores(self, data, content_type):
+        app.request = self._req
+        resp = app.app.test_client().post('/scores', data=data,
+                                          content_type=content_type)
+        return resp.get_data(as_text=True)
+
+    def test_scores_upload_json_body(self):
+        ret = self.postScores(json.dumps([
+            ['myname', 50, 'killed by a foo on level 43'],
+            {'user': 'other', 'score': 30, 'level': 2}]), 'application/json')
+        self.assertEquals('ok', ret)
+        self.assertEquals(['moo', 'myname', 'other', 'foo'],
+                          [s['user'] for s in self.getScores()])
+
+    def test_scores_upload_ndjson(self):
+        ret = self.postScores('{"user": "a", "score": 30}\n\n'
+                              '["b", 40, "quit on level 2"]\n',
+                              'application/x-ndjson')
+        self.assertEquals('ok', ret)
+        self.assertEquals(['moo', 'b', 'a', 'foo'],
+                          [s['user'] for s in self.getScores()])
+
+    def _postBatches(self, n, save_every=100000):
+        saves = []
+        save_scores = app.save_scores
+
+        def counting_save(store):
+            saves.append(len(store))
+            save_scores(store)
+
+        app.save_scores = counting_save
+        app.app.config['SCORES_UPLOAD_BATCH'] = 2
+        app.app.config['SCORES_UPLOAD_SAVE_EVERY'] = save_every
+        try:
+            ret = self.postScores('\n'.join(json.dumps(
+                {'user': 'u%d' % i, 'score': i + 1}) for i in range(n)),
+                'application/x-ndjson')
+        finally:
+            app.save_scores = save_scores
+            app.app.config['SCORES_UPLOAD_BATCH'] = 1000
+            app.app.config['SCORES_UPLOAD_SAVE_EVERY'] = 100000
+        self.assertEquals('ok', ret)
+        return saves
+
+    def test_scores_upload_json_batches(self):
+        commits = app.commits.commits
+        self.assertEquals([7], self._postBatches(5))
+        self.assertEquals(commits, app.commits.commits)
+        self.assertEquals(7, len(self.getScores()))
+
+    def test_scores_upload_json_batches_save_every(self):
+        self.assertEquals([6, 10, 11], self._postBatches(9, save_every=4))
+        self.assertEquals(11, len(self.getScores()))
+
+    def test_scores_upload_json_batches_seen(self):
+        self._postBatches(5)
+        self.assertEquals([], self._postBatches(5))
+        self.assertEquals(7, len(self.getScores()))
+
+    def test_scores_upload_gzip(self):
+        data = json.dumps([{'user': 'u%d' % i, 'score': i + 1}
+                           for i in range(300)]).encode('utf-8')
+        app.request = self._req
+        resp = app.app.test_client().post(
+            '/scores', data=gzip_compress(data),
+            content_type='application/json',
+            headers={'Content-Encoding': 'gzip'})
+        self.assertEquals('ok', resp.get_data(as_text=True))
+        self.assertEquals('gzip', resp.headers['Accept-Encoding'])
+        self.assertEquals(302, len(self.getScores()))
+
+    def test_scores_upload_gzip_malformed(self):
+        app.request = self._req
+        resp = app.app.test_client().post(
+            '/scores', data=b'nope', content_type='application/json',
+            headers={'Content-Encoding': 'gzip'})
+        self.assertEquals('wrong json', resp.get_data(as_text=True))
+
+    def test_scores_upload_unknown_encoding(self):
+        app.request = self._req
+        resp = app.app.test_client().post(
+            '/scores', data=b'[]', content_type='application/json',
+            headers={'Content-Encoding': 'br'})
+        self.assertEquals(415, resp.status_code)
+
+    def test_scores_upload_json_body_malformed(self):
+        self.assertEquals('wrong json',
+                          self.postScores('[{"user": "a"', 'application/json'))
+        self.assertEquals('wrong json',
+                          self.postScores('{"user": "a"}', 'application/json'))
+        self.assertEquals('wrong json',
+                          self.postScores('42\n', 'application/x-ndjson'))
 
     # == .scores_json == #
 
@@ -102,3 +423,89 @@ class TestRogueWeb(unittest.TestCase):
         self.assertEquals(json.loads(self.json.decode('utf-8')),
                           json.loads(txt))
         self.assertRegexpMatches(txt, '^\[\n +\{')
+
+    def test_scores_json_streamed(self):
+        app.request = self._req
+        resp = app.app.test_client().get('/scores')
+        self.assertTrue(resp.is_streamed)
+        self.assertEquals(json.loads(self.json.decode('utf-8')),
+                          json.loads(resp.data.decode('utf-8')))
+
+    def test_scores_json_page(self):
+        app.request = self._req
+        client = app.app.test_client()
+        resp = client.get('/scores?limit=1')
+        self.assertEquals(['moo'], [d['user'] for d in
+                                    json.loads(resp.data.decode('utf-8'))])
+        cursor = resp.headers['X-Next-Cursor']
+        self.assertIn('rel="next"', resp.headers['Link'])
+
+        resp = client.get('/scores?limit=1&cursor=%s' % cursor)
+        self.assertEquals(['foo'], [d['user'] for d in
+                                    json.loads(resp.data.decode('utf-8'))])
+        self.assertFalse('X-Next-Cursor' in resp.headers)
+
+    def test_scores_json_page_offset(self):
+        app.request = self._req
+        resp = app.app.test_client().get('/scores?offset=1')
+        self.assertEquals(['foo'], [d['user'] for d in
+                                    json.loads(resp.data.decode('utf-8'))])
+
+    def test_scores_json_page_bad_args(self):
+        app.request = self._req
+        client = app.app.test_client()
+        for qs in ('limit=0', 'limit=a', 'offset=-1', 'cursor=foo',
+                   'cursor=WzEsIDJd'):
+            self.assertEquals(400, client.get('/scores?' + qs).status_code)
+
+    def test_scores_json_page_bad_cursor_types(self):
+        app.request = self._req
+        client = app.app.test_client()
+        # [-10, -3, 1, 2, 3], [true, false, "a", "b", "c"] and
+        # [-1, -2, "a", null, "c"]
+        for cursor in ('Wy0xMCwgLTMsIDEsIDIsIDNd',
+                       'W3RydWUsIGZhbHNlLCAiYSIsICJiIiwgImMiXQ==',
+                       'Wy0xLCAtMiwgImEiLCBudWxsLCAiYyJd'):
+            resp = client.get('/scores?cursor=' + cursor)
+            self.assertEquals(400, resp.status_code)
+
+    def test_scores_json_page_link_pretty(self):
+        app.request = self._req
+        resp = app.app.test_client().get('/scores?limit=1&pretty=1')
+        self.assertIn('pretty=1', resp.headers['Link'])
+
+    # == responses cache == #
+
+    def test_scores_json_cached(self):
+        app.request = self._req
+        client = app.app.test_client()
+        first = client.get('/scores').data
+        hits = app.cache.hits
+        resp = client.get('/scores')
+        self.assertEquals(hits + 1, app.cache.hits)
+        self.assertEquals(first, resp.data)
+
+    def test_scores_json_cached_gzip(self):
+        app.app.config['SCORES'] = self.tmp.name
+        with open(self.tmp.name, 'w') as f:
+            f.write(json.dumps([
+                {'user': 'foo%d' % i, 'level': 2, 'cause': 'bar',
+                 'status': 'killed', 'score': 500 - i}
+                for i in range(100)]))
+        app.request = self._req
+        client = app.app.test_client()
+        first = client.get('/scores').data
+        resp = client.get('/scores', headers={'Accept-Encoding': 'gzip'})
+        self.assertEquals('gzip', resp.headers['Content-Encoding'])
+        self.assertEquals('Accept-Encoding', resp.headers['Vary'])
+        self.assertEquals(first, zlib.decompress(resp.data,
+                                                 16 + zlib.MAX_WBITS))
+
+    def test_index_cached_invalidated(self):
+        app.request = self._req
+        client = app.app.test_client()
+        client.get('/')
+        with app.app.app_context():
+            app.commit_scores([{'user': 'newuser', 'score': 3000}])
+        self.assertEquals(0, len(app.cache))
+        self.assertIn('newuser', client.get('/').get_data(as_text=True))
@@ -0,0 +1,154 @@
+# -*- coding: UTF-8 -*-
+
+import os
+import os.path
+import json
+import platform
+import struct
+import tempfile
+
+if platform.python_version() < '2.7':
+    import unittest2 as unittest
+else:
+    import unittest
+
+from rogue_scores.web.store import Score, ScoresStore, ScoreColumns, \
+    open_store
+from rogue_scores.web.binstore import BinaryScoresStore, MappedScores, \
+    BadBinaryFileException, write_binary, json_to_binary, binary_to_json, \
+    HEADER
+
+class TestRogueBinaryScoresStore(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'scores.bin')
+        self.scores = [
+            Score(user='foo', score=42, level=3, status='killed', cause='bat'),
+            Score(user='bar', score=17, level=1, status='quit', monster='x'),
+            Score(user='foo', score=2, level=1, status='quit'),
+        ]
+
+    def tearDown(self):
+        for name in os.listdir(self.dir):
+            os.unlink(os.path.join(self.dir, name))
+        os.rmdir(self.dir)
+
+    # == MappedScores == #
+
+    def test_mapped_scores(self):
+        write_binary(self.path, self.scores)
+        m = MappedScores(self.path)
+        self.assertEquals(3, len(m))
+        self.assertEquals(self.scores, list(m))
+        self.assertEquals(self.scores[1], m[1])
+        self.assertEquals(self.scores[2], m[-1])
+        self.assertEquals(self.scores[:2], m[:2])
+        self.assertEquals('x', m[1].monster)
+        self.assertRaises(IndexError, lambda: m[3])
+
+    def test_mapped_scores_keys(self):
+        write_binary(self.path, self.scores)
+        m = MappedScores(self.path)
+        self.assertEquals(self.scores[0].key(), m.key(0))
+        self.assertEquals(self.scores[0].sort_key(), m.sort_key(0))
+
+    def test_mapped_scores_empty(self):
+        write_binary(self.path, [])
+        self.assertEquals([], list(MappedScores(self.path)))
+
+    def test_mapped_scores_bad_file(self):
+        with open(self.path, 'w') as f:
+            f.write('[]' * 20)
+        self.assertRaises(BadBinaryFileException,
+                          lambda: MappedScores(self.path))
+
+    # == converters == #
+
+    def test_json_to_binary_to_json(self):
+        src = os.path.join(self.dir, 'scores.json')
+        dst = os.path.join(self.dir, 'scores2.json')
+        with open(src, 'w') as f:
+            f.write(json.dumps([s.__dict__ for s in self.scores]))
+        json_to_binary(src, self.path)
+        self.assertEquals(self.scores, list(MappedScores(self.path)))
+        binary_to_json(self.path, dst)
+        self.assertEquals(self.scores, list(ScoresStore(dst)))
+
+    # == BinaryScoresStore == #
+
+    def test_open_store(self):
+        self.assertTrue(isinstance(open_store(self.path), BinaryScoresStore))
+
+    def test_store_new_file(self):
+        st = BinaryScoresStore(self.path)
+        self.assertTrue(os.path.isfile(self.path))
+        self.assertEquals(0, len(st))
+        self.assertEquals(0, len(BinaryScoresStore(self.path)))
+
+    def test_store_mapped(self):
+        write_binary(self.path, self.scores)
+        st = BinaryScoresStore(self.path)
+        self.assertTrue(isinstance(st.scores, MappedScores))
+        self.assertEquals(self.scores[:2], st.get(2))
+        self.assertEquals(json.dumps([s.__dict__ for s in self.scores]),
+                          st.json())
+
+    def test_store_add(self):
+        write_binary(self.path, self.scores)
+        st = BinaryScoresStore(self.path)
+        self.assertEquals(0, st.add(self.scores[0].__dict__))
+        self.assertEquals(1, st.add({'user': 'qux', 'score': 20}))
+        self.assertEquals([42, 20, 17, 2], [s.score for s in st])
+        st.save()
+        self.assertFalse(st.is_stale())
+        self.assertEquals(4, len(BinaryScoresStore(self.path)))
+
+    def test_store_add_too_big(self):
+        write_binary(self.path, self.scores)
+        st = BinaryScoresStore(self.path)
+        self.assertEquals(0, st.add({'user': 'qux', 'score': 2 ** 40}))
+        self.assertEquals(0, st.add({'user': 'qux', 'score': 1,
+                                     'level': 2 ** 31}))
+        st.add({'user': 'qux', 'score': 20})
+        st.save()
+        self.assertEquals(4, len(BinaryScoresStore(self.path)))
+
+    def test_write_binary_too_big(self):
+        self.assertRaises(ValueError, write_binary, self.path,
+                          [Score(user='foo', score=2 ** 40)])
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_store_add_columnar(self):
+        write_binary(self.path, self.scores)
+        st = BinaryScoresStore(self.path, columnar=True)
+        st.add({'user': 'qux', 'score': 20})
+        self.assertTrue(isinstance(st.scores, ScoreColumns))
+        self.assertEquals(4, len(st))
+
+    def test_store_keep(self):
+        write_binary(self.path, self.scores)
+        st = BinaryScoresStore(self.path, keep=1, keep_per_user=1)
+        self.assertEquals([42, 17], [s.score for s in st])
+        st.save()
+        self.assertEquals(2, len(MappedScores(self.path)))
+
+    def test_store_time(self):
+        self.scores[0].time = 1234
+        write_binary(self.path, self.scores)
+        st = BinaryScoresStore(self.path)
+        self.assertEquals([1234, None, None], [s.time for s in st])
+
+    def test_mapped_scores_version_1(self):
+        record = struct.Struct('<iiIII')
+        strings = b''.join(struct.pack('<H', len(st)) + st
+                           for st in (b'foo', b'quit'))
+        str_off = HEADER.size + record.size
+        with open(self.path, 'wb') as f:
+            f.write(HEADER.pack(b'RSCB', 1, 1, str_off, 2,
+                                str_off + len(strings), 0))
+            f.write(record.pack(42, 3, 1, 0, 2))
+            f.write(strings)
+        self.assertEquals([Score(user='foo', score=42, level=3,
+                                 status='quit')],
+                          list(MappedScores(self.path)))
@@ -0,0 +1,169 @@
+# -*- coding: UTF-8 -*-
+
+import zlib
+import platform
+from io import BytesIO
+
+if platform.python_version() < '2.7':
+    import unittest2 as unittest
+else:
+    import unittest
+
+from rogue_scores.web.cache import ResponseCache, CachedBody, RecentSet, \
+    GzipReader, fingerprint, gzip_compress, GZIP_MIN_SIZE
+
+
+class TestRogueResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ResponseCache()
+
+    def test_gzip_compress(self):
+        body = b'foo bar ' * 1000
+        self.assertEquals(body, zlib.decompress(gzip_compress(body),
+                                                16 + zlib.MAX_WBITS))
+
+    def test_cached_body_small(self):
+        self.assertEquals(None, CachedBody('v1', b'foo').gzipped)
+
+    def test_cached_body_big(self):
+        body = b'x' * GZIP_MIN_SIZE
+        cached = CachedBody('v1', body)
+        self.assertTrue(len(cached.gzipped) < len(body))
+        self.assertEquals(len(body) + len(cached.gzipped), cached.size())
+
+    def test_get_empty(self):
+        self.assertEquals(None, self.cache.get('v1', '/'))
+        self.assertEquals(1, self.cache.misses)
+
+    def test_put_get(self):
+        self.cache.put('v1', '/', b'foo')
+        self.assertEquals(b'foo', self.cache.get('v1', '/').body)
+        self.assertEquals(None, self.cache.get('v1', '/scores'))
+        self.assertEquals(1, self.cache.hits)
+
+    def test_get_other_version(self):
+        self.cache.put('v1', '/', b'foo')
+        self.assertEquals(None, self.cache.get('v2', '/'))
+
+    def test_put_replace(self):
+        self.cache.put('v1', '/', b'foo')
+        self.cache.put('v2', '/', b'quux')
+        self.assertEquals(1, len(self.cache))
+        self.assertEquals(4, self.cache.size)
+
+    def test_put_lru(self):
+        cache = ResponseCache(max_size=6, max_entry_size=6)
+        cache.put('v1', 'a', b'aa')
+        cache.put('v1', 'b', b'bb')
+        cache.put('v1', 'c', b'cc')
+        cache.get('v1', 'a')
+        cache.put('v1', 'd', b'dd')
+        self.assertEquals(None, cache.get('v1', 'b'))
+        self.assertEquals(b'aa', cache.get('v1', 'a').body)
+        self.assertEquals(6, cache.size)
+
+    def test_put_too_big(self):
+        cache = ResponseCache(max_size=2)
+        self.assertEquals(b'foo', cache.put('v1', '/', b'foo').body)
+        self.assertEquals(0, len(cache))
+
+    def test_tee(self):
+        chunks = list(self.cache.tee('v1', '/', iter(['[1', ', 2', ']'])))
+        self.assertEquals(['[1', ', 2', ']'], chunks)
+        self.assertEquals(b'[1, 2]', self.cache.get('v1', '/').body)
+
+    def test_tee_too_big(self):
+        cache = ResponseCache(max_size=2)
+        self.assertEquals(['foo'], list(cache.tee('v1', '/', ['foo'])))
+        self.assertEquals(0, len(cache))
+
+    def test_put_entry_too_big(self):
+        cache = ResponseCache(max_size=8)
+        self.assertEquals(2, cache.max_entry_size)
+        cache.put('v1', '/', b'foo')
+        self.assertEquals(0, len(cache))
+        cache.put('v1', '/', b'fo')
+        self.assertEquals(1, len(cache))
+
+    def test_tee_concurrent(self):
+        first = self.cache.tee('v1', '/', iter(['[1', ']']))
+        self.assertEquals('[1', next(first))
+        second = self.cache.tee('v1', '/', iter(['[1', ']']))
+        self.assertEquals(['[1', ']'], list(second))
+        self.assertEquals(None, self.cache.get('v1', '/'))
+        self.assertEquals([']'], list(first))
+        self.assertEquals(b'[1]', self.cache.get('v1', '/').body)
+
+    def test_tee_closed(self):
+        first = self.cache.tee('v1', '/', iter(['[1', ']']))
+        next(first)
+        first.close()
+        list(self.cache.tee('v1', '/', iter(['[1', ']'])))
+        self.assertEquals(b'[1]', self.cache.get('v1', '/').body)
+
+    def test_clear(self):
+        self.cache.put('v1', '/', b'foo')
+        self.cache.clear()
+        self.assertEquals(0, len(self.cache))
+        self.assertEquals(0, self.cache.size)
+
+
+class TestRogueRecentSet(unittest.TestCase):
+
+    def test_fingerprint(self):
+        self.assertEquals(fingerprint({'a': 1, 'b': [2]}),
+                          fingerprint({'b': [2], 'a': 1}))
+        self.assertNotEqual(fingerprint({'a': 1}), fingerprint({'a': 2}))
+
+    def test_contains(self):
+        seen = RecentSet()
+        self.assertFalse('a' in seen)
+        seen.add('a')
+        self.assertTrue('a' in seen)
+        self.assertEquals((1, 1), (seen.hits, seen.misses))
+
+    def test_add_bounded(self):
+        seen = RecentSet(max_size=2)
+        seen.add('a')
+        seen.add('b')
+        self.assertTrue('a' in seen)
+        seen.add('c')
+        self.assertEquals(2, len(seen))
+        self.assertFalse('b' in seen)
+        self.assertTrue('a' in seen)
+
+    def test_add_disabled(self):
+        seen = RecentSet(max_size=0)
+        seen.add('a')
+        self.assertFalse('a' in seen)
+
+    def test_clear(self):
+        seen = RecentSet()
+        seen.add('a')
+        seen.clear()
+        self.assertEquals(0, len(seen))
+
+
+class TestRogueGzipReader(unittest.TestCase):
+
+    def test_read(self):
+        body = b'foo bar ' * 10000
+        r = GzipReader(BytesIO(gzip_compress(body)), chunk_size=100)
+        parts = []
+        while True:
+            part = r.read(7)
+            if not part:
+                break
+            parts.append(part)
+        self.assertEquals(body, b''.join(parts))
+
+    def test_read_all(self):
+        body = b'x' * 100000
+        r = GzipReader(BytesIO(gzip_compress(body)), chunk_size=10)
+        self.assertEquals(body, r.read())
+        self.assertEquals(b'', r.read())
+
+    def test_read_malformed(self):
+        r = GzipReader(BytesIO(b'not gzip'))
+        self.assertRaises(zlib.error, r.read)
@@ -0,0 +1,297 @@
+# -*- coding: UTF-8 -*-
+
+import os
+import os.path
+import json
+import random
+import sqlite3
+import platform
+import tempfile
+
+if platform.python_version() < '2.7':
+    import unittest2 as unittest
+else:
+    import unittest
+
+from rogue_scores.web.store import Score, open_store, ScoresStore
+from rogue_scores.web.sqlstore import SQLiteScoresStore
+from rogue_scores.web.stats import stats
+
+class TestRogueSQLiteScoresStore(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'scores.db')
+        self.store = SQLiteScoresStore(self.path)
+
+    def tearDown(self):
+        del self.store
+        for name in os.listdir(self.dir):
+            os.unlink(os.path.join(self.dir, name))
+        os.rmdir(self.dir)
+
+    def addScores(self):
+        return self.store.add(
+            {'user': 'foo', 'score': 17, 'status': 'quit', 'level': 19},
+            {'user': 'bar', 'score': 18, 'status': 'killed', 'level': 2,
+             'cause': 'bat', 'monster': 'bat'},
+            {'user': 'qux', 'score': 3, 'status': 'quit', 'level': 1})
+
+    # == open_store == #
+
+    def test_open_store_sqlite(self):
+        self.assertTrue(isinstance(open_store(self.path), SQLiteScoresStore))
+
+    def test_open_store_json(self):
+        s = open_store(None)
+        self.assertTrue(isinstance(s, ScoresStore))
+        self.assertFalse(isinstance(s, SQLiteScoresStore))
+
+    # == .__init__ == #
+
+    def test_init_creates_file(self):
+        self.assertTrue(os.path.isfile(self.path))
+
+    def test_init_in_memory(self):
+        s = SQLiteScoresStore()
+        self.assertEquals(0, len(s))
+
+    # == .add == #
+
+    def test_add(self):
+        self.assertEquals(3, self.addScores())
+        self.assertEquals(3, len(self.store))
+
+    def test_add_no_duplicate(self):
+        self.addScores()
+        self.assertEquals(0, self.addScores())
+        self.assertEquals(3, len(self.store))
+
+    def test_add_bulk(self):
+        scs = [{'user': 'foo', 'score': i + 1, 'status': 'quit'}
+               for i in range(20)]
+        self.assertEquals(20, self.store.add(*scs))
+        self.assertEquals(0, self.store.add(*scs))
+        self.assertEquals(20, len(self.store))
+
+    def test_add_sanitize(self):
+        self.assertEquals(0, self.store.add({'user': '', 'score': 3}))
+        self.assertEquals(1, self.store.add(['foo', 42, 'quit on level 3']))
+        s = self.store[0]
+        self.assertEquals(3, s.level)
+        self.assertEquals('quit', s.status)
+        self.assertEquals(None, s.cause)
+
+    def test_add_persistent(self):
+        self.addScores()
+        s = SQLiteScoresStore(self.path)
+        self.assertEquals(3, len(s))
+
+    def test_add_keep(self):
+        st = SQLiteScoresStore(keep=2)
+        self.assertEquals(1, st.add({'user': 'a', 'score': 10}))
+        self.assertEquals(1, st.add({'user': 'b', 'score': 30}))
+        self.assertEquals(1, st.add({'user': 'c', 'score': 20}))
+        self.assertEquals([30, 20], [s.score for s in st])
+        self.assertEquals(0, st.add({'user': 'd', 'score': 5}))
+        self.assertEquals(2, len(st))
+
+    def test_add_keep_per_user(self):
+        st = SQLiteScoresStore(keep=1, keep_per_user=1)
+        st.add({'user': 'a', 'score': 30}, {'user': 'a', 'score': 20},
+               {'user': 'b', 'score': 10})
+        self.assertEquals([('a', 30), ('b', 10)],
+                          [(s.user, s.score) for s in st])
+        st.add({'user': 'b', 'score': 40})
+        self.assertEquals([('b', 40), ('a', 30)],
+                          [(s.user, s.score) for s in st])
+
+    def test_add_keep_same_as_json_store(self):
+        rnd = random.Random(42)
+        scores = [{'user': rnd.choice('abcde'), 'score': rnd.randint(1, 50),
+                   'level': rnd.randint(1, 3), 'status': 'quit'}
+                  for _ in range(300)]
+        for keep, per_user in ((20, 3), (20, None), (None, 3), (3, 10)):
+            st = SQLiteScoresStore(keep=keep, keep_per_user=per_user)
+            ref = ScoresStore(keep=keep, keep_per_user=per_user)
+            st.add(*scores[:100])
+            ref.add(*scores[:100])
+            for s in scores[100:200]:
+                self.assertEquals(ref.add(s), st.add(s))
+            for i in range(200, 300, 7):
+                ref.add(*scores[i:i + 7])
+                st.add(*scores[i:i + 7])
+            self.assertEquals([s.sort_key() for s in ref],
+                              [s.sort_key() for s in st])
+
+    def test_keep_on_open(self):
+        self.addScores()
+        del self.store
+        self.store = SQLiteScoresStore(self.path, keep=1)
+        self.assertEquals(['bar'], [s.user for s in self.store])
+
+    def test_keep_user_index(self):
+        plan = self.store._db.execute(
+            'EXPLAIN QUERY PLAN SELECT rowid FROM scores WHERE user = ? '
+            'ORDER BY score DESC, level DESC, user, cause, status',
+            ('foo',)).fetchall()
+        plan = ' '.join(str(r) for r in plan)
+        self.assertTrue('scores_user_score' in plan)
+        self.assertFalse('TEMP B-TREE' in plan)
+
+    # == .get == #
+
+    def test_get(self):
+        self.addScores()
+        self.assertEquals(['bar', 'foo'], [s.user for s in self.store.get(2)])
+        self.assertSequenceEqual([], self.store.get(0))
+
+    def test_get_extra_attrs(self):
+        self.addScores()
+        self.assertEquals('bat', self.store.get(1)[0].monster)
+
+    # == .page == #
+
+    def test_page(self):
+        self.addScores()
+        self.assertEquals(['bar', 'foo'], [s.user for s in self.store.page(2)])
+        self.assertEquals(['qux'], [s.user for s in self.store.page(2, 2)])
+        after = self.store[0].sort_key()
+        self.assertEquals(['foo'],
+                          [s.user for s in self.store.page(1, 0, after)])
+
+    def test_page_after_ties(self):
+        self.store.add(*[{'user': u, 'score': 10, 'level': lvl}
+                         for u in 'abc' for lvl in (1, 2)])
+        scores = list(self.store)
+        for i in range(len(scores) - 1):
+            self.assertEquals(scores[i + 1:i + 3],
+                              self.store.page(2, 0, scores[i].sort_key()))
+
+    def test_columns(self):
+        self.addScores()
+        columns = self.store.columns()
+        self.assertEquals(['bar', 'foo', 'qux'], [s.user for s in columns])
+        self.assertTrue(columns is self.store.columns())
+        self.store.add({'user': 'new', 'score': 1})
+        self.assertEquals(4, len(self.store.columns()))
+
+    def test_aggregates(self):
+        self.addScores()
+        aggregates = self.store.aggregates()
+        self.assertEquals({'foo': 1, 'bar': 1, 'qux': 1}, aggregates.users)
+        self.assertTrue(aggregates is self.store.aggregates())
+        self.store.add({'user': 'foo', 'score': 1})
+        self.assertEquals(2, self.store.aggregates().users['foo'])
+
+    def test_aggregates_other_connection(self):
+        self.addScores()
+        self.store.aggregates()
+        other = SQLiteScoresStore(self.path)
+        other.add({'user': 'new', 'score': 1})
+        self.assertEquals(1, self.store.aggregates().users['new'])
+
+    def test_iter_page(self):
+        self.addScores()
+        self.assertEquals(['foo', 'qux'],
+                          [s.user for s in self.store.iter_page(5, 1)])
+
+    # == .since == #
+
+    def test_since(self):
+        self.store.add({'user': 'foo', 'score': 2}, time=100)
+        self.store.add({'user': 'bar', 'score': 3}, {'user': 'qux', 'score': 1},
+                       time=200)
+        self.assertEquals(['bar', 'qux'],
+                          [s.user for s in self.store.since(150)])
+        self.assertEquals(['bar'], [s.user for s in self.store.since(150, 1)])
+        self.assertEquals(200, self.store.since(150)[0].time)
+
+    def test_since_uses_index(self):
+        plan = self.store._db.execute(
+            'EXPLAIN QUERY PLAN SELECT * FROM scores WHERE time >= ?',
+            (0,)).fetchall()
+        self.assertTrue('scores_time' in ' '.join(str(r) for r in plan))
+
+    def test_migrate_time(self):
+        del self.store
+        os.unlink(self.path)
+        db = sqlite3.connect(self.path)
+        db.executescript("""
+            CREATE TABLE scores (
+                level INTEGER NOT NULL DEFAULT 0,
+                score INTEGER NOT NULL DEFAULT 0,
+                user TEXT NOT NULL DEFAULT '',
+                cause TEXT NOT NULL DEFAULT '',
+                status TEXT NOT NULL DEFAULT '',
+                extra TEXT,
+                UNIQUE (level, score, user, cause, status));
+            INSERT INTO scores VALUES
+                (1, 2, 'foo', '', '', '{"time": 100}'),
+                (1, 3, 'bar', '', '', '{"time": 200, "monster": "bat"}'),
+                (1, 4, 'qux', '', '', NULL);
+        """)
+        db.commit()
+        db.close()
+        self.store = SQLiteScoresStore(self.path)
+        self.assertEquals(['bar'], [s.user for s in self.store.since(150)])
+        bar = self.store.since(150)[0]
+        self.assertEquals(200, bar.time)
+        self.assertEquals('bat', bar.monster)
+        self.store.add({'user': 'new', 'score': 1}, time=300)
+        self.assertEquals(['bar', 'new'],
+                          [s.user for s in self.store.since(150)])
+
+    # == .get_user == #
+
+    def test_get_user(self):
+        self.addScores()
+        self.store.add({'user': 'foo', 'score': 2, 'status': 'quit'})
+        self.assertEquals([17, 2],
+                          [s.score for s in self.store.get_user('foo')])
+        self.assertEquals([], self.store.get_user('nope'))
+
+    # == .rank == #
+
+    def test_rank(self):
+        self.addScores()
+        self.assertEquals([1, 2, 3], [self.store.rank(s) for s in self.store])
+
+    # == .__iter__ == #
+
+    def test_iter(self):
+        self.addScores()
+        self.assertEquals([18, 17, 3], [s.score for s in self.store])
+
+    # == .__getitem__ == #
+
+    def test_getitem(self):
+        self.addScores()
+        self.assertEquals('foo', self.store[1].user)
+        self.assertEquals('qux', self.store[-1].user)
+        self.assertRaises(IndexError, lambda: self.store[3])
+
+    # == .scores == #
+
+    def test_set_scores(self):
+        self.addScores()
+        self.store.scores = [Score(user='a', score=2)]
+        self.assertEquals([Score(user='a', score=2)], self.store.scores)
+
+    # == .json == #
+
+    def test_json(self):
+        self.addScores()
+        self.assertEquals(['bar', 'foo', 'qux'],
+                          [d['user'] for d in json.loads(self.store.json())])
+
+    def test_json_chunks(self):
+        self.addScores()
+        self.assertEquals(self.store.json(),
+                          ''.join(self.store.json_chunks(batch=2)))
+
+    # == stats == #
+
+    def test_stats(self):
+        self.addScores()
+        self.assertEquals('bat (1 kills)', stats(self.store)['best_killer'])
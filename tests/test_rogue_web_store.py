@@ -3,9 +3,18 @@
 import os
 import os.path
 import json
+import time
+import random
 import platform
 import tempfile
 import logging
+import threading
+import multiprocessing
+
+if platform.python_version() < '3.0':
+    from StringIO import StringIO
+else:
+    from io import StringIO
 
 if platform.python_version() < '2.7':
     import unittest2 as unittest
@@ -14,7 +23,10 @@ else:
 
 from rogue_scores.web import store
 from rogue_scores.web.store import parse_text, Score, ScoresStore, \
-    BadScoreFormatException
+    BadScoreFormatException, StringTable, ScoreColumns, iter_json, \
+    iter_ndjson, iter_scores, parse_texts, normalize_score, CommitQueue, TimeBuckets, \
+    WINDOWS, open_store
+from rogue_scores.web.binstore import BinaryScoresStore
 
 class TestRogueStoreHelpers(unittest.TestCase):
 
@@ -54,6 +66,108 @@ class TestRogueStoreHelpers(unittest.TestCase):
         # I don't know what the winning text looks like
         self.assertEquals({'status': 'won'}, parse_text('won ...'))
 
+    def test_parse_text_case_and_spaces(self):
+        self.assertEquals({'status': 'killed', 'cause': 'bat', 'level': 2},
+                          parse_text('  Killed on Level 2 by a Bat. \n'))
+
+    def test_parse_text_unknown(self):
+        self.assertEquals({}, parse_text('foo'))
+        self.assertEquals({'level': 3}, parse_text('foo on level 3'))
+        self.assertEquals({}, parse_text('killed'))
+
+    def test_parse_text_cached_copy(self):
+        d = parse_text('quit on level 4')
+        d['status'] = 'foo'
+        self.assertEquals({'status': 'quit', 'level': 4},
+                          parse_text('quit on level 4'))
+
+    # == .parse_texts == #
+
+    def test_parse_texts(self):
+        texts = ['quit on level 9', 'killed on level 1 by a hobgoblin.',
+                 'quit on level 9']
+        self.assertEquals([parse_text(t) for t in texts], parse_texts(texts))
+
+    def test_parse_texts_copies(self):
+        attrs = parse_texts(['quit on level 9', 'quit on level 9'])
+        attrs[0]['level'] = 3
+        self.assertEquals(9, attrs[1]['level'])
+
+    def test_parse_texts_empty(self):
+        self.assertEquals([], parse_texts([]))
+
+
+class TestRogueStoreStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.NamedTemporaryFile(delete=False, mode='w')
+        self.tmp.write(json.dumps([
+            {'user': 'foo', 'score': 42, 'level': 3},
+            {'user': 'bar', 'score': 17, 'level': 1},
+            {'user': 'qux', 'score': 2, 'level': 1},
+        ]))
+        self.tmp.close()
+
+    def tearDown(self):
+        os.unlink(self.tmp.name)
+
+    # == .iter_json == #
+
+    def iterJSON(self, data, chunk_size=1):
+        return list(iter_json(StringIO(data), chunk_size))
+
+    def test_iter_json_empty(self):
+        self.assertEquals([], self.iterJSON('[]'))
+        self.assertEquals([], self.iterJSON(' [\n ] '))
+
+    def test_iter_json(self):
+        data = '[{"a": [1, "],"]}, 123, "x", [4, {}], null]'
+        for chunk_size in (1, 2, 5, 1000):
+            self.assertEquals(json.loads(data),
+                              self.iterJSON(data, chunk_size))
+
+    def test_iter_json_not_an_array(self):
+        self.assertRaises(ValueError, lambda: self.iterJSON('{}'))
+        self.assertRaises(ValueError, lambda: self.iterJSON(''))
+
+    def test_iter_json_malformed(self):
+        self.assertRaises(ValueError, lambda: self.iterJSON('[1, 2'))
+        self.assertRaises(ValueError, lambda: self.iterJSON('[1, }'))
+
+    def test_iter_json_lazy(self):
+        it = iter_json(StringIO('[1, 2, }'), 1)
+        self.assertEquals(1, next(it))
+        self.assertEquals(2, next(it))
+        self.assertRaises(ValueError, lambda: next(it))
+
+    # == .iter_ndjson == #
+
+    def test_iter_ndjson(self):
+        self.assertEquals([{'a': 1}, [2], 'x'],
+                          list(iter_ndjson(StringIO('{"a": 1}\n\n [2]\n"x"'))))
+
+    def test_iter_ndjson_malformed(self):
+        it = iter_ndjson(StringIO('1\n{\n2'))
+        self.assertEquals(1, next(it))
+        self.assertRaises(ValueError, lambda: next(it))
+
+    # == .iter_scores == #
+
+    def test_iter_scores(self):
+        self.assertEquals(['foo', 'bar', 'qux'],
+                          [s.user for s in iter_scores(self.tmp.name)])
+
+    def test_iter_scores_limit(self):
+        self.assertEquals(['foo', 'bar'],
+                          [s.user for s in iter_scores(self.tmp.name, 2)])
+        self.assertEquals([], list(iter_scores(self.tmp.name, 0)))
+
+    def test_iter_scores_old_format(self):
+        with open(self.tmp.name, 'w') as f:
+            f.write(json.dumps([['user', 42, 'quit on level 1']]))
+        self.assertRaises(BadScoreFormatException,
+                          lambda: list(iter_scores(self.tmp.name)))
+
 
 class TestRogueScore(unittest.TestCase):
 
@@ -82,6 +196,34 @@ class TestRogueScore(unittest.TestCase):
         s = Score(user='foo', score=12, foobar=45)
         self.assertEquals(45, s.foobar)
 
+    # == slots == #
+
+    def test_no_instance_dict(self):
+        self.assertFalse(hasattr(self.s, '__weakref__'))
+        self.assertEquals(None, self.s.extra)
+
+    def test_extra_attrs(self):
+        s = Score(user='foo', monster='bat')
+        self.assertEquals({'monster': 'bat'}, s.extra)
+        s.foo = 42
+        self.assertEquals({'monster': 'bat', 'foo': 42}, s.extra)
+        self.assertEquals(42, s.foo)
+
+    def test_missing_attr(self):
+        self.assertRaises(AttributeError, lambda: self.s.foo)
+
+    def test_dict(self):
+        s = Score(user='foo', score=12, monster='bat')
+        self.assertEquals({'level': 0, 'score': 12, 'user': 'foo',
+                           'cause': None, 'status': None, 'monster': 'bat'},
+                          s.__dict__)
+
+    def test_set_dict(self):
+        self.s.__dict__ = {'user': 'foo', 'monster': 'bat'}
+        self.assertEquals('foo', self.s.user)
+        self.assertEquals(0, self.s.score)
+        self.assertEquals('bat', self.s.monster)
+
     # == .__int__ == #:
 
     def test_int_empty_score(self):
@@ -142,6 +284,34 @@ class TestRogueScore(unittest.TestCase):
         self.assertTrue(Score(score=3) <= Score(score=3))
         self.assertTrue(Score(score=3) <= Score(score=4))
 
+    # == time == #
+
+    def test_time(self):
+        self.assertEquals(None, Score().time)
+        self.assertFalse('time' in Score().__dict__)
+        s = Score(score=3, time=42)
+        self.assertEquals(42, s['time'])
+        self.assertEquals(42, s.__dict__['time'])
+        self.assertEquals(Score(score=3), s)
+
+    # == .key == #
+
+    def test_key(self):
+        s = Score(user='foo', score=2, level=3, status='quit')
+        self.assertEquals((3, 2, 'foo', None, 'quit'), s.key())
+
+    # == .sort_key == #
+
+    def test_sort_key_score_first(self):
+        self.assertTrue(Score(score=3, level=1).sort_key()
+                        < Score(score=2, level=9).sort_key())
+
+    def test_sort_key_ties(self):
+        self.assertTrue(Score(score=3, level=2).sort_key()
+                        < Score(score=3, level=1).sort_key())
+        self.assertTrue(Score(score=3, user='a').sort_key()
+                        < Score(score=3, user='b').sort_key())
+
     # == .__getitem__ == #
 
     def test_getitem(self):
@@ -149,12 +319,92 @@ class TestRogueScore(unittest.TestCase):
         self.s.foo = n
         self.assertEquals(n, self.s['foo'])
 
+    def test_getitem_field(self):
+        self.assertEquals(12, Score(score=12)['score'])
+
+    def test_getitem_missing(self):
+        self.assertRaises(KeyError, lambda: self.s['foo'])
+
     # == .__repr__ == #
 
     def test_repr_empty(self):
         self.assertEquals('Score(%s)' % str(self.s.__dict__), repr(self.s))
 
 
+class TestRogueStringTable(unittest.TestCase):
+
+    def test_none(self):
+        t = StringTable()
+        self.assertEquals(0, t.encode(None))
+        self.assertEquals(None, t.decode(0))
+
+    def test_encode(self):
+        t = StringTable()
+        self.assertEquals(1, t.encode('foo'))
+        self.assertEquals(2, t.encode('bar'))
+        self.assertEquals(1, t.encode('foo'))
+        self.assertEquals('bar', t.decode(2))
+        self.assertEquals(3, len(t))
+
+
+class TestRogueScoreColumns(unittest.TestCase):
+
+    def setUp(self):
+        self.scores = [
+            Score(user='foo', score=42, level=3, status='killed', cause='bat'),
+            Score(user='bar', score=17, level=1, status='quit'),
+            Score(user='foo', score=2, level=1, status='quit', monster='a'),
+        ]
+        self.cols = ScoreColumns(self.scores)
+
+    def test_len(self):
+        self.assertEquals(3, len(self.cols))
+        self.assertEquals(0, len(ScoreColumns()))
+
+    def test_getitem(self):
+        self.assertEquals(self.scores[1], self.cols[1])
+        self.assertEquals(self.scores[2], self.cols[-1])
+        self.assertRaises(IndexError, lambda: self.cols[3])
+
+    def test_getitem_slice(self):
+        self.assertEquals(self.scores[:2], self.cols[:2])
+        self.assertEquals([], self.cols[:-42])
+
+    def test_iter(self):
+        self.assertEquals(self.scores, list(self.cols))
+
+    def test_extra_attrs(self):
+        self.assertEquals('a', self.cols[2].monster)
+        self.assertEquals(None, self.cols[0].extra)
+
+    def test_strings_shared(self):
+        self.assertEquals(6, len(self.cols.strings))
+
+    def test_key(self):
+        self.assertEquals(self.scores[0].key(), self.cols.key(0))
+        self.assertEquals(self.scores[1].sort_key(), self.cols.sort_key(1))
+
+    def test_insert(self):
+        s = Score(user='qux', score=20)
+        self.cols.insert(1, s)
+        self.assertEquals(s, self.cols[1])
+        self.assertEquals(4, len(self.cols))
+
+    def test_insert_overflow(self):
+        s = Score(user='qux', score=2 ** 40, level=3)
+        self.assertRaises(OverflowError, self.cols.insert, 0, s)
+        self.assertEquals(self.scores, list(self.cols))
+
+    def test_delitem(self):
+        del self.cols[2]
+        self.assertEquals(self.scores[:2], list(self.cols))
+        self.assertEquals({}, self.cols.extras)
+
+    def test_column(self):
+        self.assertEquals([42, 17, 2], self.cols.column('score'))
+        self.assertEquals(['foo', 'bar', 'foo'], self.cols.column('user'))
+
+
 class TestRogueScoresStore(unittest.TestCase):
 
     def setUp(self):
@@ -177,8 +427,9 @@ class TestRogueScoresStore(unittest.TestCase):
             f.write(json.dumps(scs))
 
     def rmScores(self):
-        if os.path.isfile(self.scores):
-            os.unlink(self.scores)
+        for path in (self.scores, self.scores + '.lock'):
+            if os.path.isfile(path):
+                os.unlink(path)
 
     # == .__init__ == #
 
@@ -215,6 +466,39 @@ class TestRogueScoresStore(unittest.TestCase):
 
         self.assertEquals(json.dumps([s.__dict__]), self.store.json())
 
+    # == .json_chunks == #
+
+    def test_json_chunks(self):
+        for columnar in (False, True):
+            st = ScoresStore(columnar=columnar)
+            self.assertEquals(['[]'], list(st.json_chunks()))
+            st.add(*[{'user': 'a', 'score': i + 1, 'monster': 'x'}
+                     for i in range(10)], time=1)
+            for indent in (None, 2, 4):
+                for batch in (1, 3, 10, 20):
+                    chunks = list(st.json_chunks(indent, batch))
+                    self.assertEquals(st.json(indent=indent),
+                                      ''.join(chunks))
+            self.assertEquals(5, len(list(st.json_chunks(batch=3))))
+
+    def test_json_chunks_insertion(self):
+        self.store.add({'user': 'a', 'score': 2}, {'user': 'b', 'score': 1})
+        chunks = self.store.json_chunks(batch=1)
+        next(chunks)
+        self.store.add({'user': 'c', 'score': 3})
+        self.assertEquals(['a', 'b'],
+                          [d['user'] for d in json.loads(
+                              '[{"user": "a"}' + ''.join(chunks))])
+
+    def test_json_chunks_insertion_columnar(self):
+        st = ScoresStore(columnar=True)
+        st.add(*[{'user': 'a', 'score': i + 1} for i in range(6)])
+        chunks = st.json_chunks(batch=2)
+        first = next(chunks)
+        st.add({'user': 'b', 'score': 100}, {'user': 'c', 'score': 4})
+        scores = json.loads(first + ''.join(chunks))
+        self.assertEquals([6, 5, 4, 4, 3, 2, 1], [d['score'] for d in scores])
+
     # == ._load == #
 
     def test_load_scores_no_path(self):
@@ -229,6 +513,13 @@ class TestRogueScoresStore(unittest.TestCase):
         s = Score(user='user', score=42, level=1, status='killed', cause='foo')
         self.assertSequenceEqual([s], self.store.scores)
 
+    def test_load_scores_sorted(self):
+        s1 = Score(user='a', score=42, level=1, status='quit')
+        s2 = Score(user='b', score=43, level=1, status='quit')
+        self.setScores([s1.__dict__, s2.__dict__])
+        self.store._load()
+        self.assertSequenceEqual([s2, s1], self.store.scores)
+
     def test_load_scores(self):
         s = Score(user='user', score=42, level=1, status='killed', cause='foo')
         self.setScores([s.__dict__])
@@ -256,6 +547,303 @@ class TestRogueScoresStore(unittest.TestCase):
         self.assertTrue(os.path.isfile(self.scores))
         self.assertSequenceEqual([], self.getScores())
 
+    # == .is_stale == #
+
+    def test_is_stale_no_path(self):
+        self.assertFalse(ScoresStore().is_stale())
+
+    def test_is_stale_after_load(self):
+        self.assertFalse(self.store.is_stale())
+
+    def test_is_stale_after_save(self):
+        self.store.add({'user': 'foo', 'score': 42})
+        self.store.save()
+        self.assertFalse(self.store.is_stale())
+
+    def test_is_stale_modified_file(self):
+        other = ScoresStore(self.scores)
+        other.add({'user': 'foo', 'score': 42})
+        other.save()
+        self.assertTrue(self.store.is_stale())
+
+    # == .version == #
+
+    def test_version_no_path(self):
+        st = ScoresStore()
+        v = st.version
+        st.add({'user': 'foo', 'score': 42})
+        self.assertNotEquals(v, st.version)
+
+    def test_version_loaded_scores(self):
+        v = self.store.version
+        self.assertEquals(v, self.store.disk_version)
+        other = ScoresStore(self.scores)
+        other.add({'user': 'foo', 'score': 42})
+        other.save()
+        self.assertEquals(v, self.store.version)
+        self.assertEquals(other.version, self.store.disk_version)
+        self.store.reload()
+        self.assertEquals(other.version, self.store.version)
+
+    def test_version_unsaved(self):
+        v = self.store.version
+        self.store.add({'user': 'foo', 'score': 42})
+        self.assertNotEquals(v, self.store.version)
+        self.store.save()
+        self.assertEquals(self.store.disk_version, self.store.version)
+
+    # == .reload == #
+
+    def test_reload(self):
+        other = ScoresStore(self.scores)
+        other.add({'user': 'foo', 'score': 42})
+        other.save()
+        self.store.reload()
+        self.assertFalse(self.store.is_stale())
+        self.assertEquals(1, len(self.store))
+
+    def test_reload_removed_file(self):
+        self.store.add({'user': 'foo', 'score': 42})
+        self.rmScores()
+        self.store.reload()
+        self.assertEquals(0, len(self.store))
+        self.assertTrue(os.path.isfile(self.scores))
+
+    # == .lock == #
+
+    def test_lock_no_path(self):
+        with ScoresStore().lock():
+            pass
+
+    def test_lock_reentrant(self):
+        with self.store.lock():
+            with self.store.lock():
+                self.store.save()
+        self.assertTrue(os.path.isfile(self.scores + '.lock'))
+
+    def test_lock_threads(self):
+        acquired = threading.Event()
+
+        def lock():
+            with self.store.lock():
+                acquired.set()
+
+        with self.store.lock():
+            t = threading.Thread(target=lock)
+            t.start()
+            # the other thread must wait for this one to release the lock
+            self.assertFalse(acquired.wait(0.1))
+        t.join()
+        self.assertTrue(acquired.is_set())
+
+    # == .save == #
+
+    def test_save_merge_concurrent_writes(self):
+        other = ScoresStore(self.scores)
+        self.store.add({'user': 'foo', 'score': 42})
+        other.add({'user': 'bar', 'score': 17})
+        self.store.save()
+        other.save()
+        self.assertEquals(['foo', 'bar'],
+                          [d['user'] for d in self.getScores()])
+        self.assertEquals(2, len(other))
+
+    def test_save_merge_concurrent_writes_journal(self):
+        self.addCleanup(self.rmJournal)
+        st1 = ScoresStore(self.scores, journal=True)
+        st2 = ScoresStore(self.scores, journal=True)
+        st1.add({'user': 'foo', 'score': 42})
+        st2.add({'user': 'bar', 'score': 17})
+        st1.save()
+        st2.save()
+        self.assertEquals(2, len(self.getJournal()))
+        self.assertEquals(2, len(ScoresStore(self.scores, journal=True)))
+
+    def test_save_atomic_rename(self):
+        ino = os.stat(self.scores).st_ino
+        self.store.add({'user': 'foo', 'score': 42})
+        self.store.save()
+        self.assertNotEquals(ino, os.stat(self.scores).st_ino)
+        d = os.path.dirname(self.scores)
+        self.assertEquals([], [f for f in os.listdir(d)
+                               if f.startswith('.tmp-')])
+
+    # == journal == #
+
+    def mkJournalStore(self, **kwargs):
+        self.addCleanup(self.rmJournal)
+        return ScoresStore(self.scores, journal=True, **kwargs)
+
+    def rmJournal(self):
+        if os.path.isfile(self.scores + '.journal'):
+            os.unlink(self.scores + '.journal')
+
+    def getJournal(self):
+        with open(self.scores + '.journal') as f:
+            return [json.loads(l) for l in f]
+
+    def test_journal_path(self):
+        self.assertEquals(self.scores + '.journal', self.store.journal_path)
+        self.assertEquals(None, ScoresStore().journal_path)
+
+    def test_journal_save_appends(self):
+        st = self.mkJournalStore()
+        st.add({'user': 'foo', 'score': 42, 'level': 2, 'status': 'quit'})
+        st.save()
+        self.assertSequenceEqual([], self.getScores())
+        self.assertEquals(1, len(self.getJournal()))
+        st.add({'user': 'bar', 'score': 17, 'level': 1, 'status': 'quit'})
+        st.save()
+        self.assertEquals(['foo', 'bar'],
+                          [d['user'] for d in self.getJournal()])
+
+    def test_journal_replay(self):
+        st = self.mkJournalStore()
+        st.add({'user': 'foo', 'score': 17, 'level': 2, 'status': 'quit'},
+               {'user': 'bar', 'score': 42, 'level': 1, 'status': 'quit'})
+        st.save()
+        st2 = ScoresStore(self.scores, journal=True)
+        self.assertEquals(['bar', 'foo'], [sc.user for sc in st2])
+        self.assertTrue(st2.saved)
+
+    def test_journal_replay_truncated_line(self):
+        st = self.mkJournalStore()
+        st.add({'user': 'foo', 'score': 17, 'level': 2, 'status': 'quit'})
+        st.save()
+        with open(st.journal_path, 'a') as f:
+            f.write('{"user": "ba')
+        st2 = ScoresStore(self.scores, journal=True)
+        self.assertEquals(1, len(st2))
+
+    def test_journal_compaction(self):
+        st = self.mkJournalStore(compact_every=2)
+        st.add({'user': 'foo', 'score': 17, 'level': 2, 'status': 'quit'})
+        st.save()
+        st.add({'user': 'bar', 'score': 42, 'level': 1, 'status': 'quit'})
+        st.save()
+        self.assertFalse(os.path.isfile(st.journal_path))
+        self.assertEquals(['bar', 'foo'],
+                          [d['user'] for d in self.getScores()])
+
+    def test_journal_compact_after_reset(self):
+        st = self.mkJournalStore()
+        st.scores = [Score(user='foo', score=2)]
+        st.save()
+        self.assertFalse(os.path.isfile(st.journal_path))
+        self.assertEquals(1, len(self.getScores()))
+
+    # == columnar == #
+
+    def test_columnar_load(self):
+        s = Score(user='user', score=42, level=1, status='killed', cause='a')
+        self.setScores([s.__dict__])
+        st = ScoresStore(self.scores, columnar=True)
+        self.assertTrue(isinstance(st.scores, ScoreColumns))
+        self.assertEquals([s], list(st))
+
+    def test_columnar_add(self):
+        st = ScoresStore(columnar=True)
+        self.assertEquals(2, st.add(
+            {'user': 'foo', 'score': 17, 'status': 'quit', 'level': 19},
+            {'user': 'bar', 'score': 18, 'status': 'quit', 'level': 42}))
+        self.assertEquals(0, st.add(
+            {'user': 'foo', 'score': 17, 'status': 'quit', 'level': 19}))
+        self.assertEquals(1, st.add(
+            {'user': 'foo', 'score': 17, 'status': 'quit', 'level': 18}))
+        self.assertEquals([18, 17, 17], [sc.score for sc in st])
+        self.assertEquals(['bar', 'foo'], [sc.user for sc in st.get(2)])
+
+    def test_columnar_save(self):
+        st = ScoresStore(self.scores, columnar=True)
+        st.add({'user': 'foo', 'score': 17, 'status': 'quit', 'level': 19})
+        st.save()
+        self.assertEquals(['foo'], [d['user'] for d in self.getScores()])
+
+    def test_columnar_reload(self):
+        st = ScoresStore(self.scores, columnar=True)
+        st.reload()
+        self.assertTrue(isinstance(st.scores, ScoreColumns))
+
+    # == retention == #
+
+    def retained(self, scores, keep, keep_per_user):
+        """
+        Return the scores kept by a retention policy, computed naively
+        """
+        scores = sorted(dict((s.key(), s) for s in scores).values(),
+                        key=Score.sort_key)
+        kept = []
+        for i, s in enumerate(scores):
+            best = [s1 for s1 in scores if s1.user == s.user]
+            if i < (keep or 0) or best.index(s) < (keep_per_user or 0):
+                kept.append(s)
+        return kept
+
+    def randomScores(self, n):
+        rnd = random.Random(42)
+        return [Score(user=rnd.choice('abcde'), score=rnd.randint(1, 50),
+                      level=rnd.randint(1, 3), status='quit')
+                for _ in range(n)]
+
+    def test_keep(self):
+        st = ScoresStore(keep=2)
+        self.assertEquals(1, st.add({'user': 'a', 'score': 10}))
+        self.assertEquals(1, st.add({'user': 'b', 'score': 30}))
+        self.assertEquals(1, st.add({'user': 'c', 'score': 20}))
+        self.assertEquals([30, 20], [s.score for s in st])
+        self.assertEquals(0, st.add({'user': 'd', 'score': 5}))
+        self.assertEquals(2, len(st))
+
+    def test_keep_per_user(self):
+        st = ScoresStore(keep=1, keep_per_user=1)
+        st.add({'user': 'a', 'score': 30}, {'user': 'a', 'score': 20},
+               {'user': 'b', 'score': 10})
+        self.assertEquals([('a', 30), ('b', 10)],
+                          [(s.user, s.score) for s in st])
+        st.add({'user': 'b', 'score': 40})
+        self.assertEquals([('b', 40), ('a', 30)],
+                          [(s.user, s.score) for s in st])
+
+    def test_keep_per_user_only(self):
+        st = ScoresStore(keep_per_user=2)
+        for i in range(5):
+            st.add({'user': 'a', 'score': i + 1}, {'user': 'b', 'score': 1})
+        self.assertEquals([5, 4, 1], [s.score for s in st])
+
+    def test_keep_incremental(self):
+        scores = self.randomScores(300)
+        for columnar in (False, True):
+            st = ScoresStore(keep=20, keep_per_user=3, columnar=columnar)
+            for s in scores:
+                st.add(s.__dict__)
+            self.assertEquals(self.retained(scores, 20, 3), list(st))
+
+    def test_keep_bulk(self):
+        scores = self.randomScores(300)
+        st = ScoresStore(keep=20, keep_per_user=3)
+        st.add(*[s.__dict__ for s in scores[:100]])
+        st.add(*[s.__dict__ for s in scores[100:]])
+        self.assertEquals(self.retained(scores, 20, 3), list(st))
+
+    def test_keep_bulk_count(self):
+        st = ScoresStore(keep=5)
+        scs = [{'user': 'a', 'score': i + 1} for i in range(20)]
+        self.assertEquals(5, st.add(*scs))
+
+    def test_keep_load(self):
+        scores = self.retained(self.randomScores(100), None, 100)
+        self.setScores([s.__dict__ for s in scores])
+        st = ScoresStore(self.scores, keep=10, keep_per_user=1)
+        self.assertEquals(self.retained(scores, 10, 1), list(st))
+        st.save()
+        self.assertEquals(len(st), len(self.getScores()))
+
+    def test_keep_set_scores(self):
+        st = ScoresStore(keep=1)
+        st.scores = [Score(user='a', score=3), Score(user='a', score=2)]
+        st.add({'user': 'b', 'score': 4})
+        self.assertEquals([4], [s.score for s in st])
+
     # == ._insert == #
 
     def test_insert_empty_scores(self):
@@ -296,6 +884,19 @@ class TestRogueScoresStore(unittest.TestCase):
         self.assertEquals(s, self.store.scores[1])
         self.assertFalse(self.store.saved)
 
+    def test_insert_tie(self):
+        self.store.scores = [Score(score=20, level=3), Score(score=20, level=1)]
+        s = Score(user='foo', score=20, level=2)
+        self.assertTrue(self.store._insert(s))
+        self.assertEquals(s, self.store.scores[1])
+
+    def test_insert_no_duplicate_after_reset(self):
+        self.store._insert(Score(user='foo', score=42))
+        self.store.scores = [Score(user='bar', score=12)]
+        self.assertFalse(self.store._insert(Score(user='bar', score=12)))
+        self.assertTrue(self.store._insert(Score(user='foo', score=42)))
+        self.assertEquals(2, len(self.store.scores))
+
     # == ._add == #
 
     def test_internal_add_empty(self):
@@ -337,6 +938,17 @@ class TestRogueScoresStore(unittest.TestCase):
         self.assertEquals(14, s.level)
         self.assertEquals('bar', s.cause)
 
+    def test_add_too_big(self):
+        for columnar in (False, True):
+            st = ScoresStore(columnar=columnar)
+            st.add({'user': 'a', 'score': 10, 'level': 1})
+            self.assertEquals(0, st.add({'user': 'b', 'score': 2 ** 40,
+                                         'level': 3}))
+            self.assertEquals(0, st.add({'user': 'b', 'score': 1,
+                                         'level': 2 ** 31}))
+            self.assertEquals([('a', 10, 1)],
+                              [(s.user, s.score, s.level) for s in st])
+
     def test_internal_add_sanitize_attrs(self):
         d = {'score': '0012', 'user': '**yo**!', 'level': '42', 'cause': 'q$'}
         self.assertTrue(self.store._add(d))
@@ -381,6 +993,76 @@ class TestRogueScoresStore(unittest.TestCase):
             {'user': 'bar', 'score': 18, 'status': 'quit', 'level': 42}
         ))
 
+    def mkScores(self, n, user='foo'):
+        return [{'user': user, 'score': i + 1, 'level': i % 26,
+                 'status': 'quit'} for i in range(n)]
+
+    def test_add_bulk(self):
+        scs = self.mkScores(40)
+        self.assertEquals(40, self.store.add(*scs))
+        self.assertEquals(list(range(40, 0, -1)),
+                          [sc.score for sc in self.store])
+
+    def test_add_bulk_merge(self):
+        self.store.add({'user': 'bar', 'score': 20, 'level': 30},
+                       {'user': 'bar', 'score': 100, 'level': 1})
+        self.assertEquals(40, self.store.add(*self.mkScores(40)))
+        scs = [sc.score for sc in self.store]
+        self.assertEquals(42, len(scs))
+        self.assertEquals(sorted(scs, reverse=True), scs)
+        self.assertEquals(100, scs[0])
+        # ties are sorted by level
+        self.assertEquals(['bar', 'foo'],
+                          [sc.user for sc in self.store if sc.score == 20])
+
+    def test_add_bulk_duplicates(self):
+        scs = self.mkScores(20)
+        self.store.add(*scs[:5])
+        self.assertEquals(15, self.store.add(*(scs + scs)))
+        self.assertEquals(20, len(self.store))
+        self.assertEquals(0, self.store.add(*scs))
+
+    def test_add_bulk_sanitize(self):
+        scs = self.mkScores(20) + [{'user': '', 'score': 1}, ['a', 0, 'quit']]
+        self.assertEquals(20, self.store.add(*scs))
+
+    def test_add_bulk_wrong_format(self):
+        scs = self.mkScores(20) + [42]
+        self.assertRaises(BadScoreFormatException,
+                          lambda: self.store.add(*scs))
+
+    def test_add_bulk_saved(self):
+        self.store.add(*self.mkScores(20))
+        self.assertFalse(self.store.saved)
+        self.store.save()
+        self.assertEquals(20, len(self.getScores()))
+
+    def test_add_bulk_columnar(self):
+        st = ScoresStore(columnar=True)
+        st.add({'user': 'bar', 'score': 20, 'level': 30, 'monster': 'bat'})
+        self.assertEquals(40, st.add(*(self.mkScores(40) * 2)))
+        self.assertEquals(0, st.add(*self.mkScores(40)))
+        scs = list(st)
+        self.assertEquals(41, len(scs))
+        self.assertEquals([sc.sort_key() for sc in scs],
+                          sorted(sc.sort_key() for sc in scs))
+        self.assertEquals('bat', scs[20].monster)
+
+    def test_load_scores_old_format_bulk(self):
+        self.setScores([['user', i + 1, 'quit on level 1'] for i in range(50)])
+        self.store._load()
+        self.assertEquals(50, len(self.store))
+        self.assertEquals(50, len(self.getScores()))
+
+    def test_load_scores_old_format_no_time(self):
+        for n in (2, 50):
+            self.setScores([['user', i + 1, 'quit on level 1']
+                            for i in range(n)])
+            self.store._load()
+            self.assertEquals([None] * n, [s.time for s in self.store])
+            self.assertEquals([], self.store.since(time.time() - 3600))
+            self.assertFalse(any('time' in s for s in self.getScores()))
+
     # == .get == #
 
     def test_get_neg(self):
@@ -399,6 +1081,120 @@ class TestRogueScoresStore(unittest.TestCase):
         self.store.scores = [1, 2, 3]
         self.assertSequenceEqual([1, 2], self.store.get(2))
 
+    # == .since == #
+
+    def test_add_sets_time(self):
+        st = ScoresStore()
+        before = int(time.time())
+        st.add({'user': 'a', 'score': 10, 'time': 1})
+        self.assertTrue(st[0].time >= before)
+        st.add({'user': 'a', 'score': 20}, time=1234)
+        self.assertEquals(1234, st[0].time)
+
+    def test_time_saved(self):
+        self.store.add({'user': 'a', 'score': 10}, time=1234)
+        self.store.save()
+        self.assertEquals(1234, self.getScores()[0]['time'])
+        for columnar in (False, True):
+            st = ScoresStore(self.scores, columnar=columnar)
+            self.assertEquals(1234, st[0].time)
+
+    def test_since(self):
+        now = int(time.time())
+        for columnar in (False, True):
+            st = ScoresStore(columnar=columnar)
+            st.add({'user': 'a', 'score': 10}, time=now - 3 * 24 * 3600)
+            st.since(now)
+            st.add({'user': 'b', 'score': 5}, {'user': 'c', 'score': 7},
+                   time=now - 60)
+            st.add({'user': 'd', 'score': 1}, time=now - 400 * 24 * 3600)
+            self.assertEquals(['c', 'b'], [s.user for s in
+                                           st.since(now - WINDOWS['day'])])
+            self.assertEquals(['c'], [s.user for s in
+                                      st.since(now - WINDOWS['day'], 1)])
+            self.assertEquals(['a', 'c', 'b'],
+                              [s.user for s in
+                               st.since(now - WINDOWS['week'])])
+            # not in the buckets
+            self.assertEquals(['a', 'c', 'b', 'd'],
+                              [s.user for s in st.since(0)])
+
+    def test_since_retention(self):
+        st = ScoresStore(keep=1)
+        st.since(0)
+        st.add({'user': 'a', 'score': 10})
+        st.add({'user': 'b', 'score': 20})
+        self.assertEquals(['b'], [s.user for s in st.since(time.time() - 60)])
+
+    # == .page == #
+
+    def test_page(self):
+        for columnar in (False, True):
+            st = ScoresStore(columnar=columnar)
+            st.add(*[{'user': 'a', 'score': i + 1} for i in range(10)])
+            self.assertEquals([10, 9, 8], [s.score for s in st.page(3)])
+            self.assertEquals([7, 6], [s.score for s in st.page(2, 3)])
+            after = st[2].sort_key()
+            self.assertEquals([7, 6], [s.score for s in st.page(2, 0, after)])
+            self.assertEquals([6], [s.score for s in st.page(1, 1, after)])
+            self.assertEquals([], st.page(2, 20))
+
+    def test_iter_page(self):
+        for columnar in (False, True):
+            st = ScoresStore(columnar=columnar)
+            st.add(*[{'user': 'a', 'score': i + 1} for i in range(10)])
+            self.assertEquals([10, 9, 8], [s.score for s in st.iter_page(3)])
+            self.assertEquals([2, 1], [s.score for s in st.iter_page(5, 8)])
+            self.assertEquals([], list(st.iter_page(2, 20)))
+
+    def test_page_after_removed_score(self):
+        st = ScoresStore()
+        st.add({'user': 'a', 'score': 10}, {'user': 'a', 'score': 5})
+        after = Score(user='b', score=7).sort_key()
+        self.assertEquals([5], [s.score for s in st.page(10, 0, after)])
+
+    # == .get_user == #
+
+    def test_get_user(self):
+        st = ScoresStore()
+        st.add({'user': 'a', 'score': 10}, {'user': 'b', 'score': 30},
+               {'user': 'a', 'score': 20})
+        self.assertEquals([20, 10], [s.score for s in st.get_user('a')])
+        self.assertEquals([], st.get_user('c'))
+        st.add({'user': 'a', 'score': 15})
+        self.assertEquals([20, 15, 10], [s.score for s in st.get_user('a')])
+
+    def test_get_user_bulk_and_columnar(self):
+        for columnar in (False, True):
+            st = ScoresStore(columnar=columnar)
+            st.get_user('a')
+            st.add(*[{'user': 'ab'[i % 2], 'score': i + 1}
+                     for i in range(40)])
+            self.assertEquals(list(range(39, 0, -2)),
+                              [s.score for s in st.get_user('a')])
+
+    def test_get_user_retention(self):
+        st = ScoresStore(keep=1, keep_per_user=1)
+        st.add({'user': 'a', 'score': 10})
+        st.get_user('a')
+        st.add({'user': 'a', 'score': 20}, {'user': 'b', 'score': 5})
+        self.assertEquals([20], [s.score for s in st.get_user('a')])
+        self.assertEquals([5], [s.score for s in st.get_user('b')])
+
+    def test_get_user_reload(self):
+        self.store.add({'user': 'a', 'score': 10})
+        self.store.get_user('a')
+        self.store.reload()
+        self.assertEquals([], self.store.get_user('a'))
+
+    # == .rank == #
+
+    def test_rank(self):
+        st = ScoresStore()
+        st.add({'user': 'a', 'score': 10}, {'user': 'b', 'score': 30})
+        self.assertEquals(1, st.rank(st.get_user('b')[0]))
+        self.assertEquals(2, st.rank(st.get_user('a')[0]))
+
     # == .__iter__ == #
 
     def test_iter(self):
@@ -474,3 +1270,146 @@ class TestRogueScoresStore(unittest.TestCase):
 
     def test_repr_empty(self):
         self.assertEquals('ScoresStore([])', repr(ScoresStore()))
+
+
+def upload_scores(path, user, count):
+    """
+    Add and save scores one by one, as a Web worker would do
+    """
+    for i in range(count):
+        st = open_store(path)
+        st.add({'user': user, 'score': i + 1, 'level': 1, 'status': 'quit'})
+        st.save()
+
+
+class TestRogueScoresStoreConcurrency(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'scores.json')
+        ScoresStore(self.path)
+
+    def tearDown(self):
+        for name in os.listdir(self.dir):
+            os.unlink(os.path.join(self.dir, name))
+        os.rmdir(self.dir)
+
+    def test_concurrent_processes(self):
+        procs = [multiprocessing.Process(target=upload_scores,
+                                         args=(self.path, 'user%d' % i, 20))
+                 for i in range(4)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        self.assertEquals(80, len(ScoresStore(self.path)))
+
+    def test_concurrent_processes_binary(self):
+        path = os.path.join(self.dir, 'scores.bin')
+        BinaryScoresStore(path)
+        procs = [multiprocessing.Process(target=upload_scores,
+                                         args=(path, 'user%d' % i, 20))
+                 for i in range(4)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        self.assertEquals(80, len(BinaryScoresStore(path)))
+
+    def test_interleaved_saves(self):
+        paths = [self.path, os.path.join(self.dir, 'scores.bin')]
+        for path in paths:
+            for kwargs in ({}, {'keep_per_user': 1}):
+                st = open_store(path)
+                st.add({'user': 'x', 'score': 1}, {'user': 'x', 'score': 2})
+                st.save()
+                # with keep_per_user, both stores drop a score when loading
+                a = open_store(path, **kwargs)
+                b = open_store(path, **kwargs)
+                a.add({'user': 'a', 'score': 30})
+                b.add({'user': 'b', 'score': 40})
+                a.save()
+                b.save()
+                expected = [40, 30, 2] if kwargs else [40, 30, 2, 1]
+                self.assertEquals(expected,
+                                  [s.score for s in open_store(path)])
+                os.unlink(path)
+
+    def test_concurrent_threads_commit_queue(self):
+        store = ScoresStore(self.path)
+
+        def commit(scores):
+            ct = store.add(*scores)
+            store.save()
+            return ct
+
+        q = CommitQueue(commit, window=0.05)
+        threads = [threading.Thread(target=q.submit, args=([
+            {'user': 'user%d' % i, 'score': j + 1} for j in range(5)],))
+            for i in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEquals(50, len(ScoresStore(self.path)))
+        self.assertTrue(q.commits < 10)
+
+
+class TestRogueTimeBuckets(unittest.TestCase):
+
+    def test_find(self):
+        tb = TimeBuckets(span=100, width=10)
+        tb.add(5, 'a')
+        tb.add(15, 'b')
+        tb.add(17, 'c')
+        tb.add(None, 'd')
+        self.assertEquals(['a', 'b', 'c'], tb.find(0, 20))
+        self.assertEquals(['c'], tb.find(16, 20))
+
+    def test_expired_buckets(self):
+        tb = TimeBuckets(span=100, width=10)
+        tb.add(5, 'a')
+        tb.add(115, 'b')
+        # too old
+        tb.add(6, 'c')
+        self.assertEquals(['b'], tb.find(20, 120))
+        self.assertFalse(tb.covers(0, 120))
+        self.assertTrue(tb.covers(20, 120))
+
+
+class TestRogueCommitQueue(unittest.TestCase):
+
+    def test_submit_returns_result(self):
+        q = CommitQueue(len, window=0)
+        self.assertEquals(2, q.submit([1, 2]))
+        self.assertEquals(1, q.commits)
+
+    def test_submit_alone_no_wait(self):
+        q = CommitQueue(len, window=10)
+        start = time.time()
+        self.assertEquals(1, q.submit([1]))
+        self.assertTrue(time.time() - start < 5)
+
+    def test_submit_error(self):
+        def commit(scores):
+            raise ValueError()
+        q = CommitQueue(commit, window=0)
+        self.assertRaises(ValueError, lambda: q.submit([1]))
+        # the next group can still be committed
+        q.commit = len
+        self.assertEquals(1, q.submit([1]))
+
+
+class TestRogueNormalizeScore(unittest.TestCase):
+
+    def test_dict(self):
+        d = {'user': 'foo'}
+        self.assertEquals(d, normalize_score(d))
+
+    def test_tuple(self):
+        self.assertEquals({'user': 'foo', 'score': 2, 'text': 'quit'},
+                          normalize_score(('foo', 2, 'quit')))
+
+    def test_wrong_format(self):
+        self.assertRaises(BadScoreFormatException,
+                          lambda: normalize_score(42))